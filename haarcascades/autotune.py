@@ -0,0 +1,300 @@
+import cv2
+import os
+import json
+import time
+import argparse
+import numpy as np
+from box_utils import iou
+from face_detector import FaceDetector
+from detector_profiles import PROFILES_FILE, save_profile
+
+# detectMultiScale gộp các khung ứng viên bằng groupRectangles với eps này
+GROUP_EPS = 0.2
+
+
+def load_annotations(path, images_dir=None):
+    """
+    Đọc tập ảnh có gán nhãn khung khuôn mặt
+
+    Định dạng JSON, một trong hai dạng:
+        {"anh1.jpg": [[x, y, w, h], ...], ...}
+        [{"image": "anh1.jpg", "boxes": [[x, y, w, h], ...]}, ...]
+    Ảnh không có khuôn mặt có danh sách khung rỗng (dùng để đo báo nhầm).
+
+    Args:
+        path: File JSON
+        images_dir: Thư mục gốc của các đường dẫn tương đối (mặc định: thư mục của file JSON)
+
+    Returns:
+        list: Các (đường dẫn ảnh, mảng khung Nx4)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [{"image": image, "boxes": boxes} for image, boxes in data.items()]
+    images_dir = images_dir or os.path.dirname(os.path.abspath(path))
+    samples = []
+    for item in data:
+        image_path = item["image"]
+        if not os.path.isabs(image_path):
+            image_path = os.path.join(images_dir, image_path)
+        samples.append((image_path, np.asarray(item.get("boxes", []), dtype=np.int32).reshape(-1, 4)))
+    return samples
+
+
+def count_matches(detections, truths, iou_threshold=0.5):
+    """Số khung gán nhãn được phát hiện đúng (ghép tham lam theo IoU giảm dần, mỗi khung dùng một lần)"""
+    pairs = sorted(((iou(d, t), i, j) for i, d in enumerate(detections) for j, t in enumerate(truths)),
+                   reverse=True)
+    used_d, used_t = set(), set()
+    for overlap, i, j in pairs:
+        if overlap < iou_threshold:
+            break
+        if i not in used_d and j not in used_t:
+            used_d.add(i)
+            used_t.add(j)
+    return len(used_t)
+
+
+def _scores(true_positives, detections, truths, elapsed, images):
+    recall = true_positives / float(truths) if truths else 1.0
+    precision = true_positives / float(detections) if detections else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"recall": round(recall, 4), "precision": round(precision, 4), "f1": round(f1, 4),
+            "ms_per_image": round(elapsed * 1000.0 / images, 3), "detections": detections,
+            "true_positives": true_positives}
+
+
+def load_samples(annotations):
+    """Đọc ảnh xám của tập gán nhãn, bỏ qua (và báo) ảnh không đọc được"""
+    samples = []
+    for image_path, boxes in annotations:
+        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            print(f"Bỏ qua ảnh không đọc được: {image_path}")
+            continue
+        samples.append((gray, boxes))
+    return samples
+
+
+def configure(detector, options):
+    """Đặt tham số cho FaceDetector đã nạp cascade (không phải nạp lại file XML cho mỗi bộ tham số)"""
+    detector.scale_factor = options.get("scale_factor", 1.1)
+    detector.min_neighbors = options.get("min_neighbors", 5)
+    detector.min_size = tuple(options.get("min_size", (30, 30)))
+    detector.detection_scale = options.get("detection_scale")
+    detector.max_detection_side = options.get("max_detection_side")
+    return detector
+
+
+def evaluate(detector, samples, options, iou_threshold=0.5, repeat=1):
+    """
+    Đo một bộ tham số bằng chính FaceDetector.detect_gray
+
+    Returns:
+        dict: Tham số và recall, precision, f1, ms_per_image
+    """
+    configure(detector, options)
+    elapsed = 0.0
+    true_positives = detections = 0
+    for gray, boxes in samples:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            faces = detector.detect_gray(gray)
+        elapsed += (time.perf_counter() - start) / repeat
+        faces = np.asarray(faces).reshape(-1, 4)
+        detections += len(faces)
+        true_positives += count_matches(faces, boxes, iou_threshold)
+    truths = sum(len(boxes) for _, boxes in samples)
+    return dict(options, **_scores(true_positives, detections, truths, elapsed, len(samples)))
+
+
+def search(detector, samples, scale_factors, min_neighbors, min_sizes, max_sides,
+           iou_threshold=0.5, repeat=1):
+    """
+    Đo mọi tổ hợp tham số trong lưới
+
+    Với mỗi (scale_factor, min_size, max_detection_side) cascade chỉ chạy một lần
+    với minNeighbors=0 để lấy các khung ứng viên chưa gộp; kết quả của từng
+    min_neighbors là groupRectangles(ứng viên, min_neighbors, 0.2), đúng như
+    detectMultiScale làm bên trong. Thời gian của cascade hầu như không phụ thuộc
+    min_neighbors nên được dùng chung cho các giá trị này.
+
+    Args:
+        detector: FaceDetector đã nạp cascade (tham số được đặt lại cho từng tổ hợp)
+        samples: Các (ảnh xám, khung gán nhãn) từ load_samples()
+        scale_factors, min_neighbors, min_sizes, max_sides: Các giá trị cần thử (max_side 0: không thu nhỏ)
+        iou_threshold: IoU tối thiểu để khung phát hiện được tính là đúng
+        repeat: Số lần chạy mỗi ảnh khi đo thời gian
+
+    Returns:
+        list: Kết quả (dict tham số và số liệu) của từng tổ hợp
+    """
+    truths = sum(len(boxes) for _, boxes in samples)
+    results = []
+    combos = [(sf, ms, side) for sf in scale_factors for ms in min_sizes for side in max_sides]
+    for index, (scale_factor, min_size, max_side) in enumerate(combos, 1):
+        options = {"scale_factor": scale_factor, "min_size": (min_size, min_size),
+                   "max_detection_side": max_side or None}
+        configure(detector, dict(options, min_neighbors=0))
+        elapsed = 0.0
+        candidates = []
+        for gray, _ in samples:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                raw = detector.detect_gray(gray)
+            elapsed += (time.perf_counter() - start) / repeat
+            candidates.append([[int(v) for v in box] for box in np.asarray(raw).reshape(-1, 4)])
+
+        for neighbors in min_neighbors:
+            true_positives = detections = 0
+            for (gray, boxes), raw in zip(samples, candidates):
+                if neighbors > 0:
+                    grouped, _ = cv2.groupRectangles(raw, neighbors, GROUP_EPS)
+                else:
+                    grouped = raw
+                grouped = np.asarray(grouped).reshape(-1, 4)
+                detections += len(grouped)
+                true_positives += count_matches(grouped, boxes, iou_threshold)
+            results.append(dict(options, min_neighbors=neighbors,
+                                **_scores(true_positives, detections, truths, elapsed, len(samples))))
+        print(f"[{index}/{len(combos)}] scale_factor={scale_factor} min_size={min_size} "
+              f"max_side={max_side or '-'}: {elapsed * 1000.0 / len(samples):.1f} ms/ảnh")
+    return results
+
+
+def pareto_front(results, min_precision=0.0):
+    """
+    Các bộ tham số không bị bộ nào khác vừa nhanh hơn vừa có recall cao hơn
+
+    Args:
+        results: Kết quả từ search()/evaluate()
+        min_precision: Bỏ các bộ tham số có precision thấp hơn (quá nhiều báo nhầm)
+
+    Returns:
+        list: Các kết quả trên biên Pareto, tăng dần theo thời gian (và recall)
+    """
+    candidates = [r for r in results if r["precision"] >= min_precision]
+    candidates.sort(key=lambda r: (r["ms_per_image"], -r["recall"], -r["precision"]))
+    front = []
+    for result in candidates:
+        if not front or result["recall"] > front[-1]["recall"]:
+            front.append(result)
+    return front
+
+
+def choose(front, min_recall):
+    """Bộ tham số nhanh nhất trên biên Pareto có recall >= min_recall (hoặc bộ có recall cao nhất)"""
+    for result in front:
+        if result["recall"] >= min_recall:
+            return result
+    return front[-1] if front else None
+
+
+def _float_list(value):
+    return [float(v) for v in value.split(',') if v.strip()]
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def _profile_spec(value):
+    name, _, min_recall = value.partition(':')
+    if not name:
+        raise argparse.ArgumentTypeError("Cần dạng TÊN:RECALL_TỐI_THIỂU, vd: kiosk-fast:0.85")
+    return name, float(min_recall) if min_recall else 1.0
+
+
+def main():
+    # Đường dẫn thư mục chứa file này
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    results_dir = os.path.join(os.path.dirname(current_dir), "results")
+
+    parser = argparse.ArgumentParser(
+        description='Tìm tham số Haar Cascade cân bằng tốc độ và recall trên tập ảnh có gán nhãn')
+    parser.add_argument('--annotations', required=True,
+                        help='File JSON: {"ảnh.jpg": [[x, y, w, h], ...]} (đường dẫn tương đối theo --images-dir)')
+    parser.add_argument('--images-dir', help='Thư mục ảnh (mặc định: thư mục của file gán nhãn)')
+    parser.add_argument('--cascade', default='haarcascade_frontalface_default.xml',
+                        help='Tên file cascade trong thư mục haarcascades')
+    parser.add_argument('--scale-factors', type=_float_list, default=[1.05, 1.1, 1.15, 1.2, 1.3],
+                        help='Các giá trị scaleFactor cần thử')
+    parser.add_argument('--min-neighbors', type=_int_list, default=[2, 3, 4, 5, 6, 8],
+                        help='Các giá trị minNeighbors cần thử')
+    parser.add_argument('--min-sizes', type=_int_list, default=[20, 30, 40, 60, 80],
+                        help='Các giá trị minSize (pixel, theo ảnh gốc) cần thử')
+    parser.add_argument('--max-sides', type=_int_list, default=[0, 1280, 960, 640],
+                        help='Các giá trị cạnh dài tối đa của ảnh phát hiện (0: không thu nhỏ)')
+    parser.add_argument('--iou', type=float, default=0.5,
+                        help='IoU tối thiểu để một khung phát hiện được tính là đúng (mặc định: 0.5)')
+    parser.add_argument('--min-precision', type=float, default=0.5,
+                        help='Bỏ các bộ tham số có precision thấp hơn giá trị này (mặc định: 0.5)')
+    parser.add_argument('--repeat', type=int, default=1, help='Số lần chạy mỗi ảnh khi đo thời gian')
+    parser.add_argument('--save', type=_profile_spec, action='append', default=[], metavar='TÊN:RECALL',
+                        help='Lưu bộ tham số nhanh nhất đạt recall tối thiểu thành profile, '
+                             'vd: --save kiosk-fast:0.85 --save archive-accurate:1.0')
+    parser.add_argument('--profiles-file', default=PROFILES_FILE, help='File lưu profile')
+    parser.add_argument('--output', default=os.path.join(results_dir, 'autotune.json'),
+                        help='File JSON ghi toàn bộ kết quả')
+
+    args = parser.parse_args()
+
+    cascade_path = os.path.join(current_dir, args.cascade)
+    if not os.path.isfile(cascade_path):
+        print(f"Lỗi: Không tìm thấy file cascade '{cascade_path}'")
+        return
+    if not os.path.isfile(args.annotations):
+        print(f"Lỗi: Không tìm thấy file gán nhãn '{args.annotations}'")
+        return
+
+    samples = load_samples(load_annotations(args.annotations, args.images_dir))
+    if not samples:
+        print("Không có ảnh nào để đánh giá")
+        return
+    truths = sum(len(boxes) for _, boxes in samples)
+    print(f"Tập đánh giá: {len(samples)} ảnh, {truths} khuôn mặt")
+
+    # Đo trên một luồng để thời gian ổn định giữa các lần chạy
+    cv2.setNumThreads(1)
+    detector = FaceDetector(cascade_path)
+    results = search(detector, samples, args.scale_factors, args.min_neighbors, args.min_sizes,
+                     args.max_sides, args.iou, args.repeat)
+
+    # Đo lại các điểm trên biên Pareto bằng FaceDetector thật để số liệu lưu vào profile là chính xác
+    front = pareto_front(results, args.min_precision)
+    options_keys = ("scale_factor", "min_neighbors", "min_size", "max_detection_side")
+    front = pareto_front([evaluate(detector, samples, {key: r[key] for key in options_keys},
+                                   args.iou, max(1, args.repeat))
+                          for r in front], args.min_precision)
+
+    print(f"\nBiên Pareto tốc độ/recall ({len(front)} bộ tham số, precision >= {args.min_precision}):")
+    print(f"{'ms/ảnh':>8} {'recall':>7} {'prec.':>7}  tham số")
+    for r in front:
+        print(f"{r['ms_per_image']:>8.1f} {r['recall']:>7.3f} {r['precision']:>7.3f}  "
+              f"scale_factor={r['scale_factor']} min_neighbors={r['min_neighbors']} "
+              f"min_size={r['min_size'][0]} max_side={r['max_detection_side'] or '-'}")
+
+    for name, min_recall in args.save:
+        chosen = choose(front, min_recall)
+        if chosen is None:
+            print(f"Không có bộ tham số nào cho profile '{name}'")
+            continue
+        if chosen["recall"] < min_recall:
+            print(f"Cảnh báo: không bộ tham số nào đạt recall {min_recall}; '{name}' dùng bộ có recall cao nhất")
+        measured = {key: chosen[key] for key in ("recall", "precision", "ms_per_image")}
+        measured.update({"images": len(samples), "faces": truths, "cascade": args.cascade,
+                         "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S")})
+        save_profile(name, {key: chosen[key] for key in options_keys}, measured, args.profiles_file)
+        print(f"Đã lưu profile '{name}': {chosen['ms_per_image']:.1f} ms/ảnh, recall {chosen['recall']:.3f}, "
+              f"precision {chosen['precision']:.3f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({"images": len(samples), "faces": truths, "front": front, "results": results},
+                  f, ensure_ascii=False, indent=2, default=list)
+    print(f"Đã lưu kết quả tại '{args.output}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+import cv2
+import os
+import glob
+import json
+import time
+from multiprocessing import Pool
+
+# Các phần mở rộng ảnh được xử lý khi không chỉ định --glob
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# Bộ xử lý của từng tiến trình con (mỗi worker chỉ nạp cascade/mô hình một lần)
+_worker_processor = None
+_worker_options = None
+
+
+def collect_images(input_dir, pattern=None):
+    """
+    Thu thập danh sách ảnh cần xử lý
+
+    Args:
+        input_dir: Thư mục chứa ảnh
+        pattern: Mẫu glob tương đối với input_dir (vd: '*.jpg', '**/*.png') hoặc None
+
+    Returns:
+        list: Danh sách đường dẫn tuyệt đối đã sắp xếp
+    """
+    if pattern:
+        paths = glob.glob(os.path.join(input_dir, pattern), recursive=True)
+    else:
+        paths = []
+        for root, _, files in os.walk(input_dir):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, name))
+    return sorted(os.path.abspath(p) for p in paths if os.path.isfile(p))
+
+
+def _read_results(results_file):
+    """
+    Đọc các bản ghi của file kết quả JSONL
+
+    Returns:
+        tuple: (danh sách (dòng, bản ghi) của các dòng hoàn chỉnh, vị trí cuối dòng hoàn chỉnh cuối cùng)
+    """
+    records, end = [], 0
+    if not os.path.exists(results_file):
+        return records, end
+    with open(results_file, 'rb') as f:
+        for line in f:
+            # Dòng cuối có thể bị ghi dở (thiếu "\n") nếu lần chạy trước bị ngắt
+            if not line.endswith(b"\n"):
+                break
+            end += len(line)
+            try:
+                records.append((line, json.loads(line)))
+            except ValueError:
+                continue
+    return records, end
+
+
+def load_processed(results_file):
+    """
+    Đọc file kết quả JSONL để tiếp tục (resume) một lần chạy trước
+
+    Args:
+        results_file: Đường dẫn file kết quả
+
+    Returns:
+        set: Các ảnh đã được xử lý thành công
+    """
+    records, _ = _read_results(results_file)
+    return {record["image"] for _, record in records if "error" not in record}
+
+
+def prepare_resume(results_file, image_paths):
+    """
+    Chuẩn bị file kết quả để chạy tiếp và trả về các ảnh còn phải xử lý
+
+    Bỏ dòng ghi dở ở cuối file (để bản ghi mới không bị nối vào nó) và các bản ghi
+    lỗi của những ảnh sẽ được xử lý lại, để mỗi ảnh chỉ có một kết quả cuối cùng.
+
+    Args:
+        results_file: Đường dẫn file kết quả
+        image_paths: Danh sách ảnh cần xử lý
+
+    Returns:
+        list: Các ảnh trong image_paths chưa được xử lý thành công
+    """
+    records, end = _read_results(results_file)
+    processed = {record["image"] for _, record in records if "error" not in record}
+    pending = [p for p in image_paths if p not in processed]
+    if not os.path.exists(results_file):
+        return pending
+
+    retried = set(pending)
+    kept = [line for line, record in records if not ("error" in record and record["image"] in retried)]
+    if len(kept) == len(records):
+        with open(results_file, 'r+b') as f:
+            f.truncate(end)
+    else:
+        # Ghi file tạm rồi đổi tên để không mất kết quả nếu bị ngắt giữa chừng
+        tmp_file = results_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            f.writelines(kept)
+        os.replace(tmp_file, results_file)
+    return pending
+
+
+def _init_worker(cascade_path, recognition_mode, options, detector_options, combine_options):
+    """Khởi tạo tiến trình con: nạp cascade và mô hình LBPH đúng một lần"""
+    global _worker_processor, _worker_options
+    # Mỗi tiến trình chạy một luồng OpenCV để tránh tranh chấp CPU giữa các worker
+    cv2.setNumThreads(1)
+    detector = None
+    if combine_options:
+        # Các tiến trình đã dùng hết lõi CPU nên các cascade chạy tuần tự trong mỗi worker
+        from multi_cascade_detector import MultiCascadeDetector
+        detector = MultiCascadeDetector(workers=1, **combine_options, **detector_options)
+    if recognition_mode:
+        from face_recognizer import FaceRecognizer
+        _worker_processor = FaceRecognizer(cascade_path, read_only=True, detector=detector, **detector_options)
+    elif detector is not None:
+        _worker_processor = detector
+    else:
+        from face_detector import FaceDetector
+        _worker_processor = FaceDetector(cascade_path, **detector_options)
+    _worker_options = options
+
+
+def _output_name(image_path, input_dir):
+    """Tạo tên file kết quả duy nhất từ đường dẫn tương đối của ảnh"""
+    rel_path = os.path.relpath(image_path, input_dir)
+    name, ext = os.path.splitext(rel_path.replace(os.sep, "__"))
+    return name, ext
+
+
+def _process_image(image_path):
+    """Xử lý một ảnh trong tiến trình con và trả về bản ghi kết quả"""
+    options = _worker_options
+    start = time.time()
+    record = {"image": image_path}
+
+    try:
+        image = cv2.imread(image_path)
+        if image is None:
+            record["error"] = "Không thể đọc ảnh"
+            return record
+
+        # Phát hiện một lần, dùng lại cho nhận diện, vẽ và cắt khuôn mặt
+        detection = _worker_processor.analyze(image)
+
+        if options["recognition_mode"]:
+            recognized_faces = _worker_processor.recognize_face(detection, options["confidence"])
+            faces = [face_info["bbox"] for face_info in recognized_faces]
+            record["recognized"] = [{
+                "user_id": face_info["user_id"],
+                "name": face_info["name"],
+                "confidence": round(float(face_info["confidence"]), 2),
+                "bbox": [int(v) for v in face_info["bbox"]]
+            } for face_info in recognized_faces]
+            if options["save_annotated"]:
+                image_with_faces = _worker_processor.draw_recognized_faces(image, recognized_faces, False)
+        else:
+            faces = detection.faces
+            if options["save_annotated"]:
+                image_with_faces = _worker_processor.draw_faces(detection)
+
+        record["faces"] = [[int(v) for v in bbox] for bbox in faces]
+        record["num_faces"] = len(faces)
+
+        name, ext = _output_name(image_path, options["input_dir"])
+        if options["save_annotated"]:
+            cv2.imwrite(os.path.join(options["output_dir"], f"{name}_detected{ext}"), image_with_faces)
+
+        if options["extract_faces"]:
+            for i, face_img in enumerate(detection.crop()):
+                cv2.imwrite(os.path.join(options["output_dir"], f"{name}_face_{i+1}.jpg"), face_img)
+    except Exception as e:
+        record["error"] = str(e)
+
+    record["elapsed_ms"] = round((time.time() - start) * 1000, 2)
+    return record
+
+
+def run_batch(image_paths, cascade_path, results_file, input_dir, output_dir,
+              recognition_mode=False, confidence=30.0, workers=None,
+              resume=False, save_annotated=False, extract_faces=False, chunksize=4,
+              detector_options=None, combine_options=None):
+    """
+    Xử lý hàng loạt ảnh trên một pool tiến trình, không hiển thị cửa sổ
+
+    Kết quả được ghi dần vào file JSONL (mỗi ảnh một dòng) ngay khi có,
+    nên có thể dừng giữa chừng và chạy lại với resume=True.
+
+    Args:
+        image_paths: Danh sách ảnh cần xử lý
+        cascade_path: Đường dẫn file Haar Cascade
+        results_file: File JSONL lưu kết quả
+        input_dir: Thư mục gốc của ảnh (dùng để đặt tên file đầu ra)
+        output_dir: Thư mục lưu ảnh kết quả và khuôn mặt cắt ra
+        recognition_mode: True để nhận diện người dùng thay vì chỉ phát hiện
+        confidence: Ngưỡng độ tin cậy cho nhận diện
+        workers: Số tiến trình (mặc định: số lõi CPU)
+        resume: Bỏ qua các ảnh đã xử lý thành công trong results_file (ảnh bị lỗi được
+                xử lý lại, xem prepare_resume)
+        save_annotated: Lưu ảnh đã vẽ khung khuôn mặt
+        extract_faces: Lưu từng khuôn mặt riêng biệt
+        chunksize: Số ảnh giao cho mỗi worker một lần
+        detector_options: Tham số cho FaceDetector (vd: detection_scale, max_detection_side)
+        combine_options: Tham số cho MultiCascadeDetector (cascade_paths, fusion, gate...)
+                         để kết hợp nhiều cascade, None để chỉ dùng cascade_path
+
+    Returns:
+        dict: Thống kê (tổng, đã xử lý, bỏ qua, lỗi, số khuôn mặt, thời gian)
+    """
+    workers = workers or os.cpu_count() or 1
+
+    skipped = 0
+    if resume:
+        pending = prepare_resume(results_file, image_paths)
+        skipped = len(image_paths) - len(pending)
+    else:
+        pending = list(image_paths)
+        # Chạy mới: xóa kết quả cũ
+        open(results_file, 'w', encoding='utf-8').close()
+
+    stats = {"total": len(image_paths), "processed": 0, "skipped": skipped,
+             "errors": 0, "faces": 0, "elapsed": 0.0}
+    if not pending:
+        return stats
+
+    options = {
+        "recognition_mode": recognition_mode,
+        "confidence": confidence,
+        "input_dir": input_dir,
+        "output_dir": output_dir,
+        "save_annotated": save_annotated,
+        "extract_faces": extract_faces,
+    }
+
+    start_time = time.time()
+    with open(results_file, 'a', encoding='utf-8') as out, \
+            Pool(workers, initializer=_init_worker,
+                 initargs=(cascade_path, recognition_mode, options, detector_options or {},
+                           combine_options)) as pool:
+        for record in pool.imap_unordered(_process_image, pending, chunksize=chunksize):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+            stats["processed"] += 1
+            if "error" in record:
+                stats["errors"] += 1
+                print(f"Lỗi: {record['image']}: {record['error']}")
+            else:
+                stats["faces"] += record["num_faces"]
+
+            if stats["processed"] % 100 == 0 or stats["processed"] == len(pending):
+                elapsed = time.time() - start_time
+                rate = stats["processed"] / elapsed if elapsed > 0 else 0
+                print(f"Đã xử lý {stats['processed']}/{len(pending)} ảnh ({rate:.1f} ảnh/giây)")
+
+    stats["elapsed"] = time.time() - start_time
+    return stats
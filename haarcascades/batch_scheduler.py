@@ -0,0 +1,134 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class SchedulerOverloaded(Exception):
+    """Hàng đợi của bộ lập lịch đã đầy, yêu cầu bị từ chối (back-pressure)"""
+
+
+class BatchScheduler:
+    """
+    Bộ lập lịch gom yêu cầu thành lô nhỏ (micro-batching)
+
+    Các yêu cầu đến được xếp vào hàng đợi có giới hạn. Một luồng gom lô đóng lô
+    khi đủ max_batch_size yêu cầu hoặc khi yêu cầu đầu tiên của lô đã chờ
+    max_wait giây, rồi giao lô cho một trong các worker. Mỗi người gọi nhận
+    một Future và được trả kết quả khi lô của mình xử lý xong.
+
+    Khi mọi worker đều bận, lô mới không được tạo và yêu cầu dồn lại trong hàng
+    đợi; hàng đợi đầy thì submit() báo SchedulerOverloaded thay vì chờ vô hạn.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait=0.005, max_queue=64, workers=2):
+        """
+        Args:
+            process_batch: Hàm nhận danh sách yêu cầu và trả về danh sách kết quả cùng thứ tự
+            max_batch_size: Số yêu cầu tối đa trong một lô
+            max_wait: Thời gian tối đa (giây) yêu cầu đầu tiên chờ lô được đóng
+            max_queue: Số yêu cầu tối đa đang chờ trong hàng đợi
+            workers: Số lô được xử lý đồng thời
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.workers = max(1, workers)
+
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._free_workers = threading.Semaphore(self.workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._closed = False
+
+        # Thống kê
+        self.batch_count = 0
+        self.item_count = 0
+        self.rejected_count = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """
+        Đưa một yêu cầu vào hàng đợi
+
+        Returns:
+            Future: Kết quả của yêu cầu
+
+        Raises:
+            SchedulerOverloaded: Hàng đợi đã đầy hoặc bộ lập lịch đã đóng
+        """
+        if self._closed:
+            raise SchedulerOverloaded("Bộ lập lịch đã dừng")
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future))
+        except queue.Full:
+            self.rejected_count += 1
+            raise SchedulerOverloaded("Hàng đợi yêu cầu đã đầy")
+        return future
+
+    def depth(self):
+        """Số yêu cầu đang chờ trong hàng đợi"""
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            # Chỉ gom lô khi có worker rảnh: yêu cầu chờ trong hàng đợi có giới hạn
+            self._free_workers.acquire()
+            first = self._queue.get()
+            if first is None:
+                self._free_workers.release()
+                return
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
+
+            self.batch_count += 1
+            self.item_count += len(batch)
+            self._executor.submit(self._process, batch)
+            if stop:
+                return
+
+    def _process(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = self.process_batch(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._free_workers.release()
+
+    def stats(self):
+        """Thống kê: số lô, số yêu cầu, kích thước lô trung bình, số yêu cầu bị từ chối"""
+        return {
+            "batches": self.batch_count,
+            "items": self.item_count,
+            "avg_batch_size": self.item_count / self.batch_count if self.batch_count else 0.0,
+            "rejected": self.rejected_count,
+            "queue_depth": self.depth(),
+        }
+
+    def close(self):
+        """Xử lý nốt các yêu cầu đang chờ rồi dừng"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
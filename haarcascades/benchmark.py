@@ -0,0 +1,410 @@
+import cv2
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import numpy as np
+from face_detector import FaceDetector
+from face_recognizer import FaceRecognizer
+from face_gallery import FaceGallery, HISTOGRAM_DTYPES, quantize_histograms
+from lbph_model import LBPHModel
+from user_store import UserStore
+
+# Độ phân giải của ảnh thử (width, height)
+RESOLUTIONS = {
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+# Lưới tham số cascade được quét
+SWEEP_SCALE_FACTORS = (1.05, 1.1, 1.2, 1.3)
+SWEEP_MIN_NEIGHBORS = (3, 5, 8)
+SWEEP_MIN_SIZES = (20, 40, 80)
+
+
+class FixedBoxes:
+    """
+    Thay cho cascade khi đo nhận diện: trả về các khung đã biết của ảnh thử
+
+    Gắn vào FaceRecognizer bằng attach_tracker() để recognize_face chạy đầy đủ
+    phần cắt, chuẩn hóa và so khớp khuôn mặt trên ảnh tổng hợp.
+    """
+
+    def __init__(self, boxes):
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+
+    def update(self, gray):
+        return self.boxes
+
+
+@contextlib.contextmanager
+def quiet():
+    """Ẩn thông báo của các hàm được đo (nạp mô hình, huấn luyện...)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def measure(fn, repeat=5, warmup=1):
+    """
+    Đo thời gian chạy của fn
+
+    Returns:
+        dict: median_ms, mean_ms, min_ms, p90_ms, runs
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000.0)
+    times = np.array(times)
+    return {
+        "median_ms": round(float(np.median(times)), 3),
+        "mean_ms": round(float(times.mean()), 3),
+        "min_ms": round(float(times.min()), 3),
+        "p90_ms": round(float(np.percentile(times, 90)), 3),
+        "runs": len(times),
+    }
+
+
+def synthetic_face(rng, size=100):
+    """Ảnh khuôn mặt giả (xám) có cấu trúc gần với ảnh thật: nền mờ, hình oval, mắt và miệng tối"""
+    face = cv2.GaussianBlur(rng.integers(60, 200, (size, size)).astype(np.uint8), (0, 0), 3)
+    center = (size // 2, size // 2)
+    cv2.ellipse(face, center, (size * 2 // 5, size // 2 - 2), 0, 0, 360, int(rng.integers(150, 220)), -1)
+    eye_y = size * 2 // 5
+    for eye_x in (size // 3, size * 2 // 3):
+        cv2.circle(face, (eye_x, eye_y), max(2, size // 14), int(rng.integers(20, 70)), -1)
+    cv2.ellipse(face, (size // 2, size * 7 // 10), (size // 6, size // 20), 0, 0, 360,
+                int(rng.integers(40, 90)), -1)
+    noise = rng.normal(0, 6, face.shape)
+    return np.clip(face + noise, 0, 255).astype(np.uint8)
+
+
+def load_faces(count, rng, faces_dir=None):
+    """Ảnh khuôn mặt xám từ faces_dir (nếu có) hoặc tổng hợp"""
+    faces = []
+    if faces_dir:
+        for name in sorted(os.listdir(faces_dir)):
+            face_img = cv2.imread(os.path.join(faces_dir, name), cv2.IMREAD_GRAYSCALE)
+            if face_img is not None:
+                faces.append(face_img)
+    if not faces:
+        return [synthetic_face(rng) for _ in range(count)]
+    return [faces[i % len(faces)] for i in range(count)]
+
+
+def make_scene(resolution, face_images, rng):
+    """
+    Ảnh BGR với các khuôn mặt được dán vào các ô lưới không chồng nhau
+
+    Returns:
+        tuple: (ảnh, danh sách khung (x, y, w, h))
+    """
+    width, height = resolution
+    background = cv2.resize(rng.integers(0, 255, (height // 16 + 1, width // 16 + 1)).astype(np.uint8),
+                            (width, height), interpolation=cv2.INTER_CUBIC)
+    image = cv2.cvtColor(background, cv2.COLOR_GRAY2BGR)
+    if not face_images:
+        return image, []
+
+    cols = int(np.ceil(np.sqrt(len(face_images))))
+    rows = int(np.ceil(len(face_images) / float(cols)))
+    cell_w, cell_h = width // cols, height // rows
+    side = max(40, int(min(cell_w, cell_h) * 0.6))
+    boxes = []
+    for i, face_img in enumerate(face_images):
+        x = (i % cols) * cell_w + (cell_w - side) // 2
+        y = (i // cols) * cell_h + (cell_h - side) // 2
+        face = cv2.resize(face_img, (side, side))
+        image[y:y+side, x:x+side] = cv2.cvtColor(face, cv2.COLOR_GRAY2BGR)
+        boxes.append((x, y, side, side))
+    return image, boxes
+
+
+def synthetic_gallery(count, dtype, rng, samples_per_user=10, pool_size=256, chunk_size=1024):
+    """
+    Thư viện histogram LBP tổng hợp với count mẫu
+
+    Mỗi mẫu là một histogram thật (của ảnh tổng hợp) với thứ tự các ô lưới được
+    hoán vị ngẫu nhiên: các mẫu khác nhau nhưng có độ thưa giống ảnh thật, và
+    thư viện 100k mẫu được tạo trong vài giây (được lượng tử hóa theo từng khối).
+    """
+    template = FaceGallery(np.empty((0, 0)), [])
+    cells = template.grid_x * template.grid_y
+    pool = template.compute_histograms([synthetic_face(rng) for _ in range(pool_size)])
+    pool = pool.reshape(pool_size, cells, template.num_patterns)
+
+    matrix = np.empty((count, template.dimension), dtype=dtype)
+    scales = np.ones(count, dtype=np.float32) if dtype == "uint8" else None
+    for start in range(0, count, chunk_size):
+        n = min(chunk_size, count - start)
+        sources = rng.integers(0, pool_size, n)
+        order = rng.permuted(np.tile(np.arange(cells), (n, 1)), axis=1)
+        block = pool[sources[:, None], order].reshape(n, template.dimension)
+        block, block_scales = quantize_histograms(block, dtype)
+        matrix[start:start + n] = block
+        if scales is not None:
+            scales[start:start + n] = block_scales
+    labels = np.arange(count) // samples_per_user
+    return FaceGallery(matrix, labels, dtype=dtype, scales=scales)
+
+
+def build_data_dir(path, gallery):
+    """Thư mục dữ liệu với mô hình face_model.lbph và cơ sở dữ liệu người dùng tương ứng với gallery"""
+    os.makedirs(path, exist_ok=True)
+    labels = sorted(set(int(label) for label in gallery.labels))
+    store = UserStore(path)
+    store.replace_users({f"user{label}": {"name": f"User {label}", "created_at": None, "last_recognized": None}
+                         for label in labels})
+    store.save_model_state({
+        "label_to_user": {str(label): f"user{label}" for label in labels},
+        "next_label": len(labels),
+        "tombstones": {},
+        "sample_count": len(gallery),
+    })
+    store.close()
+
+    model = LBPHModel(dtype=gallery.dtype)
+    model.gallery = gallery
+    model.write(os.path.join(path, "face_model.lbph"))
+
+
+def bench_detection(results, cascade_path, resolutions, face_counts, repeat, rng, faces_dir=None):
+    """Thời gian FaceDetector.detect_faces theo độ phân giải và số khuôn mặt"""
+    with quiet():
+        detector = FaceDetector(cascade_path)
+    for name in resolutions:
+        for num_faces in face_counts:
+            image, _ = make_scene(RESOLUTIONS[name], load_faces(num_faces, rng, faces_dir), rng)
+            key = f"detect/{name}/faces{num_faces}"
+            results[key] = measure(lambda: detector.detect_faces(image), repeat)
+            results[key]["detected"] = int(len(detector.detect_faces(image)[1]))
+            print(f"{key}: {results[key]['median_ms']:.1f} ms")
+
+
+def bench_sweep(results, cascade_path, resolution, repeat, rng, faces_dir=None):
+    """Thời gian phát hiện theo scaleFactor, minNeighbors và minSize"""
+    image, _ = make_scene(RESOLUTIONS[resolution], load_faces(4, rng, faces_dir), rng)
+    for scale_factor in SWEEP_SCALE_FACTORS:
+        for min_neighbors in SWEEP_MIN_NEIGHBORS:
+            for min_size in SWEEP_MIN_SIZES:
+                with quiet():
+                    detector = FaceDetector(cascade_path, scale_factor=scale_factor, min_neighbors=min_neighbors,
+                                            min_size=(min_size, min_size))
+                key = f"sweep/{resolution}/sf{scale_factor}/mn{min_neighbors}/ms{min_size}"
+                results[key] = measure(lambda: detector.detect_faces(image), repeat)
+                results[key]["detected"] = int(len(detector.detect_faces(image)[1]))
+                print(f"{key}: {results[key]['median_ms']:.1f} ms")
+
+
+def bench_recognition(results, cascade_path, gallery_sizes, face_counts, dtype, repeat, rng, work_dir,
+                      faces_dir=None):
+    """Thời gian nạp mô hình và recognize_face theo số mẫu trong thư viện"""
+    for size in gallery_sizes:
+        data_dir = os.path.join(work_dir, f"gallery_{size}")
+        build_data_dir(data_dir, synthetic_gallery(size, dtype, rng))
+        model_file = os.path.join(data_dir, "face_model.lbph")
+
+        key = f"model_load/{size}"
+        results[key] = measure(lambda: LBPHModel().read(model_file), repeat)
+        results[key]["file_bytes"] = os.path.getsize(model_file)
+        print(f"{key}: {results[key]['median_ms']:.1f} ms")
+
+        def create():
+            with quiet():
+                return FaceRecognizer(cascade_path, data_dir=data_dir, read_only=True)
+        key = f"recognizer_init/{size}"
+        results[key] = measure(lambda: create().close(), max(1, repeat // 2))
+        print(f"{key}: {results[key]['median_ms']:.1f} ms")
+
+        recognizer = create()
+        for num_faces in face_counts:
+            image, boxes = make_scene(RESOLUTIONS["hd"], load_faces(num_faces, rng, faces_dir), rng)
+            recognizer.attach_tracker(FixedBoxes(boxes))
+            key = f"recognize/{size}/faces{num_faces}"
+            results[key] = measure(lambda: recognizer.recognize_face(image, 50), repeat)
+            print(f"{key}: {results[key]['median_ms']:.1f} ms")
+        recognizer.close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def bench_training(results, cascade_path, train_sizes, repeat, rng, work_dir, samples_per_user=10):
+    """Thời gian huấn luyện lại toàn bộ mô hình (_update_recognition_model) theo số ảnh khuôn mặt"""
+    for size in train_sizes:
+        data_dir = os.path.join(work_dir, f"train_{size}")
+        os.makedirs(data_dir)
+        users = {}
+        for i in range(size):
+            user_id = f"user{i // samples_per_user}"
+            faces_dir = os.path.join(data_dir, user_id, "faces")
+            os.makedirs(faces_dir, exist_ok=True)
+            face_path = os.path.join(faces_dir, f"{user_id}_face_{i % samples_per_user + 1}.png")
+            cv2.imwrite(face_path, synthetic_face(rng))
+            users.setdefault(user_id, {"name": user_id, "created_at": None, "last_recognized": None,
+                                       "face_images": []})["face_images"].append(face_path)
+        store = UserStore(data_dir)
+        store.replace_users(users)
+        store.close()
+
+        with quiet():
+            recognizer = FaceRecognizer(cascade_path, data_dir=data_dir)
+            # Lần đầu dựng kho khuôn mặt từ ảnh; các lần đo chỉ huấn luyện lại từ kho
+            recognizer._update_recognition_model()
+
+        def train():
+            with quiet():
+                recognizer._update_recognition_model()
+        key = f"train/{size}"
+        results[key] = measure(train, max(1, repeat // 2), warmup=0)
+        print(f"{key}: {results[key]['median_ms']:.1f} ms")
+        recognizer.close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def compare_baseline(results, baseline, tolerance=0.2, min_delta_ms=0.5):
+    """
+    So sánh với kết quả lưu trước đó
+
+    Một phép đo bị xem là chậm đi (regression) khi median lớn hơn baseline quá
+    tolerance (tỷ lệ) và chênh lệch tuyệt đối lớn hơn min_delta_ms.
+
+    Returns:
+        list: Các dict name, baseline_ms, current_ms, ratio của những phép đo chậm đi
+    """
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if not previous or not previous.get("median_ms"):
+            continue
+        ratio = current["median_ms"] / previous["median_ms"]
+        delta = current["median_ms"] - previous["median_ms"]
+        flag = ratio > 1.0 + tolerance and delta > min_delta_ms
+        print(f"{'CHẬM ĐI' if flag else 'ok':<8} {name:<45} {previous['median_ms']:>10.2f} -> "
+              f"{current['median_ms']:>10.2f} ms ({ratio:.2f}x)")
+        if flag:
+            regressions.append({"name": name, "baseline_ms": previous["median_ms"],
+                                "current_ms": current["median_ms"], "ratio": round(ratio, 3)})
+    return regressions
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main():
+    # Đường dẫn thư mục chứa file này
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    results_dir = os.path.join(os.path.dirname(current_dir), "results")
+
+    parser = argparse.ArgumentParser(description='Đo hiệu năng phát hiện và nhận diện khuôn mặt (chạy offline, chỉ CPU)')
+    parser.add_argument('--cascade', default='haarcascade_frontalface_default.xml',
+                        help='Tên file cascade trong thư mục haarcascades')
+    parser.add_argument('--output', default=os.path.join(results_dir, 'benchmark.json'),
+                        help='File JSON kết quả')
+    parser.add_argument('--baseline', help='File JSON kết quả trước đó để so sánh')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Tỷ lệ chậm đi cho phép so với baseline (mặc định: 0.2 = 20%%)')
+    parser.add_argument('--suites', default='detect,sweep,recognize,train',
+                        help='Các nhóm phép đo: detect, sweep, recognize, train')
+    parser.add_argument('--resolutions', default='vga,hd,fhd,4k',
+                        help=f'Độ phân giải ảnh thử ({", ".join(RESOLUTIONS)})')
+    parser.add_argument('--faces', type=_int_list, default=[1, 4, 16], help='Số khuôn mặt mỗi ảnh, vd: 1,4,16')
+    parser.add_argument('--faces-dir', help='Thư mục ảnh khuôn mặt thật để dán vào ảnh thử (mặc định: tổng hợp)')
+    parser.add_argument('--sweep-resolution', default='hd', choices=list(RESOLUTIONS),
+                        help='Độ phân giải dùng khi quét tham số cascade')
+    parser.add_argument('--gallery-sizes', type=_int_list, default=[10, 100, 1000, 10000],
+                        help='Số mẫu trong thư viện khi đo nhận diện, vd: 10,1000,100000')
+    parser.add_argument('--gallery-dtype', default='float32', choices=HISTOGRAM_DTYPES,
+                        help='Kiểu lưu histogram của thư viện (100k mẫu: float32 ~6.5 GB, uint8 ~1.6 GB)')
+    parser.add_argument('--train-sizes', type=_int_list, default=[100, 1000],
+                        help='Số ảnh khuôn mặt khi đo huấn luyện lại')
+    parser.add_argument('--repeat', type=int, default=5, help='Số lần đo mỗi phép đo')
+    parser.add_argument('--seed', type=int, default=0, help='Hạt giống cho dữ liệu tổng hợp')
+    parser.add_argument('--quick', action='store_true',
+                        help='Chạy nhanh: vga/hd (quét tham số ở vga), thư viện tới 1000 mẫu, 100 ảnh huấn luyện, 3 lần đo')
+
+    args = parser.parse_args()
+    if args.quick:
+        args.resolutions = 'vga,hd'
+        args.sweep_resolution = 'vga'
+        args.gallery_sizes = [size for size in args.gallery_sizes if size <= 1000]
+        args.train_sizes = [size for size in args.train_sizes if size <= 100] or [100]
+        args.repeat = min(args.repeat, 3)
+
+    cascade_path = os.path.join(current_dir, args.cascade)
+    if not os.path.isfile(cascade_path):
+        print(f"Lỗi: Không tìm thấy file cascade '{cascade_path}'")
+        return 2
+    resolutions = [name for name in args.resolutions.split(',') if name]
+    unknown = [name for name in resolutions if name not in RESOLUTIONS]
+    if unknown:
+        print(f"Lỗi: Độ phân giải không hợp lệ: {', '.join(unknown)}")
+        return 2
+    suites = set(args.suites.split(','))
+
+    # Đo trên một luồng để kết quả ổn định và so sánh được giữa các máy
+    cv2.setNumThreads(1)
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix="face_benchmark_")
+    try:
+        if 'detect' in suites:
+            bench_detection(results, cascade_path, resolutions, args.faces, args.repeat, rng, args.faces_dir)
+        if 'sweep' in suites:
+            bench_sweep(results, cascade_path, args.sweep_resolution, args.repeat, rng, args.faces_dir)
+        if 'recognize' in suites:
+            bench_recognition(results, cascade_path, args.gallery_sizes, args.faces, args.gallery_dtype,
+                              args.repeat, rng, work_dir, args.faces_dir)
+        if 'train' in suites:
+            bench_training(results, cascade_path, args.train_sizes, args.repeat, rng, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "gallery_dtype": args.gallery_dtype,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\nSo sánh với {args.baseline} (dung sai {args.tolerance:.0%}):")
+        regressions = compare_baseline(results, baseline.get("results", {}), args.tolerance)
+        report["regressions"] = regressions
+        if regressions:
+            print(f"Có {len(regressions)} phép đo chậm đi so với baseline")
+            exit_code = 1
+        else:
+            print("Không có phép đo nào chậm đi so với baseline")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu kết quả tại '{args.output}'")
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import numpy as np
+
+
+def iou(box_a, box_b):
+    """
+    Tính tỷ lệ giao trên hợp (IoU) của hai khung (x, y, w, h)
+
+    Returns:
+        float: Giá trị trong khoảng [0, 1]
+    """
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    inter_w = min(ax + aw, bx + bw) - max(ax, bx)
+    inter_h = min(ay + ah, by + bh) - max(ay, by)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    union = aw * ah + bw * bh - inter
+    return inter / float(union) if union > 0 else 0.0
+
+
+def expand_box(box, padding, image_shape):
+    """
+    Mở rộng khung theo tỷ lệ và cắt theo biên ảnh
+
+    Args:
+        box: Khung (x, y, w, h)
+        padding: Độ mở rộng mỗi phía (% của kích thước khung)
+        image_shape: Kích thước ảnh (h, w, ...)
+
+    Returns:
+        tuple: Vùng (x1, y1, x2, y2) nằm trong ảnh
+    """
+    x, y, w, h = [int(v) for v in box]
+    img_h, img_w = image_shape[:2]
+    pad_w = int(w * padding)
+    pad_h = int(h * padding)
+    return (max(0, x - pad_w), max(0, y - pad_h),
+            min(img_w, x + w + pad_w), min(img_h, y + h + pad_h))
+
+
+def merge_regions(regions):
+    """
+    Gộp các vùng (x1, y1, x2, y2) chồng lên nhau thành vùng bao chung
+
+    Tránh quét cùng một vùng ảnh nhiều lần khi các khuôn mặt ở gần nhau.
+    """
+    regions = [list(r) for r in regions]
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        while regions:
+            current = regions.pop()
+            i = 0
+            while i < len(regions):
+                other = regions[i]
+                if (current[0] < other[2] and other[0] < current[2] and
+                        current[1] < other[3] and other[1] < current[3]):
+                    current = [min(current[0], other[0]), min(current[1], other[1]),
+                               max(current[2], other[2]), max(current[3], other[3])]
+                    regions.pop(i)
+                    merged = True
+                else:
+                    i += 1
+            result.append(current)
+        regions = result
+    return [tuple(r) for r in regions]
+
+
+def non_max_suppression(boxes, iou_threshold=0.3):
+    """
+    Loại bỏ các khung trùng lặp, giữ lại khung lớn hơn khi hai khung chồng nhau
+
+    Args:
+        boxes: Danh sách khung (x, y, w, h)
+        iou_threshold: Ngưỡng IoU để coi hai khung là một khuôn mặt
+
+    Returns:
+        numpy.ndarray: Mảng N x 4 (int32) các khung còn lại
+    """
+    boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+    if len(boxes) <= 1:
+        return boxes
+    order = np.argsort(-(boxes[:, 2] * boxes[:, 3]))
+    keep = []
+    for idx in order:
+        if all(iou(boxes[idx], boxes[k]) < iou_threshold for k in keep):
+            keep.append(idx)
+    return boxes[sorted(keep)]
+
+
+def weighted_box_fusion(boxes, weights, iou_threshold=0.3):
+    """
+    Gộp các khung chồng nhau thành một khung có tọa độ là trung bình có trọng số
+
+    Khác non_max_suppression (giữ một khung, bỏ các khung còn lại), mọi khung
+    của cùng một khuôn mặt đều góp vào vị trí cuối cùng theo trọng số của nó.
+
+    Args:
+        boxes: Danh sách khung (x, y, w, h)
+        weights: Trọng số của từng khung (vd: số lượt phát hiện của detectMultiScale2)
+        iou_threshold: Ngưỡng IoU để coi khung thuộc cùng một khuôn mặt
+
+    Returns:
+        tuple: (mảng N x 4 (int32) các khung đã gộp, danh sách chỉ số các khung của từng cụm)
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    weights = np.maximum(np.asarray(weights, dtype=np.float64).reshape(-1), 1e-6)
+    fused = []
+    totals = []
+    clusters = []
+    # Khung tin cậy nhất được xét trước và làm tâm của cụm
+    for idx in np.argsort(-weights, kind="stable"):
+        for k, box in enumerate(fused):
+            if iou(box, boxes[idx]) >= iou_threshold:
+                fused[k] = (box * totals[k] + boxes[idx] * weights[idx]) / (totals[k] + weights[idx])
+                totals[k] += weights[idx]
+                clusters[k].append(int(idx))
+                break
+        else:
+            fused.append(boxes[idx].copy())
+            totals.append(weights[idx])
+            clusters.append([int(idx)])
+    return np.round(np.asarray(fused).reshape(-1, 4)).astype(np.int32), clusters
@@ -2,6 +2,70 @@ import cv2
 import argparse
 import os
 from face_detector import FaceDetector
+from batch_processor import collect_images, run_batch
+from detector_profiles import resolve_detector_options
+from multi_cascade_detector import MultiCascadeDetector, resolve_cascades, DEFAULT_EXTRA_CASCADES
+
+def get_combine_options(args, cascade_path):
+    """Tham số cho MultiCascadeDetector khi dùng --combine-cascades, None nếu không kết hợp"""
+    if not args.combine_cascades:
+        return None
+    cascade_paths = resolve_cascades([cascade_path] + list(args.extra_cascades or DEFAULT_EXTRA_CASCADES))
+    print(f"Kết hợp {len(cascade_paths)} cascade: {', '.join(os.path.basename(p) for p in cascade_paths)}")
+    return {"cascade_paths": cascade_paths, "fusion": args.fusion,
+            "min_votes": args.min_votes, "gate": not args.no_gate}
+
+def run_batch_mode(args, current_dir, images_dir, results_dir):
+    """Xử lý hàng loạt ảnh trong thư mục trên nhiều tiến trình, không hiển thị cửa sổ"""
+    input_dir = os.path.abspath(args.input_dir) if args.input_dir else images_dir
+    cascade_path = os.path.join(current_dir, args.cascade)
+    
+    if not os.path.isdir(input_dir):
+        print(f"Lỗi: Thư mục đầu vào không tồn tại: '{input_dir}'")
+        return
+    
+    if not os.path.isfile(cascade_path):
+        print(f"Lỗi: Không tìm thấy file cascade '{cascade_path}'")
+        return
+    
+    image_paths = collect_images(input_dir, args.glob)
+    if not image_paths:
+        print(f"Không tìm thấy ảnh nào trong '{input_dir}'")
+        return
+    
+    try:
+        detector_options = resolve_detector_options(args.profile, detection_scale=args.detect_scale,
+                                                    max_detection_side=args.detect_max_side)
+    except ValueError as e:
+        print(f"Lỗi: {str(e)}")
+        return
+    
+    results_file = os.path.join(results_dir, args.results_file)
+    output_dir = os.path.join(results_dir, os.path.splitext(args.results_file)[0])
+    if args.save_annotated or args.extract_faces:
+        os.makedirs(output_dir, exist_ok=True)
+    
+    print(f"Tìm thấy {len(image_paths)} ảnh trong '{input_dir}'")
+    print(f"Kết quả được ghi vào: {results_file}")
+    
+    stats = run_batch(
+        image_paths, cascade_path, results_file, input_dir, output_dir,
+        recognition_mode=args.recognition_mode,
+        confidence=args.confidence,
+        workers=args.workers,
+        resume=args.resume,
+        save_annotated=args.save_annotated,
+        extract_faces=args.extract_faces,
+        detector_options=detector_options,
+        combine_options=get_combine_options(args, cascade_path)
+    )
+    
+    print(f"\nTổng số ảnh: {stats['total']}")
+    print(f"Đã xử lý: {stats['processed']} (bỏ qua {stats['skipped']} ảnh đã có kết quả)")
+    print(f"Lỗi: {stats['errors']}")
+    print(f"Số khuôn mặt phát hiện được: {stats['faces']}")
+    if stats['elapsed'] > 0:
+        print(f"Thời gian: {stats['elapsed']:.2f} giây ({stats['processed'] / stats['elapsed']:.1f} ảnh/giây)")
 
 def main():
     # Đường dẫn thư mục hiện tại
@@ -25,7 +89,7 @@ def main():
     
     # Phân tích tham số dòng lệnh
     parser = argparse.ArgumentParser(description='Nhận diện khuôn mặt từ ảnh')
-    parser.add_argument('--image', required=True, help='Tên file ảnh trong thư mục images')
+    parser.add_argument('--image', help='Tên file ảnh trong thư mục images')
     parser.add_argument('--cascade', default='haarcascade_frontalface_default.xml', 
                         help='Tên file cascade trong thư mục haarcascades')
     parser.add_argument('--output', help='Tên file kết quả (mặc định: giống tên file đầu vào)')
@@ -34,8 +98,24 @@ def main():
                         help='Kích thước đầu ra mới, định dạng WIDTHxHEIGHT hoặc tỷ lệ phần trăm (vd: 800x600, 0.5)')
     parser.add_argument('--extract-faces', action='store_true',
                         help='Lưu từng khuôn mặt riêng biệt thành file riêng')
+    parser.add_argument('--detect-scale', type=float,
+                        help='Tỷ lệ thu nhỏ ảnh trước khi phát hiện (0-1.0, vd: 0.5)')
+    parser.add_argument('--detect-max-side', type=int,
+                        help='Cạnh dài nhất của ảnh dùng để phát hiện, tính bằng pixel (vd: 960)')
+    parser.add_argument('--profile',
+                        help='Profile tham số phát hiện đã lưu bằng autotune.py (vd: kiosk-fast); '
+                             'các tham số --detect-* ghi đè profile')
     parser.add_argument('--combine-cascades', action='store_true',
                         help='Kết hợp nhiều bộ phát hiện để tăng độ chính xác')
+    parser.add_argument('--extra-cascades', nargs='+',
+                        help='Các cascade chạy thêm khi dùng --combine-cascades, tìm trong thư mục haarcascades '
+                             'và dữ liệu của OpenCV (mặc định: ' + ' '.join(DEFAULT_EXTRA_CASCADES) + ')')
+    parser.add_argument('--fusion', choices=['weighted', 'nms'], default='weighted',
+                        help='Cách gộp khung của các cascade: trung bình có trọng số hoặc NMS (mặc định: weighted)')
+    parser.add_argument('--min-votes', type=int, default=1,
+                        help='Số cascade tối thiểu phải cùng tìm thấy một khuôn mặt (mặc định: 1)')
+    parser.add_argument('--no-gate', action='store_true',
+                        help='Luôn chạy đủ các cascade phụ, không kiểm tra nhanh trên ảnh thu nhỏ trước')
     
     # Thêm các tham số mới cho chế độ nhận diện người dùng
     parser.add_argument('--recognition-mode', action='store_true',
@@ -45,9 +125,29 @@ def main():
     parser.add_argument('--show-details', action='store_true',
                         help='Hiển thị thông tin chi tiết của người dùng')
     
+    # Tham số cho chế độ xử lý hàng loạt (không hiển thị cửa sổ)
+    parser.add_argument('--input-dir',
+                        help='Thư mục ảnh cần xử lý hàng loạt (mặc định: thư mục images khi dùng --glob)')
+    parser.add_argument('--glob',
+                        help="Mẫu chọn ảnh trong thư mục đầu vào (vd: '*.jpg', '**/*.png')")
+    parser.add_argument('--workers', type=int,
+                        help='Số tiến trình xử lý song song (mặc định: số lõi CPU)')
+    parser.add_argument('--results-file', default='batch_results.jsonl',
+                        help='File JSONL lưu kết quả trong thư mục results (mặc định: batch_results.jsonl)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Bỏ qua các ảnh đã xử lý thành công trong file kết quả')
+    parser.add_argument('--save-annotated', action='store_true',
+                        help='Lưu ảnh đã đánh dấu khuôn mặt khi xử lý hàng loạt')
     
     args = parser.parse_args()
     
+    if args.input_dir or args.glob:
+        run_batch_mode(args, current_dir, images_dir, results_dir)
+        return
+    
+    if not args.image:
+        parser.error("cần --image hoặc --input-dir/--glob")
+    
     # Xây dựng đường dẫn đầy đủ
     image_path = os.path.join(images_dir, args.image)
     cascade_path = os.path.join(current_dir, args.cascade)
@@ -61,11 +161,6 @@ def main():
         print(f"Lỗi: Thư mục ảnh không tồn tại: '{images_dir}'")
         return
         
-    # Liệt kê các file trong thư mục images để debug
-    print("Các file trong thư mục images:")
-    for file in os.listdir(images_dir):
-        print(f"- {file}")
-    
     # Tạo tên file kết quả mặc định nếu không cung cấp
     if args.output is None:
         filename, ext = os.path.splitext(args.image)
@@ -79,6 +174,10 @@ def main():
     if not os.path.isfile(image_path):
         print(f"Lỗi: Không tìm thấy file ảnh '{image_path}'")
         print(f"Hãy đặt ảnh vào thư mục: {images_dir}")
+        # Liệt kê các file trong thư mục images để debug
+        print("Các file trong thư mục images:")
+        for file in os.listdir(images_dir):
+            print(f"- {file}")
         return
     
     # Kiểm tra file cascade tồn tại
@@ -88,14 +187,22 @@ def main():
     
     # Khởi tạo bộ phát hiện khuôn mặt
     try:
+        detector_options = resolve_detector_options(args.profile, detection_scale=args.detect_scale,
+                                                    max_detection_side=args.detect_max_side)
+    except ValueError as e:
+        print(f"Lỗi: {str(e)}")
+        return
+    
+    try:
+        combine_options = get_combine_options(args, cascade_path)
+        detector = MultiCascadeDetector(**combine_options, **detector_options) if combine_options else None
         if args.recognition_mode:
             print("Sử dụng chế độ nhận diện người dùng...")
             from face_recognizer import FaceRecognizer
-            face_processor = FaceRecognizer(cascade_path)
+            face_processor = FaceRecognizer(cascade_path, detector=detector, **detector_options)
         else:
             print("Sử dụng chế độ phát hiện khuôn mặt cơ bản...")
-            from face_detector import FaceDetector
-            face_processor = FaceDetector(cascade_path)
+            face_processor = detector or FaceDetector(cascade_path, **detector_options)
     except Exception as e:
         print(f"Lỗi khi tải detector: {str(e)}")
         return
@@ -133,10 +240,13 @@ def main():
                 print(f"Lỗi: Định dạng kích thước không hợp lệ")
                 return
     
+    # Phát hiện khuôn mặt đúng một lần, kết quả được dùng lại cho nhận diện, vẽ và cắt khuôn mặt
+    detection = face_processor.analyze(image)
+    
     # Xử lý ảnh dựa trên chế độ
     if args.recognition_mode:
         # Nhận diện người dùng
-        recognized_faces = face_processor.recognize_face(image, args.confidence)
+        recognized_faces = face_processor.recognize_face(detection, args.confidence)
         image_with_faces = face_processor.draw_recognized_faces(image, recognized_faces, args.show_details)
         
         # In thông tin người được nhận diện
@@ -158,9 +268,13 @@ def main():
                 print(f"Khuôn mặt {i+1}: Không nhận diện được - Độ tin cậy: {confidence:.2f}%")
         
         faces = [face_info["bbox"] for face_info in recognized_faces]
+        
+        # Ghi cập nhật last_recognized xuống đĩa
+        face_processor.close()
     else:
         # Phát hiện khuôn mặt cơ bản
-        image_with_faces, faces = face_processor.detect_faces(image, resize_output=resize_output)
+        image_with_faces = face_processor.draw_faces(detection, resize_output=resize_output)
+        faces = detection.faces
     
     # Hiển thị số lượng khuôn mặt được phát hiện
     print(f"Đã phát hiện {len(faces)} khuôn mặt")
@@ -171,7 +285,7 @@ def main():
     
     # Cắt và lưu từng khuôn mặt riêng biệt nếu được yêu cầu
     if args.extract_faces and len(faces) > 0:
-        face_images = face_processor.extract_faces(image)  # Sửa 'detector' thành 'face_processor'
+        face_images = face_processor.extract_faces(detection)
         for i, face_img in enumerate(face_images):
             face_filename = f"{os.path.splitext(output_filename)[0]}_face_{i+1}.jpg"
             face_path = os.path.join(results_dir, face_filename)
@@ -0,0 +1,124 @@
+import argparse
+import os
+from video_processor import run_video, write_timeline
+from detector_profiles import resolve_detector_options
+
+def main():
+    # Đường dẫn thư mục hiện tại
+    current_dir = os.path.dirname(os.path.abspath(__file__))  # thư mục haarcascades
+
+    # Đường dẫn thư mục dự án (đi lên 1 cấp từ haarcascades)
+    base_dir = os.path.dirname(current_dir)
+
+    # Đường dẫn thư mục kết quả
+    results_dir = os.path.join(base_dir, "results")
+
+    # Tạo thư mục nếu chưa tồn tại
+    os.makedirs(results_dir, exist_ok=True)
+
+    # Phân tích tham số dòng lệnh
+    parser = argparse.ArgumentParser(description='Phát hiện/nhận diện khuôn mặt trong file video (vd: video CCTV)')
+    parser.add_argument('--video', required=True, help='Đường dẫn file video')
+    parser.add_argument('--cascade', default='haarcascade_frontalface_default.xml',
+                        help='Tên file cascade trong thư mục haarcascades')
+    parser.add_argument('--output',
+                        help='File dòng thời gian trong thư mục results, .json hoặc .csv '
+                             '(mặc định: <tên video>_timeline.json)')
+    parser.add_argument('--stride', type=int, default=1,
+                        help='Xử lý một khung trong mỗi N khung (vd: 5 với video 25 fps là 5 khung/giây, mặc định: 1)')
+    parser.add_argument('--workers', type=int,
+                        help='Số tiến trình xử lý song song các đoạn video (mặc định: số lõi CPU)')
+    parser.add_argument('--segment-seconds', type=float, default=60.0,
+                        help='Độ dài tối đa (giây) của một đoạn giao cho một tiến trình (mặc định: 60)')
+    parser.add_argument('--merge-gap', type=float,
+                        help='Khoảng trống tối đa (giây) giữa hai lần thấy cùng một người trong một lần xuất hiện '
+                             '(mặc định: max(1, 2 x stride / fps))')
+    parser.add_argument('--recognition-mode', action='store_true',
+                        help='Bật chế độ nhận diện người dùng')
+    parser.add_argument('--confidence', type=float, default=50.0,
+                        help='Ngưỡng độ tin cậy cho nhận diện (0-100, mặc định: 50)')
+    parser.add_argument('--detect-scale', type=float,
+                        help='Tỷ lệ thu nhỏ ảnh trước khi phát hiện (0-1.0, vd: 0.5)')
+    parser.add_argument('--detect-max-side', type=int,
+                        help='Cạnh dài nhất của ảnh dùng để phát hiện, tính bằng pixel (vd: 960)')
+    parser.add_argument('--profile',
+                        help='Profile tham số phát hiện đã lưu bằng autotune.py (vd: kiosk-fast); '
+                             'các tham số --detect-* ghi đè profile')
+    parser.add_argument('--track-interval', type=int, default=0,
+                        help='Chạy cascade mỗi N khung được xử lý, theo dõi khuôn mặt ở các khung còn lại (0: tắt)')
+    parser.add_argument('--identity-cache', action='store_true',
+                        help='Dùng lại kết quả nhận diện của mỗi khuôn mặt được theo dõi, chỉ xác minh lại định kỳ')
+    parser.add_argument('--reverify-interval', type=int, default=15,
+                        help='Xác minh lại danh tính ít nhất mỗi N khung khi dùng --identity-cache (mặc định: 15)')
+
+    args = parser.parse_args()
+
+    # Xây dựng đường dẫn đầy đủ
+    video_path = os.path.abspath(args.video)
+    cascade_path = os.path.join(current_dir, args.cascade)
+    if args.output is None:
+        output_filename = f"{os.path.splitext(os.path.basename(video_path))[0]}_timeline.json"
+    else:
+        output_filename = args.output
+    output_path = os.path.join(results_dir, output_filename)
+
+    # Kiểm tra file đầu vào tồn tại
+    if not os.path.isfile(video_path):
+        print(f"Lỗi: Không tìm thấy file video '{video_path}'")
+        return
+
+    if not os.path.isfile(cascade_path):
+        print(f"Lỗi: Không tìm thấy file cascade '{cascade_path}'")
+        return
+
+    if args.stride < 1:
+        print("Lỗi: --stride phải lớn hơn 0")
+        return
+
+    try:
+        detector_options = resolve_detector_options(args.profile, detection_scale=args.detect_scale,
+                                                    max_detection_side=args.detect_max_side)
+    except ValueError as e:
+        print(f"Lỗi: {str(e)}")
+        return
+
+    print(f"Đang xử lý video: {video_path}")
+    try:
+        timeline = run_video(
+            video_path, cascade_path,
+            recognition_mode=args.recognition_mode,
+            confidence=args.confidence,
+            stride=args.stride,
+            workers=args.workers,
+            segment_seconds=args.segment_seconds,
+            max_gap=args.merge_gap,
+            detector_options=detector_options,
+            track_interval=args.track_interval,
+            identity_cache=args.identity_cache,
+            reverify_interval=args.reverify_interval
+        )
+    except ValueError as e:
+        print(f"Lỗi: {str(e)}")
+        return
+
+    write_timeline(timeline, output_path)
+
+    # Hiển thị thống kê
+    print(f"\nĐã xử lý {timeline['frames_processed']} khung trong {timeline['elapsed']:.2f} giây "
+          f"(video dài {timeline['duration']:.1f} giây)")
+    if timeline['elapsed'] > 0:
+        print(f"Tốc độ: {timeline['frames_processed'] / timeline['elapsed']:.1f} khung/giây, "
+              f"{timeline['duration'] / timeline['elapsed']:.1f} lần thời gian thực")
+    print(f"Số khung có khuôn mặt: {len(timeline['frames'])}")
+    print(f"Số lần xuất hiện: {len(timeline['appearances'])}")
+    for appearance in timeline['appearances'][:20]:
+        who = appearance['name'] or "Khuôn mặt"
+        print(f"- {who}: {appearance['start']:.1f}s - {appearance['end']:.1f}s ({appearance['detections']} lần)")
+    if len(timeline['appearances']) > 20:
+        print(f"- ... và {len(timeline['appearances']) - 20} lần khác")
+    if timeline['errors']:
+        print(f"Lỗi ở {len(timeline['errors'])} đoạn")
+    print(f"Đã lưu dòng thời gian tại '{output_path}'")
+
+if __name__ == "__main__":
+    main()
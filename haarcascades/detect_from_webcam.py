@@ -5,6 +5,13 @@ import os
 import time
 from face_detector import FaceDetector
 from face_recognizer import FaceRecognizer
+from webcam_pipeline import WebcamPipeline
+from face_tracker import FaceTracker
+from streaming_detector import StreamingFaceDetector
+from model_watcher import ModelWatcher
+from identity_cache import IdentityCache
+from metrics import Metrics, MetricsExporter
+from detector_profiles import resolve_detector_options
 
 def list_available_cameras():
     """Liệt kê các camera khả dụng trong hệ thống"""
@@ -59,6 +66,37 @@ def main():
                         help='Ngưỡng độ tin cậy cho nhận diện (0-100, mặc định: 50)')
     parser.add_argument('--show-details', action='store_true',
                         help='Hiển thị thông tin chi tiết của người dùng')
+    parser.add_argument('--detect-scale', type=float,
+                        help='Tỷ lệ thu nhỏ ảnh trước khi phát hiện (0-1.0, vd: 0.5)')
+    parser.add_argument('--detect-max-side', type=int,
+                        help='Cạnh dài nhất của ảnh dùng để phát hiện, tính bằng pixel (vd: 960)')
+    parser.add_argument('--profile',
+                        help='Profile tham số phát hiện đã lưu bằng autotune.py (vd: kiosk-fast); '
+                             'các tham số --detect-* ghi đè profile')
+    parser.add_argument('--roi-redetect', action='store_true',
+                        help='Chỉ quét lại vùng quanh khuôn mặt ở khung trước, quét toàn khung định kỳ hoặc khi có chuyển động')
+    parser.add_argument('--full-scan-interval', type=int, default=30,
+                        help='Quét toàn khung ít nhất mỗi N khung hình khi dùng --roi-redetect (mặc định: 30)')
+    parser.add_argument('--track-interval', type=int, default=0,
+                        help='Chạy cascade mỗi N khung hình, theo dõi khuôn mặt ở các khung còn lại (0: tắt)')
+    parser.add_argument('--track-confidence', type=float, default=0.6,
+                        help='Điểm khớp tối thiểu để tiếp tục theo dõi trước khi chạy lại cascade (mặc định: 0.6)')
+    parser.add_argument('--show-pipeline-stats', action='store_true',
+                        help='Hiển thị độ sâu hàng đợi, số khung bị bỏ và độ trễ của pipeline')
+    parser.add_argument('--encode-queue', type=int, default=32,
+                        help='Số khung tối đa chờ ghi video (mặc định: 32)')
+    parser.add_argument('--identity-cache', action='store_true',
+                        help='Dùng lại kết quả nhận diện của mỗi khuôn mặt được theo dõi, chỉ xác minh lại định kỳ')
+    parser.add_argument('--reverify-interval', type=int, default=15,
+                        help='Xác minh lại danh tính ít nhất mỗi N khung hình khi dùng --identity-cache (mặc định: 15)')
+    parser.add_argument('--reload-interval', type=float, default=2.0,
+                        help='Chu kỳ (giây) kiểm tra và nạp lại mô hình/người dùng mới trong chế độ nhận diện (0: tắt)')
+    parser.add_argument('--metrics', action='store_true',
+                        help='Đo thời gian từng giai đoạn và in p50/p95/p99 khi kết thúc')
+    parser.add_argument('--metrics-file',
+                        help='Ghi số liệu theo định dạng Prometheus ra file này định kỳ (bật --metrics)')
+    parser.add_argument('--metrics-interval', type=float, default=10.0,
+                        help='Chu kỳ (giây) ghi file số liệu (mặc định: 10)')
     
     args = parser.parse_args()
     
@@ -83,17 +121,59 @@ def main():
         return
     
     # Khởi tạo bộ phát hiện hoặc nhận diện khuôn mặt
+    try:
+        detector_options = resolve_detector_options(args.profile, detection_scale=args.detect_scale,
+                                                    max_detection_side=args.detect_max_side)
+    except ValueError as e:
+        print(f"Lỗi: {str(e)}")
+        return
     try:
         if args.recognition_mode:
             print("Khởi động chế độ nhận diện người dùng...")
-            face_processor = FaceRecognizer(cascade_path)
+            face_processor = FaceRecognizer(cascade_path, **detector_options)
         else:
             print("Khởi động chế độ phát hiện khuôn mặt cơ bản...")
-            face_processor = FaceDetector(cascade_path)
+            face_processor = FaceDetector(cascade_path, **detector_options)
     except Exception as e:
         print(f"Lỗi khi khởi tạo: {str(e)}")
         return
     
+    # Phát hiện giới hạn trong vùng quanh khuôn mặt cũ và/hoặc theo dõi giữa các lần chạy cascade
+    detector = face_processor.detector if args.recognition_mode else face_processor
+    detect_fn = detector.detect_gray
+    streaming_detector = None
+    if args.roi_redetect:
+        streaming_detector = StreamingFaceDetector(detector, full_scan_interval=args.full_scan_interval)
+        detect_fn = streaming_detector.update
+        print(f"Quét lại theo vùng quanh khuôn mặt, quét toàn khung mỗi {args.full_scan_interval} khung hình")
+    
+    tracker = None
+    if args.track_interval > 1:
+        tracker = FaceTracker(detect_fn, detect_interval=args.track_interval,
+                              min_confidence=args.track_confidence)
+        face_processor.attach_tracker(tracker)
+        print(f"Chạy cascade mỗi {args.track_interval} khung hình, theo dõi ở các khung còn lại")
+    elif streaming_detector is not None:
+        face_processor.attach_tracker(streaming_detector)
+    
+    # Dùng lại danh tính đã nhận diện cho mỗi khuôn mặt được theo dõi
+    identity_cache = None
+    if args.recognition_mode and args.identity_cache:
+        identity_cache = IdentityCache(reverify_interval=args.reverify_interval)
+        face_processor.attach_identity_cache(identity_cache)
+        print(f"Dùng lại danh tính theo track, xác minh lại mỗi {args.reverify_interval} khung hình")
+    
+    # Số liệu hiệu năng theo giai đoạn (không đo gì nếu không bật)
+    metrics = None
+    if args.metrics or args.metrics_file:
+        metrics = Metrics()
+        face_processor.attach_metrics(metrics)
+    
+    # Nạp lại mô hình ở luồng nền khi người dùng được thêm/xóa từ tiến trình khác
+    model_watcher = None
+    if args.recognition_mode and args.reload_interval > 0:
+        model_watcher = ModelWatcher(face_processor, interval=args.reload_interval).start()
+    
     # Mở camera
     cap = cv2.VideoCapture(args.camera)
     if not cap.isOpened():
@@ -131,60 +211,71 @@ def main():
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # hoặc 'XVID' cho .avi
         video_writer = cv2.VideoWriter(output_path, fourcc, args.fps, (frame_width, frame_height))
     
-    face_counter = 0  # Bộ đếm khuôn mặt
+    # Hàm xử lý một khung hình, chạy trên luồng suy luận của pipeline
+    def process_frame(frame):
+        if args.recognition_mode:
+            # Chế độ nhận diện người dùng
+            recognized_faces = face_processor.recognize_face(frame, args.confidence)
+            frame_with_faces = face_processor.draw_recognized_faces(frame, recognized_faces, args.show_details)
+            return frame_with_faces, [face_info["bbox"] for face_info in recognized_faces]
+        # Chế độ phát hiện khuôn mặt cơ bản
+        return face_processor.detect_faces(frame)
+    
+    pipeline = WebcamPipeline(cap, process_frame, flip=args.flip, video_writer=video_writer,
+                              encode_queue_size=args.encode_queue, metrics=metrics)
+    metrics_exporter = None
+    if args.metrics_file:
+        metrics_exporter = MetricsExporter(metrics, args.metrics_file, args.metrics_interval).start()
+    
     start_time = time.time()
-    frame_count = 0
+    last_packet = None
     
     print("Đang chạy nhận diện từ webcam...")
     print("Nhấn 'q' để thoát, 's' để chụp ảnh")
     
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("Lỗi đọc khung hình từ camera")
-            break
-        
-        # Lật hình nếu được yêu cầu
-        if args.flip is not None:
-            frame = cv2.flip(frame, args.flip)
-        
-        frame_count += 1
+    pipeline.start()
+    while pipeline.is_running():
+        packet = pipeline.get_result()
         
-        # Xử lý khung hình tùy theo chế độ
-        if args.recognition_mode:
-            # Chế độ nhận diện người dùng
-            recognized_faces = face_processor.recognize_face(frame, args.confidence)
-            frame_with_faces = face_processor.draw_recognized_faces(frame, recognized_faces, args.show_details)
-            num_faces = len(recognized_faces)
-        else:
-            # Chế độ phát hiện khuôn mặt cơ bản
-            frame_with_faces, faces = face_processor.detect_faces(frame)
-            num_faces = len(faces)
-        
-        # Tính FPS
-        elapsed_time = time.time() - start_time
-        if elapsed_time > 0:
-            fps = frame_count / elapsed_time
-            cv2.putText(frame_with_faces, f"FPS: {fps:.2f}", (10, 30), 
+        if packet is not None:
+            frame_with_faces = packet.output
+            
+            # Tính FPS theo số khung hình đã hiển thị
+            elapsed_time = time.time() - start_time
+            if elapsed_time > 0:
+                fps = pipeline.frames_rendered / elapsed_time
+                cv2.putText(frame_with_faces, f"FPS: {fps:.2f}", (10, 30), 
+                            cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            
+            # Hiển thị số lượng khuôn mặt
+            text = f"Faces: {packet.num_faces}"
+            cv2.putText(frame_with_faces, text, (10, 70), 
                         cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        
-        # Hiển thị số lượng khuôn mặt
-        text = f"Faces: {num_faces}"
-        cv2.putText(frame_with_faces, text, (10, 70), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        
-        # Thêm chỉ dẫn
-        mode_text = "Chế độ: Nhận diện người dùng" if args.recognition_mode else "Chế độ: Phát hiện cơ bản"
-        cv2.putText(frame_with_faces, mode_text, (10, frame_height - 30), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-        
-        # Hiển thị khung hình
-        window_title = "Nhận diện người dùng" if args.recognition_mode else "Phát hiện khuôn mặt"
-        cv2.imshow(window_title, frame_with_faces)
-        
-        # Lưu video nếu cần
-        if args.save_video and video_writer is not None:
-            video_writer.write(frame_with_faces)
+            
+            # Hiển thị độ sâu hàng đợi, số khung bị bỏ và độ trễ của pipeline
+            if args.show_pipeline_stats:
+                stats = pipeline.stats()
+                stats_text = (f"Q {stats['capture_queue_depth']}/{stats['render_queue_depth']}/"
+                              f"{stats['encode_queue_depth']} Drop {stats['capture_dropped']}/"
+                              f"{stats['render_dropped']}/{stats['encode_dropped']} "
+                              f"Lat {stats['last_latency_ms']:.0f}ms")
+                if args.recognition_mode:
+                    stats_text += f" Model v{face_processor.model_version}/g{face_processor.generation}"
+                cv2.putText(frame_with_faces, stats_text, (10, 105), 
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+            
+            # Thêm chỉ dẫn
+            mode_text = "Chế độ: Nhận diện người dùng" if args.recognition_mode else "Chế độ: Phát hiện cơ bản"
+            cv2.putText(frame_with_faces, mode_text, (10, frame_height - 30), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            
+            # Hiển thị khung hình
+            window_title = "Nhận diện người dùng" if args.recognition_mode else "Phát hiện khuôn mặt"
+            cv2.imshow(window_title, frame_with_faces)
+            
+            # Lưu video nếu cần (ghi trên luồng riêng)
+            pipeline.submit_for_encoding(packet)
+            last_packet = packet
         
         # Đọc phím nhấn
         key = cv2.waitKey(1) & 0xFF
@@ -194,15 +285,16 @@ def main():
             break
             
         # Nếu nhấn 's', chụp ảnh hiện tại
-        elif key == ord('s'):
+        elif key == ord('s') and last_packet is not None:
             timestamp = time.strftime("%Y%m%d_%H%M%S")
             snapshot_path = os.path.join(results_dir, f"webcam_snapshot_{timestamp}.jpg")
-            cv2.imwrite(snapshot_path, frame_with_faces)
+            cv2.imwrite(snapshot_path, last_packet.output)
             print(f"Đã lưu ảnh chụp tại '{snapshot_path}'")
             
             # Lưu khuôn mặt nếu được yêu cầu và đang ở chế độ phát hiện cơ bản
             if args.extract_faces and not args.recognition_mode:
-                face_images = face_processor.extract_faces(frame)
+                # Dùng lại kết quả phát hiện của khung hình, không chạy cascade lần nữa
+                face_images = face_processor.extract_faces(last_packet.frame, faces=last_packet.faces)
                 for i, face_img in enumerate(face_images):
                     face_filename = f"webcam_face_{timestamp}_{i+1}.jpg"
                     face_path = os.path.join(results_dir, face_filename)
@@ -210,6 +302,16 @@ def main():
                     print(f"Đã lưu khuôn mặt {i+1} tại '{face_path}'")
     
     # Giải phóng tài nguyên
+    pipeline.stop()
+    if pipeline.error:
+        print(pipeline.error)
+    if model_watcher is not None:
+        model_watcher.stop()
+    if metrics_exporter is not None:
+        metrics_exporter.stop()
+    if args.recognition_mode:
+        # Ghi nốt các cập nhật last_recognized đang chờ
+        face_processor.close()
     cap.release()
     if video_writer is not None:
         video_writer.release()
@@ -217,10 +319,34 @@ def main():
     
     # Hiển thị thống kê
     elapsed_time = time.time() - start_time
+    stats = pipeline.stats()
     print(f"\nTổng thời gian chạy: {elapsed_time:.2f} giây")
-    print(f"Số frame đã xử lý: {frame_count}")
+    print(f"Số frame đã thu: {stats['captured']}, đã xử lý: {stats['processed']}, "
+          f"đã hiển thị: {stats['rendered']}, đã ghi: {stats['encoded']}")
+    print(f"Số frame bị bỏ - thu hình: {stats['capture_dropped']}, hiển thị: {stats['render_dropped']}, "
+          f"ghi video: {stats['encode_dropped']}")
+    print(f"Độ trễ trung bình: {stats['avg_latency_ms']:.1f} ms")
     if elapsed_time > 0:
-        print(f"FPS trung bình: {frame_count / elapsed_time:.2f}")
+        print(f"FPS trung bình: {stats['rendered'] / elapsed_time:.2f}")
+    if tracker is not None:
+        print(f"Số lần chạy cascade: {tracker.detect_count}, số khung theo dõi: {tracker.track_count}")
+    if streaming_detector is not None:
+        print(f"Quét toàn khung: {streaming_detector.full_scans} lần "
+              f"({streaming_detector.motion_triggers} lần do chuyển động), "
+              f"quét theo vùng: {streaming_detector.roi_scans} lần")
+    if identity_cache is not None:
+        cache_stats = identity_cache.stats()
+        print(f"Bộ nhớ đệm danh tính: {cache_stats['verifications']}/{cache_stats['lookups']} khuôn mặt phải nhận diện "
+              f"(dùng lại {cache_stats['hit_rate']:.1%}), đổi danh tính: {cache_stats['switches']} lần")
+    if model_watcher is not None:
+        print(f"Phiên bản mô hình: {face_processor.model_version}, thế hệ: {face_processor.generation}, "
+              f"số lần nạp lại: {model_watcher.reload_count}")
+    if metrics is not None:
+        print("Thời gian theo giai đoạn:")
+        for line in metrics.summary():
+            print(f"  {line}")
+    if metrics_exporter is not None:
+        print(f"Số liệu đã được ghi tại: '{args.metrics_file}'")
     
     if args.save_video:
         print(f"Video kết quả đã được lưu tại: '{output_path}'")
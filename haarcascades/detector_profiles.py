@@ -0,0 +1,93 @@
+import os
+import json
+from persistence import atomic_write_json
+
+# File lưu các profile tham số phát hiện (tạo bởi autotune.py)
+PROFILES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "detector_profiles.json")
+
+# Các tham số của FaceDetector được lưu trong profile
+PROFILE_KEYS = ("scale_factor", "min_neighbors", "min_size", "detection_scale", "max_detection_side")
+
+# Profile có sẵn: tham số mặc định của FaceDetector
+BUILTIN_PROFILES = {
+    "default": {"scale_factor": 1.1, "min_neighbors": 5, "min_size": [30, 30]},
+}
+
+
+def load_profiles(path=None):
+    """
+    Đọc tất cả profile (profile có sẵn và profile trong file)
+
+    Args:
+        path: File profile (mặc định: PROFILES_FILE)
+
+    Returns:
+        dict: {tên: profile}; profile gồm các tham số PROFILE_KEYS và (tùy chọn) "measured"
+    """
+    path = path or PROFILES_FILE
+    profiles = {name: dict(profile) for name, profile in BUILTIN_PROFILES.items()}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            profiles.update(json.load(f).get("profiles", {}))
+    return profiles
+
+
+def get_profile(name, path=None):
+    """
+    Tham số phát hiện của một profile
+
+    Returns:
+        dict: Tham số cho FaceDetector (min_size dạng tuple)
+
+    Raises:
+        ValueError: Không có profile tên name
+    """
+    profiles = load_profiles(path)
+    if name not in profiles:
+        raise ValueError(f"Không tìm thấy profile '{name}' (có: {', '.join(sorted(profiles))})")
+    options = {key: profiles[name][key] for key in PROFILE_KEYS if profiles[name].get(key) is not None}
+    if "min_size" in options:
+        options["min_size"] = tuple(options["min_size"])
+    return options
+
+
+def resolve_detector_options(profile=None, path=None, **overrides):
+    """
+    Tham số cho FaceDetector: tham số của profile, sau đó là các giá trị khác None trong overrides
+
+    Dùng cho các CLI: tham số dòng lệnh được chỉ định rõ sẽ ghi đè profile.
+
+    Args:
+        profile: Tên profile hoặc None
+        path: File profile (mặc định: PROFILES_FILE)
+        overrides: Tham số FaceDetector (giá trị None bị bỏ qua)
+    """
+    options = get_profile(profile, path) if profile else {}
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return options
+
+
+def save_profile(name, options, measured=None, path=None):
+    """
+    Lưu (hoặc thay) một profile vào file
+
+    Args:
+        name: Tên profile, vd: "kiosk-fast"
+        options: Tham số FaceDetector (các khóa trong PROFILE_KEYS)
+        measured: Số liệu đo được khi tinh chỉnh (recall, precision, ms_per_image...)
+        path: File profile (mặc định: PROFILES_FILE)
+    """
+    if name in BUILTIN_PROFILES:
+        raise ValueError(f"Không thể ghi đè profile có sẵn '{name}'")
+    path = path or PROFILES_FILE
+    data = {"profiles": {}}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    profile = {key: options[key] for key in PROFILE_KEYS if options.get(key) is not None}
+    if "min_size" in profile:
+        profile["min_size"] = [int(v) for v in profile["min_size"]]
+    if measured:
+        profile["measured"] = measured
+    data.setdefault("profiles", {})[name] = profile
+    atomic_write_json(path, data)
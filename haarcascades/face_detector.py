@@ -1,58 +1,241 @@
 import cv2
 import numpy as np
+from metrics import timed
+from detector_profiles import resolve_detector_options
 
 class FaceDetector:
-    def __init__(self, cascade_path):
+    def __init__(self, cascade_path, scale_factor=1.1, min_neighbors=5, min_size=(30, 30),
+                 detection_scale=None, max_detection_side=None):
         """
         Khởi tạo FaceDetector với đường dẫn đến file XML của Haar Cascade
         
         Args:
             cascade_path: Đường dẫn đến file Haar Cascade XML
+            scale_factor: Tỷ lệ thu nhỏ ảnh mỗi lần quét
+            min_neighbors: Số lượng hàng xóm tối thiểu để xác định đối tượng
+            min_size: Kích thước tối thiểu của khuôn mặt (theo ảnh gốc)
+            detection_scale: Tỷ lệ thu nhỏ ảnh trước khi chạy cascade (0-1.0), None để giữ nguyên
+            max_detection_side: Cạnh dài nhất của ảnh dùng để phát hiện (pixel), None để không giới hạn
         """
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = tuple(min_size)
+        self.detection_scale = detection_scale
+        self.max_detection_side = max_detection_side
+        
         # Tải bộ phân loại Haar Cascade
         self.face_cascade = cv2.CascadeClassifier(cascade_path)
         if self.face_cascade.empty():
             raise ValueError(f"Không thể tải cascade từ {cascade_path}")
         print(f"Đã tải thành công bộ phân loại từ {cascade_path}")
+        
+        # Bộ theo dõi tùy chọn (xem attach_tracker)
+        self.tracker = None
+        # Số liệu hiệu năng tùy chọn (xem attach_metrics)
+        self.metrics = None
     
-    def detect_faces(self, image, resize_output=None):
+    @classmethod
+    def from_profile(cls, cascade_path, profile, **overrides):
         """
-        Phát hiện khuôn mặt trong ảnh
+        Tạo FaceDetector với tham số của một profile đã lưu (xem detector_profiles, autotune.py)
+        
+        Args:
+            cascade_path: Đường dẫn đến file Haar Cascade XML
+            profile: Tên profile, vd: "default", "kiosk-fast"
+            overrides: Tham số ghi đè profile (giá trị None bị bỏ qua)
+        """
+        return cls(cascade_path, **resolve_detector_options(profile, **overrides))
+    
+    def attach_tracker(self, tracker):
+        """
+        Gắn bộ theo dõi để không phải chạy cascade trên mọi khung hình
+        
+        Args:
+            tracker: Đối tượng có phương thức update(gray) trả về các khung (x, y, w, h),
+                     hoặc None để quay lại chạy cascade mỗi lần
+        """
+        self.tracker = tracker
+    
+    def attach_metrics(self, metrics):
+        """
+        Gắn bộ thu thập số liệu hiệu năng
+        
+        Args:
+            metrics: Metrics ghi thời gian của các giai đoạn cvtcolor, detect, draw và bộ đếm
+                     frames, faces; None để tắt (không tốn chi phí đo)
+        """
+        self.metrics = metrics
+    
+    def get_detection_scale(self, image_shape):
+        """
+        Tính tỷ lệ thu nhỏ ảnh dùng để phát hiện
+        
+        Args:
+            image_shape: Kích thước ảnh (h, w, ...)
+            
+        Returns:
+            float: Tỷ lệ trong khoảng (0, 1.0], 1.0 nghĩa là phát hiện trên ảnh gốc
+        """
+        scale = 1.0
+        if self.detection_scale is not None and 0 < self.detection_scale < 1.0:
+            scale = self.detection_scale
+        if self.max_detection_side:
+            longest = max(image_shape[:2])
+            if longest * scale > self.max_detection_side:
+                scale = self.max_detection_side / float(longest)
+        return scale
+    
+    def detect_gray(self, gray, min_size=None, max_size=None):
+        """
+        Chạy Haar Cascade trên ảnh xám
+        
+        Nếu có cấu hình độ phân giải phát hiện, cascade chạy trên bản thu nhỏ
+        và các khung được quy đổi lại tọa độ của ảnh gốc.
+        
+        Args:
+            gray: Ảnh xám
+            min_size: Kích thước khuôn mặt tối thiểu (w, h), None để dùng giá trị mặc định
+            max_size: Kích thước khuôn mặt tối đa (w, h), None để không giới hạn
+            
+        Returns:
+            faces: Danh sách các khuôn mặt được phát hiện (x, y, w, h) theo tọa độ ảnh gốc
+        """
+        if min_size is None:
+            min_size = self.min_size
+        
+        with timed(self.metrics, "detect"):
+            return self._detect_gray(gray, min_size, max_size)
+    
+    def _detect_gray(self, gray, min_size, max_size):
+        return self._run_cascade(self.face_cascade, gray, min_size, max_size)[0]
+    
+    def _run_cascade(self, cascade, gray, min_size, max_size):
+        """
+        Chạy một bộ phân loại trên ảnh xám với tham số và độ phân giải phát hiện của detector
+        
+        Returns:
+            tuple: (các khung (x, y, w, h) theo tọa độ ảnh gốc,
+                    số lượt phát hiện được gộp vào mỗi khung - dùng làm độ tin cậy)
+        """
+        scale = self.get_detection_scale(gray.shape)
+        if scale >= 1.0:
+            # scaleFactor: Tỷ lệ thu nhỏ ảnh mỗi lần quét
+            # minNeighbors: Số lượng hàng xóm tối thiểu để xác định đối tượng
+            # minSize/maxSize: Kích thước tối thiểu/tối đa của khuôn mặt
+            return cascade.detectMultiScale2(
+                gray, 
+                scaleFactor=self.scale_factor, 
+                minNeighbors=self.min_neighbors,
+                minSize=tuple(min_size),
+                maxSize=tuple(max_size) if max_size else (0, 0)
+            )
+        
+        # Phát hiện trên ảnh thu nhỏ, minSize/maxSize được thu nhỏ theo cùng tỷ lệ
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        min_size = (max(1, int(round(min_size[0] * scale))),
+                    max(1, int(round(min_size[1] * scale))))
+        if max_size:
+            max_size = (max(1, int(round(max_size[0] * scale))),
+                        max(1, int(round(max_size[1] * scale))))
+        faces, counts = cascade.detectMultiScale2(
+            small,
+            scaleFactor=self.scale_factor,
+            minNeighbors=self.min_neighbors,
+            minSize=min_size,
+            maxSize=max_size if max_size else (0, 0)
+        )
+        if len(faces) == 0:
+            return faces, counts
+        
+        # Quy đổi tọa độ về ảnh gốc
+        return np.round(np.asarray(faces) / scale).astype(np.int32), counts
+    
+    def find_faces(self, gray):
+        """
+        Tìm khuôn mặt trên ảnh xám, qua bộ theo dõi nếu đã được gắn
+        
+        Args:
+            gray: Ảnh xám
+            
+        Returns:
+            faces: Danh sách các khuôn mặt (x, y, w, h)
+        """
+        if self.tracker is not None:
+            return self.tracker.update(gray)
+        return self.detect_gray(gray)
+    
+    def analyze(self, image):
+        """
+        Chạy pipeline phát hiện một lần cho ảnh: chuyển ảnh xám và tìm khuôn mặt
+        
+        Kết quả được dùng lại cho việc vẽ, đếm, cắt và nhận diện khuôn mặt
+        mà không phải chạy lại cvtColor/detectMultiScale.
         
         Args:
             image: Ảnh đầu vào (BGR)
-            resize_output: Kích thước đầu ra dạng (width, height) hoặc None để giữ nguyên
             
         Returns:
-            image_with_faces: Ảnh với các khuôn mặt được đánh dấu
-            faces: Danh sách các khuôn mặt được phát hiện (x, y, w, h)
+            DetectionResult: Ảnh gốc, ảnh xám và các khuôn mặt được phát hiện
         """
         # Chuyển sang ảnh xám để tăng hiệu suất xử lý
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        with timed(self.metrics, "cvtcolor"):
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
         # Phát hiện khuôn mặt
-        # scaleFactor: Tỷ lệ thu nhỏ ảnh mỗi lần quét
-        # minNeighbors: Số lượng hàng xóm tối thiểu để xác định đối tượng
-        # minSize: Kích thước tối thiểu của khuôn mặt
-        faces = self.face_cascade.detectMultiScale(
-            gray, 
-            scaleFactor=1.1, 
-            minNeighbors=5,
-            minSize=(30, 30)
-        )
+        faces = self.find_faces(gray)
         
-        # Tạo bản sao của ảnh để vẽ lên đó
-        image_with_faces = image.copy()
+        if self.metrics is not None:
+            self.metrics.inc("frames")
+            self.metrics.inc("faces", len(faces))
+        return DetectionResult(image, gray, faces)
+    
+    def _as_result(self, image):
+        """Nhận ảnh hoặc DetectionResult, trả về DetectionResult"""
+        if isinstance(image, DetectionResult):
+            return image
+        return self.analyze(image)
+    
+    def draw_faces(self, image, resize_output=None):
+        """
+        Vẽ khung các khuôn mặt đã phát hiện
         
-        # Vẽ hình chữ nhật xung quanh các khuôn mặt
-        for (x, y, w, h) in faces:
-            cv2.rectangle(image_with_faces, (x, y), (x+w, y+h), (0, 255, 0), 2)
+        Args:
+            image: DetectionResult hoặc ảnh đầu vào (BGR, sẽ được phát hiện trước)
+            resize_output: Kích thước đầu ra dạng (width, height) hoặc None để giữ nguyên
+            
+        Returns:
+            image_with_faces: Ảnh với các khuôn mặt được đánh dấu
+        """
+        result = self._as_result(image)
+        
+        with timed(self.metrics, "draw"):
+            # Tạo bản sao của ảnh để vẽ lên đó
+            image_with_faces = result.image.copy()
+            
+            # Vẽ hình chữ nhật xung quanh các khuôn mặt
+            for (x, y, w, h) in result.faces:
+                cv2.rectangle(image_with_faces, (int(x), int(y)), (int(x+w), int(y+h)), (0, 255, 0), 2)
+            
+            # Điều chỉnh kích thước ảnh đầu ra nếu được yêu cầu
+            if resize_output is not None:
+                image_with_faces = self.resize_image(image_with_faces, resize_output)
         
-        # Điều chỉnh kích thước ảnh đầu ra nếu được yêu cầu
-        if resize_output is not None:
-            image_with_faces = self.resize_image(image_with_faces, resize_output)
+        return image_with_faces
+    
+    def detect_faces(self, image, resize_output=None):
+        """
+        Phát hiện khuôn mặt trong ảnh
         
-        return image_with_faces, faces
+        Args:
+            image: Ảnh đầu vào (BGR) hoặc DetectionResult
+            resize_output: Kích thước đầu ra dạng (width, height) hoặc None để giữ nguyên
+            
+        Returns:
+            image_with_faces: Ảnh với các khuôn mặt được đánh dấu
+            faces: Danh sách các khuôn mặt được phát hiện (x, y, w, h)
+        """
+        result = self._as_result(image)
+        return self.draw_faces(result, resize_output), result.faces
     
     def resize_image(self, image, size):
         """
@@ -82,30 +265,61 @@ class FaceDetector:
         Đếm số lượng khuôn mặt trong ảnh
         
         Args:
-            image: Ảnh đầu vào
+            image: Ảnh đầu vào hoặc DetectionResult
             
         Returns:
             count: Số lượng khuôn mặt
         """
-        _, faces = self.detect_faces(image)
-        return len(faces)
+        return len(self._as_result(image).faces)
     
-    def extract_faces(self, image, padding=0.2):
+    def extract_faces(self, image, padding=0.2, faces=None):
+        """
+        Cắt các khuôn mặt từ ảnh gốc
+        
+        Args:
+            image: Ảnh đầu vào hoặc DetectionResult
+            padding: Khoảng đệm xung quanh khuôn mặt (% của kích thước khuôn mặt)
+            faces: Các khung (x, y, w, h) đã phát hiện trước đó, None để phát hiện lại
+            
+        Returns:
+            face_images: Danh sách các ảnh khuôn mặt đã cắt
+        """
+        if faces is not None and not isinstance(image, DetectionResult):
+            return DetectionResult(image, None, faces).crop(padding)
+        return self._as_result(image).crop(padding)
+
+
+class DetectionResult:
+    """Kết quả phát hiện của một ảnh: ảnh gốc, ảnh xám và các khuôn mặt (x, y, w, h)"""
+    
+    def __init__(self, image, gray, faces):
+        """
+        Args:
+            image: Ảnh gốc (BGR)
+            gray: Ảnh xám tương ứng (có thể None nếu không cần nhận diện)
+            faces: Các khung (x, y, w, h)
+        """
+        self.image = image
+        self.gray = gray
+        self.faces = np.asarray(faces, dtype=np.int32).reshape(-1, 4)
+    
+    def __len__(self):
+        return len(self.faces)
+    
+    def crop(self, padding=0.2):
         """
         Cắt các khuôn mặt từ ảnh gốc
         
         Args:
-            image: Ảnh đầu vào
             padding: Khoảng đệm xung quanh khuôn mặt (% của kích thước khuôn mặt)
             
         Returns:
             face_images: Danh sách các ảnh khuôn mặt đã cắt
         """
-        _, faces = self.detect_faces(image)
         face_images = []
-        h, w = image.shape[:2]
+        h, w = self.image.shape[:2]
         
-        for (x, y, fw, fh) in faces:
+        for (x, y, fw, fh) in self.faces:
             # Thêm padding
             pad_w = int(fw * padding)
             pad_h = int(fh * padding)
@@ -117,8 +331,11 @@ class FaceDetector:
             y2 = min(h, y + fh + pad_h)
             
             # Cắt khuôn mặt
-            face_img = image[y1:y2, x1:x2]
+            face_img = self.image[y1:y2, x1:x2]
             face_images.append(face_img)
             
         return face_images
-    
\ No newline at end of file
+    
+    def gray_faces(self):
+        """Các vùng khuôn mặt trên ảnh xám (không padding), dùng cho nhận diện"""
+        return [self.gray[y:y+h, x:x+w] for (x, y, w, h) in self.faces]
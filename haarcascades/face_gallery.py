@@ -0,0 +1,546 @@
+import numpy as np
+
+
+def lbp_image(gray, radius=1, neighbors=8):
+    """
+    Ảnh mã LBP mở rộng (circular LBP), giống hệt elbp của LBPHFaceRecognizer
+
+    Args:
+        gray: Ảnh xám uint8
+        radius: Bán kính lấy mẫu
+        neighbors: Số điểm lân cận
+
+    Returns:
+        numpy.ndarray: Mảng (H - 2r) x (W - 2r) các mã LBP
+    """
+    src = gray.astype(np.float32)
+    rows, cols = src.shape
+    center = src[radius:rows - radius, radius:cols - radius]
+    dst = np.zeros(center.shape, dtype=np.int32)
+    eps = np.finfo(np.float32).eps
+
+    for n in range(neighbors):
+        # Tọa độ điểm lấy mẫu và trọng số nội suy song tuyến tính (tính bằng float32 như OpenCV)
+        x = np.float32(radius * np.cos(2.0 * np.pi * n / neighbors))
+        y = np.float32(-radius * np.sin(2.0 * np.pi * n / neighbors))
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        ty = np.float32(y - fy)
+        tx = np.float32(x - fx)
+        w1 = (1 - tx) * (1 - ty)
+        w2 = tx * (1 - ty)
+        w3 = (1 - tx) * ty
+        w4 = tx * ty
+
+        def shifted(dy, dx):
+            return src[radius + dy:rows - radius + dy, radius + dx:cols - radius + dx]
+
+        t = (w1 * shifted(fy, fx) + w2 * shifted(fy, cx) +
+             w3 * shifted(cy, fx) + w4 * shifted(cy, cx))
+        dst += (((t > center) | (np.abs(t - center) < eps)).astype(np.int32) << n)
+    return dst
+
+
+def spatial_histogram(lbp, num_patterns, grid_x=8, grid_y=8):
+    """
+    Histogram LBP theo lưới ô, chuẩn hóa theo số điểm ảnh mỗi ô (giống spatial_histogram của OpenCV)
+
+    Returns:
+        numpy.ndarray: Vector float32 độ dài grid_x * grid_y * num_patterns
+    """
+    height = lbp.shape[0] // grid_y
+    width = lbp.shape[1] // grid_x
+    # Cắt phần dư như OpenCV rồi gom các ô thành (grid_y * grid_x) x (height * width)
+    cells = lbp[:grid_y * height, :grid_x * width].reshape(grid_y, height, grid_x, width)
+    cells = cells.transpose(0, 2, 1, 3).reshape(grid_y * grid_x, height * width)
+
+    # Đếm mọi ô trong một lần bincount bằng cách dịch mã của mỗi ô sang vùng riêng
+    offsets = (np.arange(grid_y * grid_x) * num_patterns)[:, None]
+    counts = np.bincount((cells + offsets).ravel(), minlength=grid_y * grid_x * num_patterns)
+    if height * width == 0:
+        return counts.astype(np.float32)
+    return (counts / np.float32(height * width)).astype(np.float32)
+
+
+HISTOGRAM_DTYPES = ("float32", "float16", "uint8")
+
+# Số dòng dự trữ tối thiểu khi bộ đệm ma trận phải cấp phát lại (xem _RowBuffer)
+SPARE_ROWS = 16
+
+
+def quantize_histograms(histograms, dtype="float32", chunk_size=1024):
+    """
+    Chuyển ma trận histogram float32 sang kiểu lưu trữ gọn hơn
+
+    float16 giữ nguyên giá trị (sai số tương đối ~5e-4). uint8 dùng một hệ số
+    tỷ lệ cho mỗi dòng: histogram LBP là số đếm chia cho số điểm ảnh mỗi ô,
+    nên khi nhận ra được bước này (giá trị khác 0 nhỏ nhất) và số đếm không
+    vượt quá 255, histogram được lưu chính xác; ngược lại giá trị lớn nhất
+    của dòng ứng với 255.
+
+    Args:
+        histograms: Ma trận N x D histogram
+        dtype: "float32", "float16" hoặc "uint8"
+        chunk_size: Số dòng chuyển đổi mỗi lần (giới hạn bộ nhớ tạm)
+
+    Returns:
+        tuple: (ma trận kiểu dtype, hệ số tỷ lệ float32 của mỗi dòng hoặc None)
+    """
+    if dtype not in HISTOGRAM_DTYPES:
+        raise ValueError(f"Kiểu dữ liệu không hợp lệ: {dtype} (chỉ hỗ trợ {', '.join(HISTOGRAM_DTYPES)})")
+    if dtype != "uint8":
+        return np.ascontiguousarray(histograms, dtype=dtype), None
+
+    quantized = np.empty(histograms.shape, dtype=np.uint8)
+    scales = np.ones(len(histograms), dtype=np.float32)
+    for start in range(0, len(histograms), chunk_size):
+        block = np.asarray(histograms[start:start + chunk_size], dtype=np.float32)
+        peaks = block.max(axis=1)
+        block_scales = np.where(peaks > 0, peaks / np.float32(255.0), np.float32(1.0)).astype(np.float32)
+        steps = np.where(block > 0, block, np.inf).min(axis=1)
+        counts = block / steps[:, None]
+        exact = (np.isfinite(steps) & (peaks / steps < 255.5) &
+                 np.all(np.abs(counts - np.rint(counts)) < 1e-3, axis=1))
+        block_scales = np.where(exact, steps, block_scales).astype(np.float32)
+        quantized[start:start + len(block)] = np.rint(block / block_scales[:, None])
+        scales[start:start + len(block)] = block_scales
+    return quantized, scales
+
+
+class _RowBuffer:
+    """
+    Ma trận có dòng dự trữ ở cuối, dùng chung giữa các thư viện tạo bằng extended()
+
+    count là số dòng đang dùng bởi thư viện mới nhất. Ghi thêm chỉ điền vào
+    các dòng dự trữ sau count nên các thư viện cũ (xem các dòng [0, n) của
+    chúng) không bị ảnh hưởng. data có thể là memory-map ghi được của file mô
+    hình (xem LBPHModel.load_binary).
+    """
+    __slots__ = ("data", "count")
+
+    def __init__(self, data, count):
+        self.data = data
+        self.count = count
+
+    def appended(self, start, rows):
+        """
+        Bộ đệm chứa các dòng [0, start) hiện tại và rows ở sau
+
+        Ghi tại chỗ nếu còn dòng dự trữ, bộ đệm ghi được và chưa có thư viện nào
+        ghi tiếp sau start; ngược lại cấp phát bộ đệm lớn hơn (dư một nửa) và chép sang.
+        """
+        stop = start + len(rows)
+        if start == self.count and stop <= len(self.data) and self.data.flags.writeable:
+            self.data[start:stop] = rows
+            self.count = stop
+            return self
+        data = np.empty((stop + max(SPARE_ROWS, stop // 2),) + self.data.shape[1:], dtype=self.data.dtype)
+        data[:start] = self.data[:start]
+        data[start:stop] = rows
+        return _RowBuffer(data, stop)
+
+
+class FaceGallery:
+    """
+    Thư viện mẫu khuôn mặt cho việc so khớp vector hóa
+
+    Histogram LBP của mọi mẫu huấn luyện được đặt trong một ma trận NumPy liên
+    tục (N x D). Các khuôn mặt cần nhận diện (có thể là mọi khuôn mặt trong một
+    khung hình) được tính histogram một lần và so với toàn bộ thư viện bằng
+    các phép toán ma trận thay vì vòng lặp từng mẫu như LBPHFaceRecognizer.predict.
+
+    Với thư viện lớn, một bước lọc nhanh bằng khoảng cách Hellinger (một phép
+    nhân ma trận) chọn shortlist ứng viên trước, sau đó khoảng cách chính xác
+    chỉ được tính trên các ứng viên này: thời gian nhận diện mỗi khuôn mặt gần
+    như không tăng theo số mẫu.
+
+    Khoảng cách "chisqr" giống HISTCMP_CHISQR_ALT mà LBPHFaceRecognizer dùng.
+    Khi thư viện không lớn hơn shortlist (hoặc shortlist=0), mọi mẫu được so
+    khớp chính xác nên ứng viên tốt nhất trùng với kết quả predict(). Với thư
+    viện lớn hơn, kết quả là xấp xỉ: mẫu gần nhất theo chi-square có thể bị
+    loại ở bước lọc Hellinger, khi đó khoảng cách trả về lớn hơn (không bao
+    giờ nhỏ hơn) khoảng cách của predict() và nhãn có thể khác.
+
+    Histogram có thể được lưu dạng float16 hoặc uint8 (xem quantize_histograms)
+    để giảm 2-4 lần bộ nhớ; các phép tính khoảng cách vẫn thực hiện trên float32.
+
+    Ma trận histogram và chỉ mục lọc nhanh có dòng dự trữ (_RowBuffer) nên
+    extended() chỉ tốn chi phí theo số mẫu thêm vào, không chép lại thư viện.
+    """
+
+    METRICS = ("chisqr", "l1")
+
+    def __init__(self, histograms, labels, radius=1, neighbors=8, grid_x=8, grid_y=8,
+                 shortlist=256, chunk_size=1024, dtype="float32", scales=None, index=None):
+        """
+        Args:
+            histograms: Ma trận N x D histogram của các mẫu; có thể có thêm dòng dự trữ ở cuối
+                        (đã ở kiểu dtype, kèm scales với uint8) để ghi thêm tại chỗ
+            labels: N nhãn tương ứng
+            radius, neighbors, grid_x, grid_y: Tham số LBP (phải giống mô hình LBPH)
+            shortlist: Số ứng viên giữ lại sau bước lọc nhanh (0 để luôn so khớp chính xác toàn bộ)
+            chunk_size: Số mẫu xử lý mỗi lần khi tính khoảng cách chính xác (giới hạn bộ nhớ tạm)
+            dtype: Kiểu lưu trữ histogram ("float32", "float16" hoặc "uint8")
+            scales: Hệ số tỷ lệ mỗi dòng khi histograms đã được lượng tử hóa uint8 (tùy chọn)
+            index: (ma trận, hệ số tỷ lệ) căn bậc hai của histogram cho bước lọc nhanh,
+                   đã tính sẵn (tùy chọn, vd: memory-map từ file mô hình; ma trận có thể
+                   có dòng dự trữ như histograms)
+        """
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.num_patterns = 2 ** neighbors
+        self.shortlist = shortlist
+        self.chunk_size = chunk_size
+
+        self.labels = np.asarray(labels, dtype=np.int32).ravel()
+        count = len(self.labels)
+        if count == 0:
+            histograms = np.empty((0, self.dimension), dtype=np.float32)
+            scales = index = None
+        histograms = np.asarray(histograms).reshape(-1, self.dimension)
+        if scales is None:
+            if dtype == "uint8":
+                histograms = histograms[:count]
+            # Với float32/float16 đã đúng kiểu, ma trận (cùng các dòng dự trữ) được giữ nguyên
+            histograms, scales = quantize_histograms(histograms, dtype, chunk_size)
+        self._histogram_rows = _RowBuffer(histograms, count)
+        self.histograms = histograms[:count]
+        self.scales = scales
+        self._index_rows = None
+        self._index = None
+        if index is not None:
+            self._index_rows = _RowBuffer(index[0], count)
+            self._index = (index[0][:count], index[1])
+        self._sums = None
+        # Định danh của thư viện gốc, giữ nguyên qua extended() (xem LBPHModel.append_binary)
+        self.origin = object()
+
+    @classmethod
+    def from_recognizer(cls, recognizer, **kwargs):
+        """Tạo thư viện từ LBPHFaceRecognizer đã huấn luyện (dùng chung tham số LBP)"""
+        histograms = recognizer.getHistograms()
+        labels = recognizer.getLabels().ravel() if len(histograms) else []
+        matrix = np.vstack(histograms) if len(histograms) else np.empty((0, 0), dtype=np.float32)
+        return cls(matrix, labels, radius=recognizer.getRadius(), neighbors=recognizer.getNeighbors(),
+                   grid_x=recognizer.getGridX(), grid_y=recognizer.getGridY(), **kwargs)
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def dimension(self):
+        return self.grid_x * self.grid_y * self.num_patterns
+
+    @property
+    def dtype(self):
+        return self.histograms.dtype.name
+
+    @property
+    def nbytes(self):
+        """Bộ nhớ của histogram và chỉ mục lọc nhanh (nếu đã tính)"""
+        arrays = [self.histograms, self.scales]
+        if self._index is not None:
+            arrays.extend(self._index)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def _rows(self, matrix, scales, start, stop):
+        """Các dòng [start, stop) của một ma trận (có thể đã lượng tử hóa) dưới dạng float32"""
+        block = np.asarray(matrix[start:stop], dtype=np.float32)
+        if scales is not None:
+            block = block * scales[start:stop, None]
+        return block
+
+    def dequantized(self):
+        """Toàn bộ histogram dạng float32"""
+        return self._rows(self.histograms, self.scales, 0, len(self.labels))
+
+    def astype(self, dtype):
+        """Thư viện mới với histogram được lưu theo kiểu dtype"""
+        if dtype == self.dtype:
+            return self
+        return FaceGallery(self.dequantized(), self.labels, self.radius, self.neighbors, self.grid_x, self.grid_y,
+                           self.shortlist, self.chunk_size, dtype=dtype)
+
+    def compute_histogram(self, face_img):
+        """Histogram LBP theo lưới của một khuôn mặt xám (giống LBPHFaceRecognizer)"""
+        lbp = lbp_image(face_img, self.radius, self.neighbors)
+        return spatial_histogram(lbp, self.num_patterns, self.grid_x, self.grid_y)
+
+    def compute_histograms(self, face_images):
+        """Ma trận P x D histogram của nhiều khuôn mặt"""
+        if not len(face_images):
+            return np.empty((0, self.dimension), dtype=np.float32)
+        return np.vstack([self.compute_histogram(face_img) for face_img in face_images])
+
+    def extended(self, histograms, labels):
+        """
+        Thư viện mới gồm các mẫu hiện tại và các mẫu thêm vào cuối
+
+        Thư viện cũ không bị thay đổi nên các luồng đang so khớp trên nó không bị ảnh hưởng.
+        Các dòng mới được ghi vào dòng dự trữ của ma trận (xem _RowBuffer); chỉ mục lọc
+        nhanh và tổng mỗi dòng (nếu đã tính) chỉ được tính thêm cho các dòng mới.
+        """
+        labels = np.asarray(labels, dtype=np.int32).ravel()
+        histograms = np.asarray(histograms, dtype=np.float32).reshape(len(labels), self.dimension)
+        rows, row_scales = quantize_histograms(histograms, self.dtype, self.chunk_size)
+        count = len(self.labels)
+        if count == 0:
+            return FaceGallery(rows, labels, self.radius, self.neighbors, self.grid_x, self.grid_y,
+                               self.shortlist, self.chunk_size, dtype=self.dtype, scales=row_scales)
+
+        histogram_rows = self._histogram_rows.appended(count, rows)
+        scales = None if row_scales is None else np.concatenate([self.scales, row_scales])
+        block = self._rows(rows, row_scales, 0, len(rows))
+        index = None
+        if self._index is not None:
+            index_rows, index_scales = quantize_histograms(np.sqrt(block), self.dtype)
+            index_buffer = self._index_rows.appended(count, index_rows)
+            if index_scales is not None:
+                index_scales = np.concatenate([self._index[1], index_scales])
+            index = (index_buffer.data, index_scales)
+
+        gallery = FaceGallery(histogram_rows.data, np.concatenate([self.labels, labels]), self.radius,
+                              self.neighbors, self.grid_x, self.grid_y, self.shortlist, self.chunk_size,
+                              dtype=self.dtype, scales=scales, index=index)
+        # Dùng chung bộ đệm (và số dòng đã dùng) với thư viện này
+        gallery._histogram_rows = histogram_rows
+        if index is not None:
+            gallery._index_rows = index_buffer
+        if self._sums is not None:
+            gallery._sums = np.concatenate([self._sums, block.sum(axis=1, dtype=np.float32)])
+        gallery.origin = self.origin
+        return gallery
+
+    def _row_sums(self):
+        if self._sums is None:
+            sums = self.histograms.sum(axis=1, dtype=np.float32)
+            self._sums = sums * self.scales if self.scales is not None else sums
+        return self._sums
+
+    def _distances(self, probe, rows, metric):
+        """
+        Khoảng cách từ một probe tới các mẫu được chọn (rows)
+
+        Histogram LBP rất thưa nên chỉ các ô khác 0 của probe được duyệt:
+            chisqr: 2 * sum((a - b)^2 / (a + b)) = 2 * (sum(a) + sum(b)) - 8 * sum(a*b / (a + b))
+            l1:     sum(|a - b|)                 = sum(a) + sum(b) - 2 * sum(min(a, b))
+        trong đó các tổng cuối chỉ khác 0 tại những ô mà probe khác 0.
+        """
+        nonzero = np.flatnonzero(probe)
+        values = probe[nonzero]
+        totals = self._row_sums()[rows] + probe.sum()
+        overlap = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = rows[start:start + self.chunk_size]
+            gallery = self.histograms[chunk[:, None], nonzero].astype(np.float32)
+            if self.scales is not None:
+                gallery *= self.scales[chunk, None]
+            if metric == "l1":
+                overlap[start:start + len(gallery)] = np.minimum(gallery, values).sum(axis=1)
+            else:
+                overlap[start:start + len(gallery)] = (gallery * values / (gallery + values)).sum(axis=1)
+        if metric == "l1":
+            return totals - 2.0 * overlap
+        return np.maximum(2.0 * totals - 8.0 * overlap, 0.0)
+
+    def shortlist_index(self):
+        """
+        Căn bậc hai của histogram dùng cho bước lọc nhanh, lưu cùng kiểu với histogram
+
+        Returns:
+            tuple: (ma trận N x D, hệ số tỷ lệ mỗi dòng hoặc None)
+        """
+        if self._index is None:
+            count = len(self.labels)
+            # Cùng số dòng dự trữ với ma trận histogram để extended() ghi thêm tại chỗ
+            index = np.empty(self._histogram_rows.data.shape, dtype=self.histograms.dtype)
+            scales = np.ones(count, dtype=np.float32) if self.scales is not None else None
+            for start in range(0, count, self.chunk_size):
+                block = np.sqrt(self._rows(self.histograms, self.scales, start, start + self.chunk_size))
+                block, block_scales = quantize_histograms(block, self.dtype)
+                index[start:start + len(block)] = block
+                if scales is not None:
+                    scales[start:start + len(block)] = block_scales
+            self._index_rows = _RowBuffer(index, count)
+            self._index = (index[:count], scales)
+        return self._index
+
+    def _shortlist(self, probes, size):
+        """Chọn nhanh các mẫu gần nhất theo khoảng cách Hellinger (phép nhân ma trận theo từng khối)"""
+        index, scales = self.shortlist_index()
+        sqrt_probes = np.sqrt(probes)
+        # Histogram mỗi ô có tổng bằng 1 nên Hellinger nhỏ nhất <=> tích vô hướng căn bậc hai lớn nhất
+        if index.dtype == np.float32:
+            similarity = sqrt_probes @ index.T
+        else:
+            similarity = np.empty((len(probes), len(index)), dtype=np.float32)
+            for start in range(0, len(index), self.chunk_size):
+                block = index[start:start + self.chunk_size].astype(np.float32)
+                similarity[:, start:start + len(block)] = sqrt_probes @ block.T
+            if scales is not None:
+                similarity *= scales
+        return np.argpartition(-similarity, size - 1, axis=1)[:, :size]
+
+    def search(self, probes, k=5, metric="chisqr"):
+        """
+        Tìm k nhãn gần nhất cho mỗi probe
+
+        Args:
+            probes: Ma trận P x D histogram (xem compute_histograms)
+            k: Số nhãn ứng viên cho mỗi probe (mỗi nhãn chỉ xuất hiện một lần, với mẫu gần nhất)
+            metric: "chisqr" (giống LBPH) hoặc "l1"
+
+        Returns:
+            list: Với mỗi probe, danh sách [(nhãn, khoảng cách)] tăng dần theo khoảng cách
+                  (xấp xỉ khi thư viện lớn hơn shortlist, xem FaceGallery)
+        """
+        if metric not in self.METRICS:
+            raise ValueError(f"Khoảng cách không hợp lệ: {metric} (chỉ hỗ trợ {', '.join(self.METRICS)})")
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dimension)
+        if len(self.labels) == 0:
+            return [[] for _ in probes]
+
+        use_shortlist = self.shortlist and len(self.labels) > self.shortlist
+        if use_shortlist:
+            candidates = self._shortlist(probes, self.shortlist)
+        all_rows = np.arange(len(self.labels))
+
+        results = []
+        for i, probe in enumerate(probes):
+            rows = candidates[i] if use_shortlist else all_rows
+            distances = self._distances(probe, rows, metric)
+            order = np.argsort(distances, kind='stable')
+            matches = []
+            seen = set()
+            for idx in order:
+                label = int(self.labels[rows[idx]])
+                if label in seen:
+                    continue
+                seen.add(label)
+                matches.append((label, float(distances[idx])))
+                if len(matches) == k:
+                    break
+            results.append(matches)
+        return results
+
+    def match(self, face_images, k=5, metric="chisqr"):
+        """Tính histogram và tìm k nhãn gần nhất cho nhiều khuôn mặt trong một lần gọi"""
+        return self.search(self.compute_histograms(face_images), k, metric)
+
+    def pairwise_distances(self, metric="chisqr"):
+        """Ma trận N x N khoảng cách giữa mọi cặp mẫu (dùng cho thư viện nhỏ, vd: mẫu của một người dùng)"""
+        rows = np.arange(len(self.labels))
+        if len(rows) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack([self._distances(self._rows(self.histograms, self.scales, i, i + 1)[0], rows, metric)
+                          for i in rows])
+
+
+def select_representatives(distances, max_samples=None, duplicate_distance=0.0, iterations=10):
+    """
+    Chọn tập con đại diện và đa dạng trong các mẫu của một người dùng
+
+    Bước 1 bỏ các mẫu gần trùng: duyệt từ mẫu mới nhất về cũ nhất, bỏ mẫu cách
+    một mẫu đã giữ chưa tới duplicate_distance (ưu tiên giữ ảnh gần đây).
+    Bước 2, nếu vẫn nhiều hơn max_samples: phân cụm k-medoids trên ma trận
+    khoảng cách (khởi tạo bằng cách lần lượt chọn mẫu xa nhất với các mẫu đã
+    chọn) và giữ medoid của mỗi cụm.
+
+    Args:
+        distances: Ma trận N x N khoảng cách giữa các mẫu, theo thứ tự thêm vào (cũ -> mới)
+        max_samples: Số mẫu tối đa được giữ (None: không giới hạn)
+        duplicate_distance: Khoảng cách dưới ngưỡng này được xem là gần trùng (0: không bỏ)
+        iterations: Số vòng lặp tối đa của k-medoids
+
+    Returns:
+        list: Chỉ số các mẫu được giữ, tăng dần
+    """
+    distances = np.asarray(distances)
+    kept = []
+    for i in reversed(range(len(distances))):
+        if not kept or distances[i, kept].min() >= duplicate_distance:
+            kept.append(i)
+    kept = np.array(sorted(kept), dtype=np.int64)
+    if max_samples is None or len(kept) <= max_samples:
+        return kept.tolist()
+
+    sub = distances[np.ix_(kept, kept)]
+    medoids = [int(np.argmin(sub.sum(axis=1)))]
+    nearest = sub[medoids[0]].copy()
+    while len(medoids) < max_samples and nearest.max() > 0:
+        medoids.append(int(np.argmax(nearest)))
+        nearest = np.minimum(nearest, sub[medoids[-1]])
+
+    for _ in range(iterations):
+        assignment = np.argmin(sub[medoids], axis=0)
+        updated = []
+        for cluster, medoid in enumerate(medoids):
+            members = np.flatnonzero(assignment == cluster)
+            if len(members) == 0:
+                updated.append(medoid)
+                continue
+            updated.append(int(members[np.argmin(sub[np.ix_(members, members)].sum(axis=1))]))
+        if updated == medoids:
+            break
+        medoids = updated
+    return sorted(kept[medoids].tolist())
+
+
+def quantization_report(gallery, dtypes=HISTOGRAM_DTYPES, samples=200, metric="chisqr", seed=0):
+    """
+    So sánh độ chính xác và bộ nhớ của thư viện khi lưu histogram theo các kiểu khác nhau
+
+    Mỗi mẫu được chọn ngẫu nhiên làm probe (histogram float32) và so với mọi mẫu
+    còn lại của thư viện (bỏ qua chính nó, không dùng bước lọc nhanh).
+
+    Args:
+        gallery: Thư viện gốc (độ chính xác đầy đủ nếu có thể)
+        dtypes: Các kiểu lưu trữ cần so sánh
+        samples: Số mẫu dùng làm probe
+        metric: Khoảng cách dùng để so khớp
+        seed: Hạt giống chọn mẫu ngẫu nhiên
+
+    Returns:
+        list: Mỗi kiểu một dict: dtype, bytes (histogram + chỉ mục lọc nhanh), bytes_per_sample,
+              agreement (tỷ lệ kết quả gần nhất trùng với float32), accuracy (tỷ lệ mẫu gần nhất cùng nhãn),
+              distance_error (sai số tương đối trung bình của khoảng cách gần nhất)
+    """
+    reference = gallery.astype("float32")
+    count = len(reference)
+    if count < 2:
+        return []
+    rng = np.random.default_rng(seed)
+    probes = np.sort(rng.choice(count, size=min(samples, count), replace=False))
+    rows = np.arange(count)
+
+    def nearest(candidate):
+        results = []
+        for i in probes:
+            distances = candidate._distances(reference.histograms[i], rows, metric)
+            distances[i] = np.inf
+            best = int(np.argmin(distances))
+            results.append((int(candidate.labels[best]), float(distances[best])))
+        return results
+
+    baseline = nearest(reference)
+    report = []
+    for dtype in dtypes:
+        candidate = reference.astype(dtype)
+        results = baseline if candidate is reference else nearest(candidate)
+        nbytes = candidate.histograms.nbytes * 2
+        if candidate.scales is not None:
+            nbytes += candidate.scales.nbytes * 2
+        agreement = np.mean([a[0] == b[0] for a, b in zip(results, baseline)])
+        accuracy = np.mean([label == reference.labels[i] for (label, _), i in zip(results, probes)])
+        errors = [abs(a[1] - b[1]) / b[1] for a, b in zip(results, baseline) if b[1] > 0]
+        report.append({
+            "dtype": dtype,
+            "bytes": int(nbytes),
+            "bytes_per_sample": int(nbytes // count),
+            "agreement": float(agreement),
+            "accuracy": float(accuracy),
+            "distance_error": float(np.mean(errors)) if errors else 0.0,
+        })
+    return report
@@ -1,80 +1,302 @@
 import cv2
 import os
+import re
 import numpy as np
-import json
-import pickle
+import shutil
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from face_detector import FaceDetector
+from face_gallery import FaceGallery, select_representatives
+from face_store import FaceStore
+from lbph_model import LBPHModel
+from metrics import timed
+from detector_profiles import resolve_detector_options
+from persistence import WriteBehindFlusher, file_lock
+from user_store import UserStore
 
 class FaceRecognizer:
-    def __init__(self, face_cascade_path, data_dir="user_data"):
+    def __init__(self, face_cascade_path, data_dir="user_data", read_only=False,
+                 flush_interval=5.0, flush_max_pending=100, face_size=(100, 100),
+                 max_samples_per_user=None, duplicate_distance=10.0, detector_profile=None, detector=None,
+                 **detector_options):
         """
         Khởi tạo bộ nhận diện khuôn mặt
         
         Args:
             face_cascade_path: Đường dẫn đến file cascade để phát hiện khuôn mặt
             data_dir: Thư mục lưu dữ liệu người dùng
+            read_only: Không ghi lại cơ sở dữ liệu khi nhận diện (dùng cho các worker xử lý song song)
+            flush_interval: Thời gian tối đa (giây) trước khi ghi last_recognized xuống đĩa
+            flush_max_pending: Số người dùng thay đổi tối đa trước khi ghi ngay
+            face_size: Kích thước chuẩn hóa (width, height) của khuôn mặt trong kho huấn luyện
+            max_samples_per_user: Số mẫu tối đa của mỗi người dùng trong mô hình; khi thêm ảnh vượt quá,
+                                  chỉ giữ một tập con đại diện (xem compact_user_samples). None: không giới hạn
+            duplicate_distance: Khoảng cách chi-square dưới ngưỡng này được xem là ảnh gần trùng khi nén
+            detector_profile: Tên profile tham số phát hiện (xem detector_profiles), detector_options ghi đè profile
+            detector: FaceDetector đã tạo sẵn (vd: MultiCascadeDetector); khi có, face_cascade_path,
+                      detector_profile và detector_options không được dùng
+            detector_options: Tham số cho FaceDetector (scale_factor, min_neighbors, min_size,
+                              detection_scale, max_detection_side). Việc nhận diện luôn cắt
+                              khuôn mặt từ ảnh độ phân giải gốc.
         """
+        self.read_only = read_only
+        self.max_samples_per_user = max_samples_per_user
+        self.duplicate_distance = duplicate_distance
+        
+        # Khóa bảo vệ users_data giữa luồng nhận diện và luồng ghi nền
+        self._data_lock = threading.RLock()
+        # Khóa cập nhật mô hình giữa các luồng (lồng nhau được) và số lớp đang giữ, xem _model_update
+        self._model_lock = threading.RLock()
+        self._model_lock_depth = 0
+        
+        # Ghi trễ cập nhật last_recognized: nhận diện không bao giờ chờ đĩa
+        self.flusher = WriteBehindFlusher(self._flush_recognition_updates,
+                                          interval=flush_interval, max_pending=flush_max_pending)
+        
         # Thư mục dự án
         self.base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         # Thư mục lưu dữ liệu của người dùng
         self.data_dir = os.path.join(self.base_dir, data_dir)
         os.makedirs(self.data_dir, exist_ok=True)
         
-        # Tệp cơ sở dữ liệu người dùng
-        self.users_db_file = os.path.join(self.data_dir, "users_database.json")
-        self.face_encodings_file = os.path.join(self.data_dir, "face_encodings.pkl")
+        # Cơ sở dữ liệu người dùng và ánh xạ nhãn (SQLite)
+        self.user_store = UserStore(self.data_dir)
+        self.users_db_file = self.user_store.db_file
+        # Các file của định dạng cũ, chỉ dùng để chuyển đổi
+        self.legacy_users_file = os.path.join(self.data_dir, "users_database.json")
+        self.legacy_encodings_file = os.path.join(self.data_dir, "face_encodings.pkl")
         
         # Tải bộ phát hiện khuôn mặt
-        self.face_cascade = cv2.CascadeClassifier(face_cascade_path)
-        if self.face_cascade.empty():
-            raise Exception(f"Không thể tải cascade từ: {face_cascade_path}")
+        if detector is None:
+            detector = FaceDetector(face_cascade_path, **resolve_detector_options(detector_profile,
+                                                                              **detector_options))
+        self.detector = detector
+        self.face_cascade = self.detector.face_cascade
+        
+        # Bộ nhớ đệm danh tính tùy chọn (xem attach_identity_cache)
+        self.identity_cache = None
+        # Số liệu hiệu năng tùy chọn (xem attach_metrics); gán trước khi nạp/chuyển đổi mô hình
+        # vì việc ghi mô hình đi qua _persisting()
+        self.metrics = None
         
-        # Tải bộ nhận diện khuôn mặt LBPH
-        self.recognizer = cv2.face.LBPHFaceRecognizer_create()
+        # Tải bộ nhận diện khuôn mặt LBPH (histogram dạng ma trận NumPy, xem LBPHModel)
+        self.recognizer = LBPHModel()
+        self._signatures = {}
         
         # Khởi tạo cơ sở dữ liệu người dùng nếu chưa tồn tại
         self._init_user_database()
         
-        # Nạp mô hình nhận diện nếu đã có
-        self.model_file = os.path.join(self.data_dir, "face_model.yml")
+        # Nạp mô hình nhận diện nếu đã có (định dạng nhị phân, chuyển đổi từ YAML cũ nếu cần)
+        self.model_file = os.path.join(self.data_dir, "face_model.lbph")
+        self.legacy_model_file = os.path.join(self.data_dir, "face_model.yml")
+        self.model_lock_file = os.path.join(self.data_dir, "face_model.lock")
         if os.path.exists(self.model_file):
-            self.recognizer.read(self.model_file)
+            self.recognizer.read(self.model_file, writable=not read_only)
             print(f"Đã nạp mô hình nhận diện từ {self.model_file}")
+        elif os.path.exists(self.legacy_model_file):
+            self.recognizer.read(self.legacy_model_file)
+            print(f"Đã nạp mô hình nhận diện từ {self.legacy_model_file}")
+            if not read_only:
+                self._write_model()
+                print(f"Đã chuyển mô hình sang định dạng nhị phân: {self.model_file}")
+        
+        # Kho khuôn mặt đóng gói dùng để huấn luyện
+        self.face_store = FaceStore(os.path.join(self.data_dir, "face_store"), face_size)
         
         # Tải dữ liệu khuôn mặt
         self.users_data = self._load_users_data()
         self.face_encodings = self._load_face_encodings()
+        
+        # Dấu hiệu của dữ liệu đã nạp, dùng để phát hiện thay đổi từ tiến trình khác
+        self._signatures = {path: self._signature(path) for path in self._watched_files()}
+        # Số lần dữ liệu trong bộ nhớ được thay bằng bản mới trên đĩa
+        self.generation = 0
+
+    def attach_tracker(self, tracker):
+        """Gắn bộ theo dõi khuôn mặt cho bộ phát hiện (xem FaceDetector.attach_tracker)"""
+        self.detector.attach_tracker(tracker)
+    
+    def attach_identity_cache(self, cache):
+        """
+        Gắn bộ nhớ đệm danh tính theo track (xem IdentityCache) cho recognize_face
+        
+        Khuôn mặt của một track đã được nhận diện dùng lại kết quả cũ cho tới lần
+        xác minh lại tiếp theo. Chỉ dùng khi các ảnh là khung hình liên tiếp của
+        một nguồn video; gọi với None để gỡ.
+        """
+        self.identity_cache = cache
+    
+    def attach_metrics(self, metrics):
+        """
+        Gắn bộ thu thập số liệu hiệu năng (xem Metrics) cho bộ nhận diện và bộ phát hiện
+        
+        Ghi thời gian các giai đoạn predict, draw, persist (cùng các giai đoạn của
+        FaceDetector), bộ đếm recognitions, disk_writes và gauge kích thước mô hình.
+        Gọi với None để tắt.
+        """
+        self.metrics = metrics
+        self.detector.attach_metrics(metrics)
+        if metrics is not None:
+            metrics.register_gauge("gallery_samples", lambda: len(self.recognizer.gallery))
+            metrics.register_gauge("gallery_bytes", lambda: self.recognizer.gallery.nbytes)
+            metrics.register_gauge("users", lambda: len(self.users_data))
+    
+    def _persisting(self):
+        """Ngữ cảnh đo một lần ghi xuống đĩa (giai đoạn persist, bộ đếm disk_writes)"""
+        if self.metrics is not None:
+            self.metrics.inc("disk_writes")
+        return timed(self.metrics, "persist")
 
     def _init_user_database(self):
-        """Khởi tạo cơ sở dữ liệu người dùng nếu chưa tồn tại"""
-        if not os.path.exists(self.users_db_file):
-            with open(self.users_db_file, 'w', encoding='utf-8') as f:
-                json.dump({}, f, ensure_ascii=False, indent=4)
-            print(f"Đã tạo file cơ sở dữ liệu người dùng: {self.users_db_file}")
+        """Khởi tạo cơ sở dữ liệu người dùng, chuyển đổi từ file JSON/pickle cũ nếu có"""
+        if not self.user_store.created:
+            return
+        if os.path.exists(self.legacy_users_file) or os.path.exists(self.legacy_encodings_file):
+            num_users, num_labels = self.migrate_legacy_files()
+            print(f"Đã chuyển {num_users} người dùng và {num_labels} nhãn sang {self.users_db_file}")
+        else:
+            print(f"Đã tạo cơ sở dữ liệu người dùng: {self.users_db_file}")
+    
+    def migrate_legacy_files(self):
+        """
+        Nhập users_database.json và face_encodings.pkl (định dạng cũ) vào cơ sở dữ liệu SQLite
+        
+        Returns:
+            tuple: (số người dùng, số nhãn) đã nhập
+        """
+        return self.user_store.migrate_from_files(self.legacy_users_file, self.legacy_encodings_file)
     
     def _load_users_data(self):
-        """Tải dữ liệu người dùng từ file JSON"""
-        if os.path.exists(self.users_db_file):
-            with open(self.users_db_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        """Tải dữ liệu người dùng từ cơ sở dữ liệu"""
+        return self.user_store.all_users()
+    
+    def _save_users_data(self, user_ids=None):
+        """
+        Lưu dữ liệu người dùng vào cơ sở dữ liệu
+        
+        Args:
+            user_ids: Chỉ ghi các người dùng này (người dùng không còn trong users_data
+                      sẽ bị xóa). Mặc định ghi các người dùng của users_data đã thay đổi
+                      kể từ lần nạp gần nhất.
+        """
+        with self._data_lock, self._persisting():
+            if user_ids is None:
+                self.user_store.replace_users(self.users_data)
+                return
+            self.user_store.save_users({user_id: self.users_data[user_id]
+                                        for user_id in user_ids if user_id in self.users_data})
+            removed = [user_id for user_id in user_ids if user_id not in self.users_data]
+            if removed:
+                self.user_store.delete_users(removed)
+    
+    def save_user(self, user_id):
+        """Ghi thay đổi của một người dùng (hoặc xóa nếu không còn trong users_data)"""
+        self._save_users_data([user_id])
+    
+    def _flush_recognition_updates(self, user_ids):
+        """Ghi các thay đổi last_recognized đang chờ (chạy trên luồng ghi nền), chỉ cập nhật các dòng này"""
+        with self._data_lock:
+            timestamps = {user_id: self.users_data[user_id].get("last_recognized")
+                          for user_id in user_ids if user_id in self.users_data}
+        with self._persisting():
+            self.user_store.update_last_recognized(timestamps)
+    
+    def _signature(self, path):
+        """
+        Dấu hiệu thay đổi của dữ liệu: data_version của SQLite cho cơ sở dữ liệu
+        (chỉ đổi khi tiến trình khác ghi), (mtime_ns, kích thước) cho các file khác.
+        File mô hình còn kèm inode và số mẫu vì ghi thêm mẫu không đổi kích thước file
+        """
+        if path == self.users_db_file:
+            return self.user_store.data_version()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if path == self.model_file:
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size, LBPHModel.stored_count(path))
+        return (stat.st_mtime_ns, stat.st_size)
     
-    def _save_users_data(self):
-        """Lưu dữ liệu người dùng vào file JSON"""
-        with open(self.users_db_file, 'w', encoding='utf-8') as f:
-            json.dump(self.users_data, f, ensure_ascii=False, indent=4)
+    def _watched_files(self):
+        return [self.model_file, self.users_db_file]
+    
+    def _file_changed(self, path):
+        return self._signature(path) != self._signatures.get(path)
+    
+    def changed_files(self):
+        """Các file dữ liệu đã bị tiến trình khác thay đổi kể từ lần nạp gần nhất"""
+        return [path for path in self._watched_files() if self._file_changed(path)]
+    
+    @property
+    def model_version(self):
+        """Phiên bản mô hình đang dùng (tăng mỗi lần mô hình được ghi, giống nhau trên mọi tiến trình đã nạp cùng dữ liệu)"""
+        return self.face_encodings.get("model_version", 0)
+    
+    def mark_recognized(self, user_id):
+        """Ghi nhận thời điểm nhận diện gần nhất của người dùng (ghi xuống đĩa ở luồng nền)"""
+        user_info = self.users_data.get(user_id)
+        if user_info is None or self.read_only:
+            return
+        with self._data_lock:
+            user_info["last_recognized"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.flusher.mark_dirty(user_id)
+    
+    def reload(self, files=None):
+        """
+        Nạp lại mô hình, cơ sở dữ liệu người dùng và kho khuôn mặt từ đĩa
+        
+        Dùng sau khi một tiến trình/đối tượng khác đã thay đổi dữ liệu người dùng.
+        Dữ liệu mới được nạp đầy đủ trước, sau đó thay thế bản cũ trong một bước
+        nên các lần nhận diện đang chạy không bao giờ thấy trạng thái nửa cũ nửa mới.
+        
+        Args:
+            files: Danh sách file cần nạp lại (mặc định: tất cả)
+        """
+        files = self._watched_files() if files is None else files
+        if self.users_db_file in files:
+            self.flush()
+        
+        # Ghi nhận dấu hiệu trước khi đọc: nếu file thay đổi trong lúc đọc, lần kiểm tra sau sẽ nạp lại
+        signatures = {path: self._signature(path) for path in files}
+        recognizer = face_store = face_encodings = users_data = None
+        if self.model_file in files:
+            recognizer = LBPHModel()
+            if os.path.exists(self.model_file):
+                recognizer.read(self.model_file, writable=not self.read_only)
+            face_store = FaceStore(self.face_store.store_dir, self.face_store.face_size)
+        if self.users_db_file in files:
+            face_encodings = self._load_face_encodings()
+            users_data = self._load_users_data()
+        
+        with self._data_lock:
+            if recognizer is not None:
+                self.recognizer = recognizer
+                self.face_store = face_store
+            if face_encodings is not None:
+                self.face_encodings = face_encodings
+            if users_data is not None:
+                self.users_data = users_data
+            self._signatures.update(signatures)
+            self.generation += 1
+    
+    def flush(self):
+        """Ghi ngay các thay đổi last_recognized đang chờ"""
+        self.flusher.flush()
+    
+    def close(self):
+        """Dừng luồng ghi nền và ghi nốt các thay đổi còn lại"""
+        self.flusher.close()
     
     def _load_face_encodings(self):
-        """Tải các vector đặc trưng khuôn mặt"""
-        if os.path.exists(self.face_encodings_file):
-            with open(self.face_encodings_file, 'rb') as f:
-                return pickle.load(f)
-        return {}
+        """Tải ánh xạ nhãn của mô hình từ cơ sở dữ liệu"""
+        return self.user_store.load_model_state()
     
     def _save_face_encodings(self):
-        """Lưu các vector đặc trưng khuôn mặt"""
-        with open(self.face_encodings_file, 'wb') as f:
-            pickle.dump(self.face_encodings, f)
+        """Lưu các thay đổi của ánh xạ nhãn (mỗi lần lưu là một phiên bản mô hình mới)"""
+        with self._data_lock, self._persisting():
+            # Phiên bản được tăng trong cơ sở dữ liệu, không tính từ bản trong bộ nhớ
+            self.face_encodings["model_version"] = self.user_store.save_model_state(self.face_encodings)
     
     def add_user(self, user_id, name, image, additional_info=None):
         """
@@ -91,7 +313,7 @@ class FaceRecognizer:
         """
         # Phát hiện khuôn mặt trong ảnh
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        faces = self.detector.detect_gray(gray)
         
         if len(faces) == 0:
             print("Không phát hiện khuôn mặt trong ảnh")
@@ -126,132 +348,828 @@ class FaceRecognizer:
         
         # Lưu vào cơ sở dữ liệu
         self.users_data[user_id] = user_info
-        self._save_users_data()
+        self.save_user(user_id)
         
-        # Cập nhật mô hình nhận diện
-        self._update_recognition_model()
+        # Cập nhật mô hình nhận diện (chỉ thêm khuôn mặt mới, không huấn luyện lại từ đầu)
+        if user_id in self.face_encodings.get("user_to_label", {}):
+            self.refresh_user_in_model(user_id)
+        else:
+            self.enroll_faces(user_id, [face_roi], [face_filename])
         
         print(f"Đã thêm người dùng: {name} (ID: {user_id})")
         return True
     
-    def _update_recognition_model(self):
-        """Cập nhật mô hình nhận diện khuôn mặt"""
+    def add_face(self, user_id, image):
+        """
+        Thêm ảnh khuôn mặt mới cho người dùng đã tồn tại
+        
+        Args:
+            user_id: ID người dùng
+            image: Ảnh chứa khuôn mặt (numpy array, BGR)
+            
+        Returns:
+            bool: True nếu thành công, False nếu thất bại
+        """
+        if user_id not in self.users_data:
+            print(f"Không tìm thấy người dùng với ID: {user_id}")
+            return False
+        
+        # Chuyển từ màu sang ảnh xám
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        
+        # Phát hiện khuôn mặt bằng cascade classifier
+        faces = self.detector.detect_gray(gray)
+        
+        if len(faces) == 0:
+            print("Không phát hiện khuôn mặt trong ảnh")
+            return False
+        
+        # Lấy thông tin người dùng hiện tại
+        user_info = self.users_data[user_id]
+        user_dir = os.path.join(self.data_dir, user_id)
+        
+        # Chuẩn bị các thư mục cho ảnh khuôn mặt
+        faces_dir = os.path.join(user_dir, "faces")
+        os.makedirs(faces_dir, exist_ok=True)
+        
+        # Cắt khuôn mặt đầu tiên
+        x, y, w, h = faces[0]
+        face_roi = gray[y:y+h, x:x+w]
+        
+        # Đếm số ảnh hiện tại để tạo tên file mới
+        existing_faces = user_info.get("face_images", [])
+        if not existing_faces and "face_image" in user_info:  # Hỗ trợ định dạng cũ
+            existing_faces = [user_info["face_image"]]
+            # Chuyển đổi từ định dạng cũ sang mới: di chuyển ảnh cũ vào thư mục faces nếu cần
+            old_face = user_info["face_image"]
+            if os.path.exists(old_face) and os.path.dirname(old_face) != faces_dir:
+                new_path = os.path.join(faces_dir, f"{user_id}_face_1.jpg")
+                shutil.copy2(old_face, new_path)
+                existing_faces = [new_path]
+        
+        # Tạo tên file mới (không trùng ảnh đang dùng hay ảnh đã bị loại) và lưu ảnh khuôn mặt
+        new_face_filename = self.new_face_path(user_id, existing_faces)
+        cv2.imwrite(new_face_filename, face_roi)
+        
+        # Cập nhật danh sách ảnh khuôn mặt, xóa trường face_image cũ nếu có
+        with self._data_lock:
+            existing_faces.append(new_face_filename)
+            user_info["face_images"] = existing_faces
+            user_info.pop("face_image", None)
+        self.save_user(user_id)
+        
+        # Thêm khuôn mặt mới vào mô hình nhận diện (không huấn luyện lại từ đầu)
+        print("Đang cập nhật mô hình nhận diện...")
+        self.enroll_faces(user_id, [face_roi], [new_face_filename])
+        
+        print(f"Đã thêm ảnh khuôn mặt mới ({os.path.basename(new_face_filename)}) cho người dùng {user_id}")
+        return True
+    
+    def new_face_path(self, user_id, face_images=None):
+        """
+        Đường dẫn cho ảnh khuôn mặt mới: faces/<user_id>_face_<N>.jpg
+        
+        N lớn hơn mọi số thứ tự đã dùng trong face_images, retired_faces và các file
+        trong thư mục faces, nên ảnh mới không ghi đè ảnh đang dùng hay ảnh đã bị
+        loại khi nén (số ảnh trong face_images giảm sau khi nén).
+        
+        Args:
+            user_id: ID người dùng
+            face_images: Danh sách ảnh hiện tại (mặc định: lấy từ users_data)
+        """
+        faces_dir = os.path.join(self.data_dir, user_id, "faces")
+        os.makedirs(faces_dir, exist_ok=True)
+        user_info = self.users_data.get(user_id, {})
+        if face_images is None:
+            face_images = self.get_face_paths(user_info)
+        names = [os.path.basename(path.replace("\\", "/"))
+                 for path in list(face_images) + user_info.get("retired_faces", [])]
+        names += os.listdir(faces_dir)
+        pattern = re.compile(re.escape(user_id) + r"_face_(\d+)\.")
+        used = [int(match.group(1)) for match in map(pattern.match, names) if match]
+        return os.path.join(faces_dir, f"{user_id}_face_{max(used, default=0) + 1}.jpg")
+    
+    @staticmethod
+    def get_face_paths(user_info):
+        """Danh sách ảnh khuôn mặt của người dùng (hỗ trợ cả định dạng cũ 'face_image')"""
+        face_images = user_info.get("face_images", [])
+        if not face_images and user_info.get("face_image"):
+            face_images = [user_info["face_image"]]
+        return face_images
+    
+    def _resolve_face_path(self, user_id, face_path):
+        """
+        Tìm ảnh khuôn mặt trên đĩa
+        
+        Đường dẫn tuyệt đối có thể đã cũ (vd: dữ liệu chép từ máy khác), khi đó
+        tìm file cùng tên trong thư mục của người dùng.
+        """
+        if face_path and os.path.exists(face_path):
+            return face_path
+        if not face_path:
+            return None
+        filename = os.path.basename(face_path.replace("\\", "/"))
+        for candidate in (os.path.join(self.data_dir, user_id, filename),
+                          os.path.join(self.data_dir, user_id, "faces", filename)):
+            if os.path.exists(candidate):
+                return candidate
+        return None
+    
+    def _user_face_files(self, user_id):
+        """Các ảnh khuôn mặt hiện có trên đĩa của một người dùng"""
+        paths = []
+        for face_path in self.get_face_paths(self.users_data.get(user_id, {})):
+            resolved = self._resolve_face_path(user_id, face_path)
+            if resolved:
+                paths.append(resolved)
+        return paths
+    
+    def _sync_user_store(self, user_id):
+        """Đồng bộ kho khuôn mặt với danh sách ảnh của một người dùng"""
+        paths = self._user_face_files(user_id) if user_id in self.users_data else []
+        stored = self.face_store.user_sources(user_id)
+        stale = [source for source in stored if source not in paths]
+        if stale:
+            self.face_store.remove_sources(user_id, stale)
+        missing = [path for path in paths if path not in stored]
         faces = []
-        labels = []
-        label_ids = {}
-        current_label = 0
-        
-        # Thu thập dữ liệu huấn luyện
-        for user_id, user_info in self.users_data.items():
-            face_path = user_info.get("face_image")
-            if face_path and os.path.exists(face_path):
-                face_img = cv2.imread(face_path, cv2.IMREAD_GRAYSCALE)
-                if face_img is not None:
-                    # Gán ID số cho người dùng
-                    if user_id not in label_ids:
-                        label_ids[user_id] = current_label
-                        current_label += 1
-                    
-                    # Thêm ảnh và nhãn vào tập dữ liệu
-                    faces.append(face_img)
-                    labels.append(label_ids[user_id])
+        sources = []
+        for face_path in missing:
+            face_img = cv2.imread(face_path, cv2.IMREAD_GRAYSCALE)
+            if face_img is not None:
+                faces.append(face_img)
+                sources.append(face_path)
+        self.face_store.append(user_id, faces, sources)
+    
+    def rebuild_face_store(self):
+        """
+        Dựng lại kho khuôn mặt đóng gói từ các thư mục ảnh của người dùng
         
-        if not faces:
-            print("Không có dữ liệu khuôn mặt để huấn luyện")
-            return
+        Returns:
+            int: Số khuôn mặt trong kho
+        """
+        count = self.face_store.rebuild([(user_id, self._user_face_files(user_id))
+                                         for user_id in self.users_data])
+        print(f"Đã dựng lại kho khuôn mặt với {count} ảnh")
+        return count
+    
+    def compact_user_samples(self, user_id, max_samples=None, duplicate_distance=None, dry_run=False):
+        """
+        Giới hạn số mẫu của một người dùng bằng một tập con đại diện, đa dạng
+        
+        Các ảnh gần trùng bị loại, sau đó nếu vẫn vượt quá max_samples thì các mẫu
+        được phân cụm theo histogram LBP và chỉ giữ mẫu đại diện của mỗi cụm (xem
+        select_representatives). Ảnh bị loại được chuyển từ face_images sang
+        retired_faces (vẫn giữ trên đĩa) nên không được thêm lại khi đồng bộ kho
+        hay huấn luyện lại. Mô hình chưa được cập nhật: gọi refresh_user_in_model()
+        hoặc huấn luyện lại sau đó.
+        
+        Args:
+            user_id: ID người dùng
+            max_samples: Số mẫu tối đa (mặc định: max_samples_per_user)
+            duplicate_distance: Ngưỡng gần trùng (mặc định: duplicate_distance của bộ nhận diện)
+            dry_run: Chỉ trả về các ảnh sẽ bị loại, không thay đổi dữ liệu
+            
+        Returns:
+            list: Đường dẫn các ảnh bị loại
+        """
+        if max_samples is None:
+            max_samples = self.max_samples_per_user
+        if duplicate_distance is None:
+            duplicate_distance = self.duplicate_distance
+        
+        self._sync_user_store(user_id)
+        rows = self.face_store.user_rows(user_id)
+        if len(rows) < 2:
+            return []
+        faces = self.face_store.faces()
+        template = self.recognizer.gallery
+        user_gallery = FaceGallery(template.compute_histograms([faces[row] for row in rows]), [0] * len(rows),
+                                   template.radius, template.neighbors, template.grid_x, template.grid_y)
+        keep = set(select_representatives(user_gallery.pairwise_distances(), max_samples, duplicate_distance))
+        retired = set(self.face_store.entries[row]["source"] for i, row in enumerate(rows) if i not in keep)
+        retired.discard(None)
+        if not retired:
+            return []
         
-        # Huấn luyện mô hình
-        print(f"Huấn luyện mô hình với {len(faces)} khuôn mặt...")
-        self.recognizer.train(faces, np.array(labels))
+        user_info = self.users_data[user_id]
+        remaining = []
+        moved = []
+        for face_path in self.get_face_paths(user_info):
+            if self._resolve_face_path(user_id, face_path) in retired:
+                moved.append(face_path)
+            else:
+                remaining.append(face_path)
+        if dry_run:
+            return moved
         
-        # Lưu mô hình và ánh xạ nhãn
-        self.recognizer.write(self.model_file)
+        with self._data_lock:
+            user_info["face_images"] = remaining
+            user_info.pop("face_image", None)
+            user_info["retired_faces"] = user_info.get("retired_faces", []) + moved
+        self.save_user(user_id)
+        self.face_store.remove_sources(user_id, retired)
+        return moved
+    
+    def compact_gallery(self, max_samples=None, duplicate_distance=None, user_ids=None, dry_run=False):
+        """
+        Nén mẫu của nhiều người dùng (xem compact_user_samples) rồi huấn luyện lại mô hình một lần
         
-        # Lưu ánh xạ giữa ID nhãn và ID người dùng
-        self.face_encodings = {
-            "label_to_user": {str(label): user_id for user_id, label in label_ids.items()},
-            "user_to_label": {user_id: str(label) for user_id, label in label_ids.items()}
-        }
+        Args:
+            max_samples: Số mẫu tối đa mỗi người dùng
+            duplicate_distance: Ngưỡng gần trùng
+            user_ids: Danh sách người dùng (mặc định: tất cả)
+            dry_run: Chỉ thống kê, không thay đổi dữ liệu
+            
+        Returns:
+            dict: {user_id: [ảnh bị loại]} của các người dùng có ảnh bị loại
+        """
+        retired = {}
+        for user_id in (self.users_data if user_ids is None else user_ids):
+            moved = self.compact_user_samples(user_id, max_samples, duplicate_distance, dry_run)
+            if moved:
+                retired[user_id] = moved
+        if retired and not dry_run:
+            self._update_recognition_model()
+        return retired
+    
+    def _model_state(self):
+        """
+        Trạng thái của mô hình trong face_encodings (ánh xạ nhãn, nhãn đã xóa, số mẫu)
+        
+        Bổ sung các trường còn thiếu cho dữ liệu chuyển đổi từ face_encodings.pkl của phiên bản cũ.
+        """
+        state = self.face_encodings
+        state.setdefault("label_to_user", {})
+        state.setdefault("user_to_label", {})
+        if "next_label" not in state:
+            labels = [int(label) for label in state["label_to_user"]]
+            state["next_label"] = max(labels) + 1 if labels else 0
+        # Nhãn đã bị xóa (tombstone) -> số mẫu vẫn còn nằm trong mô hình
+        state.setdefault("tombstones", {})
+        if "sample_count" not in state:
+            state["sample_count"] = 0 if self.recognizer.empty() else len(self.recognizer.getLabels())
+        return state
+    
+    def _write_model(self):
+        """
+        Ghi mô hình: chỉ ghi các mẫu mới vào phần dự trữ của file nếu được (LBPHModel.append_binary),
+        ngược lại ghi ra file tạm rồi đổi tên để tiến trình khác không đọc phải file ghi dở
+        """
+        tmp_file = os.path.join(self.data_dir, ".tmp_" + os.path.basename(self.model_file))
+        with self._persisting():
+            appended = self.recognizer.append_binary(self.model_file)
+            if not appended:
+                self.recognizer.write(tmp_file)
+        with self._data_lock:
+            if not appended:
+                os.replace(tmp_file, self.model_file)
+            self._signatures[self.model_file] = self._signature(self.model_file)
+    
+    @contextmanager
+    def _model_update(self):
+        """
+        Ngữ cảnh cập nhật mô hình: giữ khóa file giữa các tiến trình (face_model.lock)
+        
+        Sau khi lấy khóa, mô hình và ánh xạ nhãn được nạp lại nếu tiến trình khác
+        đã ghi, nên thay đổi (update(), tombstone, huấn luyện lại) được áp dụng
+        lên bản mới nhất trên đĩa thay vì ghi đè nó bằng bản cũ trong bộ nhớ.
+        Gọi lồng nhau trong cùng luồng chỉ lấy khóa một lần.
+        """
+        with self._model_lock:
+            if self._model_lock_depth:
+                self._model_lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._model_lock_depth -= 1
+                return
+            with file_lock(self.model_lock_file):
+                self._model_lock_depth = 1
+                try:
+                    changed = self.changed_files()
+                    if changed:
+                        self.reload(changed)
+                    yield
+                finally:
+                    self._model_lock_depth = 0
+    
+    def export_model(self, path):
+        """Xuất mô hình ra file (YAML của OpenCV nếu phần mở rộng là .yml/.yaml/.xml, ngược lại nhị phân)"""
+        self.recognizer.write(path)
+    
+    def import_model(self, path):
+        """
+        Nạp mô hình từ file YAML (LBPHFaceRecognizer.write) hoặc nhị phân và lưu làm mô hình hiện tại
+        
+        Ánh xạ nhãn -> người dùng trong cơ sở dữ liệu phải khớp với nhãn của file được nhập.
+        """
+        with self._model_update():
+            recognizer = LBPHModel(dtype=self.recognizer.dtype)
+            recognizer.read(path)
+            with self._data_lock:
+                self.recognizer = recognizer
+                self.face_encodings["sample_count"] = len(recognizer.gallery)
+            self._write_model()
+            self._save_face_encodings()
+    
+    def quantize_model(self, dtype):
+        """
+        Đổi kiểu lưu histogram của mô hình ("float32", "float16" hoặc "uint8")
+        
+        Kiểu lưu trữ được giữ nguyên khi mô hình được cập nhật hoặc huấn luyện lại.
+        Các tiến trình khác nạp lại mô hình mới qua ModelWatcher.
+        """
+        with self._model_update():
+            recognizer = self.recognizer.astype(dtype)
+            with self._data_lock:
+                self.recognizer = recognizer
+            self._write_model()
+            self._save_face_encodings()
+    
+    def enroll_faces(self, user_id, face_images, sources=None):
+        """
+        Thêm khuôn mặt của một người dùng vào kho khuôn mặt và mô hình (LBPH update())
+        
+        Chỉ tính histogram cho các khuôn mặt mới, không đọc lại ảnh của người
+        dùng khác và không huấn luyện lại từ đầu.
+        
+        Args:
+            user_id: ID người dùng
+            face_images: Danh sách ảnh khuôn mặt xám
+            sources: Đường dẫn các ảnh khuôn mặt đã lưu trên đĩa (tùy chọn)
+        """
+        if not face_images:
+            return
+        with self._model_update():
+            normalized = self.face_store.append(user_id, face_images, sources)
+            if self.recognizer.empty():
+                # Chưa có mô hình: huấn luyện lần đầu
+                self._update_recognition_model()
+            else:
+                self._train_update(user_id, normalized)
+            
+            if self.max_samples_per_user and len(self.face_store.user_rows(user_id)) > self.max_samples_per_user:
+                if self.compact_user_samples(user_id):
+                    self.refresh_user_in_model(user_id)
+    
+    def _train_update(self, user_id, face_images):
+        """Thêm các khuôn mặt đã chuẩn hóa vào mô hình dưới nhãn của người dùng (gọi trong _model_update)"""
+        state = self._model_state()
+        label = state["user_to_label"].get(user_id)
+        if label is None:
+            # Cấp nhãn trong cơ sở dữ liệu để tiến trình khác không cấp trùng nhãn
+            label = str(self.user_store.allocate_label(state["next_label"]))
+            state["next_label"] = int(label) + 1
+            state["user_to_label"][user_id] = label
+            state["label_to_user"][label] = user_id
+        
+        labels = np.full(len(face_images), int(label), dtype=np.int32)
+        with self._data_lock:
+            self.recognizer.update(list(face_images), labels)
+            state["sample_count"] += len(face_images)
+        
+        self._write_model()
         self._save_face_encodings()
+        print(f"Đã thêm {len(face_images)} khuôn mặt của {user_id} vào mô hình nhận diện")
+    
+    def remove_user_from_model(self, user_id):
+        """
+        Loại người dùng khỏi kết quả nhận diện mà không huấn luyện lại
+        
+        Nhãn của người dùng được đánh dấu đã xóa (tombstone): các mẫu vẫn nằm
+        trong mô hình nhưng kết quả khớp với nhãn này được xem là không xác định.
+        Khi tỷ lệ mẫu đã xóa vượt ngưỡng, mô hình được nén lại (huấn luyện lại từ đầu).
+        
+        Args:
+            user_id: ID người dùng
+        """
+        with self._model_update():
+            self.face_store.remove_user(user_id)
+            if self._tombstone_user(user_id) and not self._maybe_compact_model():
+                self._save_face_encodings()
+    
+    def _tombstone_user(self, user_id):
+        """Đánh dấu nhãn của người dùng là đã xóa, trả về False nếu người dùng không có trong mô hình"""
+        state = self._model_state()
+        label = state["user_to_label"].pop(user_id, None)
+        if label is None:
+            return False
+        state["label_to_user"].pop(label, None)
+        
+        if not self.recognizer.empty():
+            labels = self.recognizer.getLabels().ravel()
+            state["tombstones"][label] = int(np.count_nonzero(labels == int(label)))
+        return True
+    
+    def refresh_user_in_model(self, user_id):
+        """
+        Cập nhật mô hình sau khi danh sách ảnh của một người dùng thay đổi
+        
+        Nhãn cũ bị đánh dấu đã xóa và các ảnh hiện tại được thêm lại với nhãn mới,
+        chỉ tốn chi phí theo số ảnh của người dùng này.
+        
+        Args:
+            user_id: ID người dùng
+        """
+        with self._model_update():
+            self._sync_user_store(user_id)
+            self._tombstone_user(user_id)
+            if self._maybe_compact_model():
+                # Huấn luyện lại từ đầu đã bao gồm các ảnh hiện tại của người dùng
+                return
+            user_faces = self.face_store.get_user_faces(user_id)
+            if user_faces:
+                self._train_update(user_id, user_faces)
+            else:
+                self._save_face_encodings()
+    
+    def _maybe_compact_model(self, max_tombstone_ratio=0.3):
+        """
+        Huấn luyện lại từ đầu khi số mẫu đã xóa chiếm quá nhiều trong mô hình
+        
+        Returns:
+            bool: True nếu mô hình đã được nén lại
+        """
+        state = self._model_state()
+        dead = sum(state["tombstones"].values())
+        if state["sample_count"] and dead / float(state["sample_count"]) > max_tombstone_ratio:
+            print(f"Mô hình có {dead}/{state['sample_count']} mẫu đã xóa, đang nén lại...")
+            self._update_recognition_model()
+            return True
+        return False
+    
+    def _update_recognition_model(self):
+        """
+        Huấn luyện lại toàn bộ mô hình nhận diện
+        
+        Dữ liệu được đọc từ kho khuôn mặt đóng gói (memory-map); kho được đồng bộ
+        với danh sách ảnh của người dùng trước khi huấn luyện.
+        """
+        with self._model_update():
+            # Đồng bộ kho khuôn mặt với cơ sở dữ liệu người dùng
+            if len(self.face_store) == 0:
+                self.rebuild_face_store()
+            else:
+                for user_id in set(e["user_id"] for e in self.face_store.entries) - set(self.users_data):
+                    self.face_store.remove_user(user_id)
+                for user_id in self.users_data:
+                    self._sync_user_store(user_id)
+                self.face_store.compact()
+        
+            # Thu thập dữ liệu huấn luyện
+            faces, user_ids = self.face_store.training_data()
+            label_ids = {}
+            for user_id in user_ids:
+                if user_id not in label_ids:
+                    # Gán ID số cho người dùng
+                    label_ids[user_id] = len(label_ids)
+            labels = np.array([label_ids[user_id] for user_id in user_ids], dtype=np.int32)
+        
+            # Lưu ánh xạ giữa ID nhãn và ID người dùng
+            self.face_encodings = {
+                "label_to_user": {str(label): user_id for user_id, label in label_ids.items()},
+                "user_to_label": {user_id: str(label) for user_id, label in label_ids.items()},
+                "next_label": len(label_ids),
+                "tombstones": {},
+                "sample_count": len(user_ids),
+                "model_version": self.model_version
+            }
+        
+            if not user_ids:
+                print("Không có dữ liệu khuôn mặt để huấn luyện")
+                # Thay bằng mô hình rỗng: nhãn được đánh lại từ 0 nên mẫu cũ không được giữ lại
+                # (ghi đè file thay vì xóa để không nạp lại face_model.yml cũ)
+                with self._data_lock:
+                    self.recognizer = LBPHModel(dtype=self.recognizer.dtype)
+                self._write_model()
+                self._save_face_encodings()
+                return
+        
+            # Huấn luyện mô hình
+            print(f"Huấn luyện mô hình với {len(user_ids)} khuôn mặt...")
+            recognizer = LBPHModel(dtype=self.recognizer.dtype)
+            recognizer.train(list(faces), labels)
+            with self._data_lock:
+                self.recognizer = recognizer
+        
+            # Lưu mô hình và ánh xạ nhãn
+            self._write_model()
+            self._save_face_encodings()
+        
+            print(f"Đã cập nhật và lưu mô hình nhận diện")
+    
+    def analyze(self, image):
+        """Phát hiện khuôn mặt một lần, trả về DetectionResult (xem FaceDetector.analyze)"""
+        return self.detector.analyze(image)
+    
+    def count_faces(self, image):
+        """Đếm số khuôn mặt trong ảnh hoặc DetectionResult"""
+        return self.detector.count_faces(image)
+    
+    def extract_faces(self, image, padding=0.2, faces=None):
+        """Cắt các khuôn mặt từ ảnh hoặc DetectionResult (xem FaceDetector.extract_faces)"""
+        return self.detector.extract_faces(image, padding, faces)
+    
+    def _get_gallery(self):
+        """Thư viện histogram của mô hình hiện tại (None nếu chưa huấn luyện)"""
+        with self._data_lock:
+            return None if self.recognizer.empty() else self.recognizer.gallery
+    
+    def match_faces(self, face_images, k=5, metric="chisqr"):
+        """
+        Tìm k người dùng gần nhất cho nhiều khuôn mặt trong một lần so khớp
+        
+        Args:
+            face_images: Danh sách ảnh khuôn mặt đã cắt (xám hoặc BGR)
+            k: Số ứng viên cho mỗi khuôn mặt
+            metric: "chisqr" (giống LBPH predict) hoặc "l1"
+            
+        Returns:
+            list: Với mỗi khuôn mặt, danh sách [(user_id, khoảng cách)] tăng dần theo khoảng cách;
+                  user_id là None nếu nhãn đã bị xóa
+        """
+        with self._data_lock:
+            gallery = self._get_gallery()
+            face_encodings = self.face_encodings
+            face_store = self.face_store
+        if gallery is None or not face_encodings:
+            return [[] for _ in face_images]
+        label_to_user = face_encodings.get("label_to_user", {})
+        normalized = [face_store.normalize(face_img) for face_img in face_images]
+        return [[(label_to_user.get(str(label)), distance) for label, distance in matches]
+                for matches in gallery.match(normalized, k, metric)]
+    
+    def _snapshot(self):
+        """Bản chụp nhất quán của mô hình (có thể bị thay bởi reload() ở luồng khác)"""
+        with self._data_lock:
+            return self._get_gallery(), self.face_encodings, self.users_data, self.face_store
+    
+    @staticmethod
+    def _match_crops(gallery, face_store, face_rois, top_k):
+        """Chuẩn hóa kích thước giống các khuôn mặt huấn luyện trong kho và so khớp tất cả cùng lúc"""
+        if not face_rois:
+            return []
+        return gallery.match([face_store.normalize(face_roi) for face_roi in face_rois], k=max(1, top_k))
+    
+    @staticmethod
+    def _identify(matches, label_to_user, confidence_threshold, top_k):
+        """
+        Danh tính của một khuôn mặt từ kết quả so khớp
+        
+        Returns:
+            tuple: (user_id hoặc None, độ tin cậy, danh sách ứng viên hoặc None)
+        """
+        label, distance = matches[0]
         
-        print(f"Đã cập nhật và lưu mô hình nhận diện")
+        # Đổi ngược độ tin cậy để dễ hiểu hơn (100% là hoàn toàn chính xác)
+        confidence_score = 100 - distance
+        
+        # Lấy ID người dùng từ nhãn (None nếu nhãn đã bị xóa khỏi mô hình hoặc độ tin cậy thấp)
+        user_id = label_to_user.get(str(label))
+        if confidence_score < confidence_threshold:
+            user_id = None
+        candidates = None
+        if top_k > 1:
+            candidates = [{"user_id": label_to_user.get(str(candidate)), "confidence": 100 - candidate_distance}
+                          for candidate, candidate_distance in matches]
+        return user_id, confidence_score, candidates
+    
+    def _face_result(self, user_id, confidence_score, bbox, users_data, candidates=None):
+        """Kết quả nhận diện của một khuôn mặt theo định dạng của draw_recognized_faces"""
+        # Người dùng có thể không còn tồn tại
+        if user_id and user_id in users_data:
+            user_info = users_data[user_id]
+            
+            # Cập nhật thời gian nhận diện gần nhất
+            self.mark_recognized(user_id)
+            
+            face_info = {
+                "user_id": user_id,
+                "name": user_info["name"],
+                "confidence": confidence_score,
+                "bbox": bbox,
+                "info": user_info
+            }
+        else:
+            # Khuôn mặt không khớp với độ tin cậy đủ cao
+            face_info = {
+                "user_id": None,
+                "name": "Không xác định",
+                "confidence": confidence_score,
+                "bbox": bbox,
+                "info": {"name": "Không xác định"}
+            }
+        if candidates is not None:
+            face_info["candidates"] = candidates
+        return face_info
     
-    def recognize_face(self, image, confidence_threshold=70):
+    @staticmethod
+    def _error_result(bbox):
+        return {
+            "user_id": None,
+            "name": "Lỗi",
+            "confidence": 0,
+            "bbox": bbox,
+            "info": {"name": "Lỗi nhận diện"}
+        }
+    
+    def recognize_face(self, image, confidence_threshold=70, top_k=1):
         """
         Nhận diện khuôn mặt trong ảnh
         
+        Mọi khuôn mặt trong ảnh được so khớp với thư viện histogram trong một lần gọi
+        (xem FaceGallery). Kết quả tốt nhất trùng với LBPHFaceRecognizer.predict khi
+        thư viện có tối đa gallery.shortlist mẫu (mặc định 256); với thư viện lớn hơn,
+        bước lọc nhanh Hellinger làm kết quả chỉ là xấp xỉ.
+        Nếu đã gắn IdentityCache, chỉ các khuôn mặt cần xác minh lại được so khớp.
+        
         Args:
-            image: Ảnh đầu vào
+            image: Ảnh đầu vào hoặc DetectionResult đã có từ analyze()
             confidence_threshold: Ngưỡng độ tin cậy (càng thấp càng nghiêm ngặt)
+            top_k: Số ứng viên trả về trong trường "candidates" khi lớn hơn 1
             
         Returns:
             list: Danh sách các khuôn mặt đã được nhận diện với thông tin
         """
+        gallery, face_encodings, users_data, face_store = self._snapshot()
+        
         # Kiểm tra xem có dữ liệu nhận diện không
-        if not self.face_encodings or not os.path.exists(self.model_file):
+        if not face_encodings or gallery is None:
             print("Chưa có dữ liệu nhận diện. Hãy thêm người dùng trước")
             return []
         
-        # Chuyển sang ảnh xám
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # Ảnh xám và khuôn mặt được tính một lần (qua bộ theo dõi nếu đã được gắn)
+        detection = self.detector._as_result(image)
+        gray = detection.gray
+        faces = detection.faces
+        if len(faces) == 0:
+            return []
+        
+        # Khuôn mặt của track đã nhận diện dùng lại kết quả cũ, chỉ so khớp các khuôn mặt cần xác minh
+        cache = self.identity_cache
+        tracks = cache.begin_frame(faces, confidence_threshold, self.generation) if cache is not None else None
+        pending = [i for i in range(len(faces)) if tracks is None or tracks[i]["pending"]]
         
-        # Phát hiện khuôn mặt
-        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        try:
+            with timed(self.metrics, "predict"):
+                pending_matches = self._match_crops(gallery, face_store,
+                                                    [gray[y:y+h, x:x+w] for (x, y, w, h) in (faces[i] for i in pending)],
+                                                    top_k)
+        except Exception as e:
+            print(f"Lỗi khi nhận diện khuôn mặt: {str(e)}")
+            return [self._error_result((x, y, w, h)) for (x, y, w, h) in faces]
         
+        if self.metrics is not None:
+            self.metrics.inc("recognitions", len(pending))
+        label_to_user = face_encodings["label_to_user"]
+        matches_by_face = dict(zip(pending, pending_matches))
         recognized_faces = []
         
         # Xử lý từng khuôn mặt được phát hiện
-        for (x, y, w, h) in faces:
-            face_roi = gray[y:y+h, x:x+w]
+        for i, (x, y, w, h) in enumerate(faces):
+            if i in matches_by_face:
+                user_id, confidence_score, candidates = self._identify(matches_by_face[i], label_to_user,
+                                                                       confidence_threshold, top_k)
+                if tracks is not None:
+                    user_id, confidence_score, candidates = cache.resolve(tracks[i], user_id, confidence_score,
+                                                                          candidates)
+            else:
+                user_id = tracks[i]["user_id"]
+                confidence_score = tracks[i]["confidence"]
+                candidates = tracks[i]["candidates"]
             
-            # Nhận diện khuôn mặt
-            try:
-                label, confidence = self.recognizer.predict(face_roi)
-                
-                # Đổi ngược độ tin cậy để dễ hiểu hơn (100% là hoàn toàn chính xác)
-                confidence_score = 100 - confidence
-                
-                if confidence_score >= confidence_threshold:
-                    # Lấy ID người dùng từ nhãn
-                    user_id = self.face_encodings["label_to_user"].get(str(label))
-                    
-                    if user_id and user_id in self.users_data:
-                        user_info = self.users_data[user_id]
-                        
-                        # Cập nhật thời gian nhận diện gần nhất
-                        user_info["last_recognized"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        self._save_users_data()
-                        
-                        recognized_faces.append({
-                            "user_id": user_id,
-                            "name": user_info["name"],
-                            "confidence": confidence_score,
-                            "bbox": (x, y, w, h),
-                            "info": user_info
-                        })
-                    else:
-                        print(f"Không tìm thấy thông tin cho người dùng với nhãn {label}")
-                else:
-                    # Khuôn mặt không khớp với độ tin cậy đủ cao
-                    recognized_faces.append({
-                        "user_id": None,
-                        "name": "Không xác định",
-                        "confidence": confidence_score,
-                        "bbox": (x, y, w, h),
-                        "info": {"name": "Không xác định"}
-                    })
-            except Exception as e:
-                print(f"Lỗi khi nhận diện khuôn mặt: {str(e)}")
-                recognized_faces.append({
-                    "user_id": None,
-                    "name": "Lỗi",
-                    "confidence": 0,
-                    "bbox": (x, y, w, h),
-                    "info": {"name": "Lỗi nhận diện"}
-                })
+            face_info = self._face_result(user_id, confidence_score, (x, y, w, h), users_data, candidates)
+            if tracks is not None:
+                face_info["track_id"] = tracks[i]["track_id"]
+            recognized_faces.append(face_info)
         
         return recognized_faces
     
+    def _recognize_crops(self, face_rois, boxes, confidence_threshold, top_k):
+        """So khớp các khuôn mặt đã cắt trong một lần gọi, kết quả gắn với khung tương ứng"""
+        gallery, face_encodings, users_data, face_store = self._snapshot()
+        if not face_encodings or gallery is None:
+            print("Chưa có dữ liệu nhận diện. Hãy thêm người dùng trước")
+            return []
+        
+        # Khuôn mặt rỗng (khung nằm ngoài ảnh) không được so khớp
+        valid = [i for i, face_roi in enumerate(face_rois) if face_roi is not None and face_roi.size > 0]
+        try:
+            with timed(self.metrics, "predict"):
+                matches = self._match_crops(gallery, face_store, [face_rois[i] for i in valid], top_k)
+        except Exception as e:
+            print(f"Lỗi khi nhận diện khuôn mặt: {str(e)}")
+            return [self._error_result(bbox) for bbox in boxes]
+        
+        if self.metrics is not None:
+            self.metrics.inc("recognitions", len(valid))
+        label_to_user = face_encodings["label_to_user"]
+        matches_by_face = dict(zip(valid, matches))
+        recognized_faces = []
+        for i, bbox in enumerate(boxes):
+            if i not in matches_by_face:
+                recognized_faces.append(self._error_result(bbox))
+                continue
+            user_id, confidence_score, candidates = self._identify(matches_by_face[i], label_to_user,
+                                                                   confidence_threshold, top_k)
+            recognized_faces.append(self._face_result(user_id, confidence_score, bbox, users_data, candidates))
+        return recognized_faces
+    
+    def recognize_faces_batch(self, crops, confidence_threshold=70, top_k=1):
+        """
+        Nhận diện các khuôn mặt đã được cắt sẵn (không chạy lại bộ phát hiện)
+        
+        Các khuôn mặt được chuẩn hóa về kích thước của kho huấn luyện và so khớp
+        cùng lúc trong một lần gọi FaceGallery.match.
+        
+        Args:
+            crops: Danh sách ảnh khuôn mặt đã cắt (xám hoặc BGR, kích thước bất kỳ)
+            confidence_threshold: Ngưỡng độ tin cậy (càng thấp càng nghiêm ngặt)
+            top_k: Số ứng viên trả về trong trường "candidates" khi lớn hơn 1
+            
+        Returns:
+            list: Kết quả cho từng khuôn mặt, cùng định dạng với recognize_face;
+                  "bbox" là toàn bộ ảnh khuôn mặt (0, 0, w, h)
+        """
+        boxes = [(0, 0, crop.shape[1], crop.shape[0]) if crop is not None else (0, 0, 0, 0) for crop in crops]
+        return self._recognize_crops(list(crops), boxes, confidence_threshold, top_k)
+    
+    def recognize_images(self, images, confidence_thresholds=70, top_k=1):
+        """
+        Nhận diện khuôn mặt trong nhiều ảnh với một lần so khớp thư viện
+        
+        Mỗi ảnh được phát hiện riêng, khuôn mặt của mọi ảnh được so khớp chung trong
+        một lần gọi FaceGallery.match rồi tách lại theo ảnh (dùng cho lô yêu cầu của
+        máy chủ). Không dùng IdentityCache vì các ảnh không phải khung hình liên tiếp.
+        
+        Args:
+            images: Danh sách ảnh (BGR) hoặc DetectionResult
+            confidence_thresholds: Ngưỡng độ tin cậy chung, hoặc danh sách ngưỡng theo từng ảnh
+            top_k: Số ứng viên trả về trong trường "candidates" khi lớn hơn 1
+            
+        Returns:
+            list: Với mỗi ảnh, danh sách kết quả cùng định dạng với recognize_face
+        """
+        if not isinstance(confidence_thresholds, (list, tuple)):
+            confidence_thresholds = [confidence_thresholds] * len(images)
+        gallery, face_encodings, users_data, face_store = self._snapshot()
+        if not face_encodings or gallery is None:
+            print("Chưa có dữ liệu nhận diện. Hãy thêm người dùng trước")
+            return [[] for _ in images]
+        
+        detections = [self.detector._as_result(image) for image in images]
+        face_rois = [detection.gray[y:y+h, x:x+w]
+                     for detection in detections for (x, y, w, h) in detection.faces]
+        try:
+            with timed(self.metrics, "predict"):
+                matches = self._match_crops(gallery, face_store, face_rois, top_k)
+        except Exception as e:
+            print(f"Lỗi khi nhận diện khuôn mặt: {str(e)}")
+            return [[self._error_result((x, y, w, h)) for (x, y, w, h) in detection.faces]
+                    for detection in detections]
+        
+        if self.metrics is not None:
+            self.metrics.inc("recognitions", len(face_rois))
+        label_to_user = face_encodings["label_to_user"]
+        results = []
+        position = 0
+        for detection, confidence_threshold in zip(detections, confidence_thresholds):
+            recognized_faces = []
+            for (x, y, w, h) in detection.faces:
+                user_id, confidence_score, candidates = self._identify(matches[position], label_to_user,
+                                                                       confidence_threshold, top_k)
+                position += 1
+                recognized_faces.append(self._face_result(user_id, confidence_score, (x, y, w, h),
+                                                          users_data, candidates))
+            results.append(recognized_faces)
+        return results
+    
+    def recognize_boxes(self, image, boxes, confidence_threshold=70, top_k=1):
+        """
+        Nhận diện khuôn mặt tại các khung cho trước (vd: từ bộ phát hiện khác), không chạy cascade
+        
+        Args:
+            image: Ảnh đầu vào (BGR hoặc xám)
+            boxes: Các khung (x, y, w, h) của khuôn mặt, được cắt theo biên ảnh
+            confidence_threshold: Ngưỡng độ tin cậy (càng thấp càng nghiêm ngặt)
+            top_k: Số ứng viên trả về trong trường "candidates" khi lớn hơn 1
+            
+        Returns:
+            list: Kết quả cho từng khung theo thứ tự, cùng định dạng với recognize_face
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        img_h, img_w = gray.shape[:2]
+        face_rois = []
+        bboxes = []
+        for box in boxes:
+            x, y, w, h = [int(v) for v in box]
+            x1, y1 = max(0, x), max(0, y)
+            x2, y2 = min(img_w, x + w), min(img_h, y + h)
+            face_rois.append(gray[y1:y2, x1:x2] if x2 > x1 and y2 > y1 else None)
+            bboxes.append((x, y, w, h))
+        return self._recognize_crops(face_rois, bboxes, confidence_threshold, top_k)
+    
     def draw_recognized_faces(self, image, recognized_faces, show_info=True):
         """
         Vẽ thông tin nhận diện lên ảnh
@@ -264,6 +1182,10 @@ class FaceRecognizer:
         Returns:
             numpy.ndarray: Ảnh với thông tin được vẽ
         """
+        with timed(self.metrics, "draw"):
+            return self._draw_recognized_faces(image, recognized_faces, show_info)
+    
+    def _draw_recognized_faces(self, image, recognized_faces, show_info):
         result_image = image.copy()
         
         for face_info in recognized_faces:
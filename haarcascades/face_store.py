@@ -0,0 +1,285 @@
+import cv2
+import os
+import json
+import numpy as np
+from contextlib import contextmanager
+from persistence import atomic_write_bytes, file_lock
+
+
+class FaceStore:
+    """
+    Kho khuôn mặt đóng gói cho việc huấn luyện
+
+    Mọi khuôn mặt được chuẩn hóa về cùng kích thước và ghi nối tiếp vào một
+    file mảng uint8 (N x H x W) có thể memory-map, kèm chỉ mục JSONL
+    (mỗi dòng: row, user_id, face_id, source). Việc huấn luyện lại đọc một
+    vùng nhớ liên tục thay vì giải mã hàng nghìn file JPEG nhỏ.
+
+    Xóa khuôn mặt chỉ ghi thêm một dòng đánh dấu vào chỉ mục; compact()
+    ghi lại file dữ liệu khi cần loại bỏ hẳn các dòng đã xóa.
+
+    Mọi thao tác ghi giữ khóa file (faces.lock) và đọc nốt phần chỉ mục do
+    tiến trình khác ghi thêm trước khi tính dòng tiếp theo, nên hai tiến
+    trình cùng thêm khuôn mặt không ghi chồng lên dòng của nhau.
+    """
+
+    DATA_FILE = "faces.u8"
+    INDEX_FILE = "faces_index.jsonl"
+    META_FILE = "store_meta.json"
+    LOCK_FILE = "faces.lock"
+
+    def __init__(self, store_dir, face_size=(100, 100)):
+        """
+        Args:
+            store_dir: Thư mục chứa kho khuôn mặt
+            face_size: Kích thước chuẩn hóa (width, height) cho kho mới
+        """
+        self.store_dir = store_dir
+        self.data_file = os.path.join(store_dir, self.DATA_FILE)
+        self.index_file = os.path.join(store_dir, self.INDEX_FILE)
+        self.meta_file = os.path.join(store_dir, self.META_FILE)
+        self.lock_file = os.path.join(store_dir, self.LOCK_FILE)
+        os.makedirs(store_dir, exist_ok=True)
+
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.face_size = tuple(meta["face_size"])
+        else:
+            self.face_size = tuple(face_size)
+            self._write_meta()
+
+        self.entries = []
+        self.deleted = set()
+        self._mmap = None
+        # Vị trí đã đọc tới và định danh (inode) của file chỉ mục
+        self._index_pos = 0
+        self._index_id = None
+        self._load_index()
+
+    @property
+    def face_bytes(self):
+        return self.face_size[0] * self.face_size[1]
+
+    def _write_meta(self):
+        meta = {"face_size": list(self.face_size), "dtype": "uint8", "layout": "N x H x W"}
+        atomic_write_bytes(self.meta_file, json.dumps(meta, indent=4).encode('utf-8'))
+
+    def _load_index(self):
+        """
+        Đọc phần chỉ mục chưa đọc (tiến trình khác có thể đã ghi thêm), bỏ qua
+        các dòng không có dữ liệu tương ứng (ghi dở khi bị ngắt)
+        """
+        try:
+            stat = os.stat(self.index_file)
+        except OSError:
+            return
+        if (stat.st_ino, stat.st_dev) != self._index_id or stat.st_size < self._index_pos:
+            # Chỉ mục đã được ghi lại (compact/clear): đọc lại từ đầu
+            self.entries = []
+            self.deleted = set()
+            self._mmap = None
+            self._index_pos = 0
+            self._index_id = (stat.st_ino, stat.st_dev)
+        if stat.st_size == self._index_pos:
+            return
+        data_rows = os.path.getsize(self.data_file) // self.face_bytes if os.path.exists(self.data_file) else 0
+        num_entries = len(self.entries)
+        with open(self.index_file, 'rb') as f:
+            f.seek(self._index_pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._index_pos += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "deleted" in record:
+                    self.deleted.add(record["deleted"])
+                elif record["row"] == len(self.entries) and record["row"] < data_rows:
+                    self.entries.append(record)
+        if len(self.entries) != num_entries:
+            self._mmap = None
+
+    @contextmanager
+    def _locked(self):
+        """Giữ khóa ghi của kho và cập nhật chỉ mục theo bản trên đĩa"""
+        with file_lock(self.lock_file):
+            self._load_index()
+            yield
+
+    def __len__(self):
+        """Số khuôn mặt còn hiệu lực"""
+        return len(self.entries) - len(self.deleted)
+
+    def normalize(self, face_img):
+        """Chuyển khuôn mặt về ảnh xám uint8 kích thước chuẩn của kho"""
+        if face_img.ndim == 3:
+            face_img = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
+        if (face_img.shape[1], face_img.shape[0]) != self.face_size:
+            interpolation = cv2.INTER_AREA if face_img.shape[1] > self.face_size[0] else cv2.INTER_LINEAR
+            face_img = cv2.resize(face_img, self.face_size, interpolation=interpolation)
+        return np.ascontiguousarray(face_img, dtype=np.uint8)
+
+    def append(self, user_id, face_images, sources=None):
+        """
+        Thêm khuôn mặt vào cuối kho
+
+        Args:
+            user_id: ID người dùng
+            face_images: Danh sách ảnh khuôn mặt (xám hoặc BGR, kích thước bất kỳ)
+            sources: Danh sách đường dẫn ảnh gốc tương ứng (tùy chọn)
+
+        Returns:
+            list: Các ảnh đã chuẩn hóa
+        """
+        normalized = [self.normalize(face_img) for face_img in face_images]
+        if not normalized:
+            return normalized
+        if sources is None:
+            sources = [None] * len(normalized)
+
+        with self._locked():
+            # Dòng tiếp theo lấy từ chỉ mục trên đĩa; dữ liệu thừa sau dòng cuối
+            # (lần ghi bị ngắt trước khi kịp ghi chỉ mục) bị cắt bỏ.
+            # Ghi dữ liệu trước, chỉ mục sau: chỉ mục không bao giờ trỏ tới dữ liệu chưa có
+            first_row = len(self.entries)
+            with open(self.data_file, 'ab') as f:
+                f.truncate(first_row * self.face_bytes)
+                for face_img in normalized:
+                    f.write(face_img.tobytes())
+
+            records = []
+            for row, source in enumerate(sources, first_row):
+                records.append({"row": row, "user_id": user_id, "face_id": row, "source": source})
+            self._append_index(records)
+            self.entries.extend(records)
+            self._mmap = None
+        return normalized
+
+    def _append_index(self, records):
+        """Ghi thêm các dòng vào chỉ mục (đang giữ khóa nên vị trí đã đọc là cuối file)"""
+        with open(self.index_file, 'a', encoding='utf-8') as f:
+            # Bỏ dòng ghi dở của lần ghi bị ngắt để dòng mới không bị nối vào nó
+            f.truncate(self._index_pos)
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        stat = os.stat(self.index_file)
+        self._index_pos = stat.st_size
+        self._index_id = (stat.st_ino, stat.st_dev)
+
+    def _mark_deleted(self, predicate):
+        with self._locked():
+            rows = [e["row"] for e in self.entries if e["row"] not in self.deleted and predicate(e)]
+            if not rows:
+                return 0
+            self._append_index([{"deleted": row} for row in rows])
+            self.deleted.update(rows)
+        return len(rows)
+
+    def remove_user(self, user_id):
+        """Đánh dấu xóa mọi khuôn mặt của người dùng, trả về số khuôn mặt bị xóa"""
+        return self._mark_deleted(lambda e: e["user_id"] == user_id)
+
+    def remove_sources(self, user_id, sources):
+        """Đánh dấu xóa các khuôn mặt của người dùng có ảnh gốc nằm trong sources"""
+        sources = set(sources)
+        return self._mark_deleted(lambda e: e["user_id"] == user_id and e["source"] in sources)
+
+    def user_rows(self, user_id):
+        """Các dòng còn hiệu lực của một người dùng"""
+        return [e["row"] for e in self.entries if e["user_id"] == user_id and e["row"] not in self.deleted]
+
+    def user_sources(self, user_id):
+        """Đường dẫn ảnh gốc của các khuôn mặt còn hiệu lực của một người dùng"""
+        return [self.entries[row]["source"] for row in self.user_rows(user_id)]
+
+    def faces(self):
+        """
+        Toàn bộ dữ liệu khuôn mặt dạng memory-map chỉ đọc
+
+        Returns:
+            numpy.memmap: Mảng N x H x W (uint8), bao gồm cả các dòng đã xóa
+        """
+        if self._mmap is None:
+            if not self.entries:
+                return np.empty((0, self.face_size[1], self.face_size[0]), dtype=np.uint8)
+            self._mmap = np.memmap(self.data_file, dtype=np.uint8, mode='r',
+                                   shape=(len(self.entries), self.face_size[1], self.face_size[0]))
+        return self._mmap
+
+    def get_user_faces(self, user_id):
+        """Các khuôn mặt đã chuẩn hóa của một người dùng"""
+        data = self.faces()
+        return [data[row] for row in self.user_rows(user_id)]
+
+    def training_data(self):
+        """
+        Dữ liệu huấn luyện: khuôn mặt còn hiệu lực và ID người dùng tương ứng
+
+        Returns:
+            faces: Mảng K x H x W (uint8) các khuôn mặt
+            user_ids: Danh sách K ID người dùng
+        """
+        live = [e for e in self.entries if e["row"] not in self.deleted]
+        data = self.faces()
+        if len(live) == len(self.entries):
+            faces = data
+        else:
+            faces = data[[e["row"] for e in live]]
+        return faces, [e["user_id"] for e in live]
+
+    def compact(self):
+        """Ghi lại kho, loại bỏ hẳn các khuôn mặt đã xóa"""
+        with self._locked():
+            if not self.deleted:
+                return
+            faces, _ = self.training_data()
+            live = [e for e in self.entries if e["row"] not in self.deleted]
+            faces = np.array(faces)
+            self._reset_files(faces.tobytes(), live)
+
+    def _reset_files(self, data, entries):
+        records = []
+        for row, entry in enumerate(entries):
+            records.append({"row": row, "user_id": entry["user_id"], "face_id": row, "source": entry["source"]})
+        self._mmap = None
+        atomic_write_bytes(self.data_file, data)
+        index_text = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        atomic_write_bytes(self.index_file, index_text.encode('utf-8'))
+        stat = os.stat(self.index_file)
+        self._index_pos = stat.st_size
+        self._index_id = (stat.st_ino, stat.st_dev)
+        self.entries = records
+        self.deleted = set()
+
+    def clear(self):
+        """Xóa toàn bộ dữ liệu của kho"""
+        with file_lock(self.lock_file):
+            self._reset_files(b"", [])
+
+    def rebuild(self, user_faces):
+        """
+        Dựng lại kho từ danh sách ảnh khuôn mặt trên đĩa
+
+        Args:
+            user_faces: Danh sách (user_id, [đường dẫn ảnh khuôn mặt])
+
+        Returns:
+            int: Số khuôn mặt đã nạp vào kho
+        """
+        self.clear()
+        count = 0
+        for user_id, paths in user_faces:
+            faces = []
+            sources = []
+            for face_path in paths:
+                face_img = cv2.imread(face_path, cv2.IMREAD_GRAYSCALE)
+                if face_img is None:
+                    print(f"Cảnh báo: Không thể đọc ảnh khuôn mặt {face_path}")
+                    continue
+                faces.append(face_img)
+                sources.append(face_path)
+            count += len(self.append(user_id, faces, sources))
+        return count
@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+
+
+class FaceTracker:
+    """
+    Theo dõi khuôn mặt giữa các lần chạy Haar Cascade
+
+    Cascade chỉ chạy mỗi N khung hình (hoặc khi độ tin cậy theo dõi giảm);
+    ở các khung còn lại vị trí khuôn mặt được lan truyền bằng template matching
+    trên ảnh xám trong một vùng tìm kiếm nhỏ quanh vị trí cũ.
+    """
+
+    def __init__(self, detect_fn, detect_interval=5, min_confidence=0.6,
+                 search_margin=0.5, template_size=48):
+        """
+        Args:
+            detect_fn: Hàm phát hiện khuôn mặt trên ảnh xám, trả về các khung (x, y, w, h)
+            detect_interval: Chạy cascade mỗi bao nhiêu khung hình
+            min_confidence: Điểm khớp tối thiểu (TM_CCOEFF_NORMED) để tiếp tục theo dõi
+            search_margin: Độ mở rộng vùng tìm kiếm (% của kích thước khuôn mặt)
+            template_size: Cạnh lớn nhất của mẫu khi so khớp (thu nhỏ để tăng tốc)
+        """
+        self.detect_fn = detect_fn
+        self.detect_interval = max(1, detect_interval)
+        self.min_confidence = min_confidence
+        self.search_margin = search_margin
+        self.template_size = template_size
+
+        self.tracks = []
+        self.frames_since_detect = 0
+
+        # Thống kê
+        self.detect_count = 0
+        self.track_count = 0
+
+    def reset(self):
+        """Xóa toàn bộ track, lần cập nhật tiếp theo sẽ chạy cascade"""
+        self.tracks = []
+        self.frames_since_detect = 0
+
+    def update(self, gray):
+        """
+        Cập nhật vị trí khuôn mặt cho khung hình mới
+
+        Args:
+            gray: Ảnh xám của khung hình
+
+        Returns:
+            faces: Các khung (x, y, w, h), cùng cấu trúc với detectMultiScale
+        """
+        if not self.tracks or self.frames_since_detect >= self.detect_interval - 1:
+            return self._detect(gray)
+
+        boxes = []
+        for track in self.tracks:
+            box, score = self._match(gray, track)
+            if score < self.min_confidence:
+                # Độ tin cậy giảm: chạy lại cascade cho cả khung hình
+                return self._detect(gray)
+            boxes.append(box)
+
+        for track, box in zip(self.tracks, boxes):
+            track["bbox"] = box
+        self.frames_since_detect += 1
+        self.track_count += 1
+        return np.array(boxes, dtype=np.int32).reshape(-1, 4)
+
+    def _detect(self, gray):
+        faces = self.detect_fn(gray)
+        self.tracks = [self._make_track(gray, box) for box in faces]
+        self.frames_since_detect = 0
+        self.detect_count += 1
+        return faces
+
+    def _scale_for(self, w, h):
+        return min(1.0, self.template_size / float(max(w, h)))
+
+    def _make_track(self, gray, box):
+        x, y, w, h = [int(v) for v in box]
+        scale = self._scale_for(w, h)
+        template = gray[y:y+h, x:x+w]
+        if scale < 1.0:
+            template = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return {"bbox": (x, y, w, h), "template": template, "scale": scale}
+
+    def _match(self, gray, track):
+        """Tìm vị trí mới của track trong vùng lân cận, trả về (khung, điểm khớp)"""
+        x, y, w, h = track["bbox"]
+        img_h, img_w = gray.shape[:2]
+        pad_w = int(w * self.search_margin)
+        pad_h = int(h * self.search_margin)
+
+        x1 = max(0, x - pad_w)
+        y1 = max(0, y - pad_h)
+        x2 = min(img_w, x + w + pad_w)
+        y2 = min(img_h, y + h + pad_h)
+
+        scale = track["scale"]
+        template = track["template"]
+        search = gray[y1:y2, x1:x2]
+        if scale < 1.0:
+            search = cv2.resize(search, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        if search.shape[0] < template.shape[0] or search.shape[1] < template.shape[1]:
+            # Khuôn mặt đã ra khỏi khung hình
+            return track["bbox"], -1.0
+
+        result = cv2.matchTemplate(search, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, max_loc = cv2.minMaxLoc(result)
+
+        new_x = x1 + int(round(max_loc[0] / scale))
+        new_y = y1 + int(round(max_loc[1] / scale))
+        new_x = min(max(0, new_x), img_w - w)
+        new_y = min(max(0, new_y), img_h - h)
+        return (new_x, new_y, w, h), score
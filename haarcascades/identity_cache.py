@@ -0,0 +1,174 @@
+from box_utils import iou
+
+
+class IdentityCache:
+    """
+    Bộ nhớ đệm danh tính theo từng khuôn mặt được theo dõi qua các khung hình
+
+    Mỗi khuôn mặt trong khung mới được ghép với một track của khung trước theo
+    IoU. Track đã có danh tính dùng lại kết quả nhận diện cũ; chỉ những khuôn
+    mặt cần xác minh lại mới được so khớp với mô hình:
+        - track mới xuất hiện,
+        - đã qua reverify_interval khung kể từ lần xác minh trước,
+        - khung đã dịch chuyển/đổi kích thước nhiều so với lúc xác minh (IoU < reverify_iou),
+        - độ tin cậy đã lưu, giảm dần theo thời gian (confidence_decay mỗi khung),
+          xuống dưới ngưỡng nhận diện.
+
+    Để danh tính hiển thị không nhấp nháy, một track đã có danh tính chỉ đổi
+    sang người khác (hoặc sang "không xác định") khi switch_votes lần xác minh
+    liên tiếp cùng cho kết quả khác. Track không còn xuất hiện quá max_missed
+    khung bị xóa.
+
+    Không an toàn luồng: mỗi nguồn video dùng một IdentityCache riêng.
+    """
+
+    def __init__(self, reverify_interval=15, reverify_iou=0.5, match_iou=0.3, confidence_decay=0.5,
+                 max_missed=5, switch_votes=2):
+        """
+        Args:
+            reverify_interval: Xác minh lại danh tính ít nhất mỗi bao nhiêu khung hình
+            reverify_iou: Xác minh lại khi IoU giữa khung hiện tại và khung lúc xác minh nhỏ hơn giá trị này
+            match_iou: IoU tối thiểu để ghép khuôn mặt với track của khung trước
+            confidence_decay: Độ tin cậy đã lưu giảm bao nhiêu mỗi khung (0: không giảm)
+            max_missed: Số khung liên tiếp một track được phép không xuất hiện trước khi bị xóa
+            switch_votes: Số lần xác minh liên tiếp cần để đổi danh tính của track
+        """
+        self.reverify_interval = max(1, reverify_interval)
+        self.reverify_iou = reverify_iou
+        self.match_iou = match_iou
+        self.confidence_decay = confidence_decay
+        self.max_missed = max_missed
+        self.switch_votes = max(1, switch_votes)
+
+        self.tracks = []
+        self.frame_index = 0
+        self.generation = None
+        self._next_id = 0
+
+        # Thống kê
+        self.lookups = 0
+        self.verifications = 0
+        self.switches = 0
+        self.evictions = 0
+
+    def reset(self):
+        """Xóa toàn bộ track"""
+        self.tracks = []
+
+    def begin_frame(self, faces, confidence_threshold, generation=None):
+        """
+        Ghép các khuôn mặt của khung hình mới với các track
+
+        Args:
+            faces: Các khung (x, y, w, h) của khung hình
+            confidence_threshold: Ngưỡng độ tin cậy của nhận diện
+            generation: Thế hệ dữ liệu của bộ nhận diện; khi thay đổi (mô hình được nạp lại)
+                        mọi track được xác minh lại
+
+        Returns:
+            list: Track (dict) tương ứng với từng khuôn mặt; track["pending"] là True
+                  nếu khuôn mặt cần được nhận diện rồi gửi kết quả qua resolve()
+        """
+        self.frame_index += 1
+        reload = generation != self.generation
+        self.generation = generation
+
+        # Ghép tham lam theo IoU giảm dần
+        pairs = []
+        for i, box in enumerate(faces):
+            for j, track in enumerate(self.tracks):
+                overlap = iou(box, track["bbox"])
+                if overlap >= self.match_iou:
+                    pairs.append((overlap, i, j))
+        pairs.sort(reverse=True)
+
+        assigned = [None] * len(faces)
+        used = set()
+        for _, i, j in pairs:
+            if assigned[i] is None and j not in used:
+                assigned[i] = self.tracks[j]
+                used.add(j)
+
+        # Track không xuất hiện: giữ lại vài khung (cascade có thể bỏ sót), sau đó xóa
+        kept = []
+        for j, track in enumerate(self.tracks):
+            if j in used:
+                track["missed"] = 0
+                kept.append(track)
+            elif track["missed"] < self.max_missed:
+                track["missed"] += 1
+                kept.append(track)
+            else:
+                self.evictions += 1
+
+        for i, box in enumerate(faces):
+            track = assigned[i]
+            if track is None:
+                track = self._new_track()
+                kept.append(track)
+                assigned[i] = track
+            track["bbox"] = tuple(int(v) for v in box)
+            track["pending"] = reload or self._needs_verification(track, confidence_threshold)
+            self.lookups += 1
+        self.tracks = kept
+        return assigned
+
+    def _new_track(self):
+        track = {"track_id": self._next_id, "bbox": None, "verified_bbox": None, "verified_frame": None,
+                 "user_id": None, "confidence": 0.0, "candidates": None, "votes": 0, "missed": 0,
+                 "pending": True}
+        self._next_id += 1
+        return track
+
+    def _needs_verification(self, track, confidence_threshold):
+        if track["verified_frame"] is None or track["votes"]:
+            return True
+        age = self.frame_index - track["verified_frame"]
+        if age >= self.reverify_interval:
+            return True
+        if iou(track["bbox"], track["verified_bbox"]) < self.reverify_iou:
+            return True
+        # Chỉ áp dụng cho danh tính đã biết (khuôn mặt không xác định đã ở dưới ngưỡng)
+        decayed = track["confidence"] - self.confidence_decay * age
+        return track["user_id"] is not None and decayed < confidence_threshold
+
+    def resolve(self, track, user_id, confidence, candidates=None):
+        """
+        Ghi kết quả nhận diện của một track đang chờ xác minh
+
+        Args:
+            track: Track trả về từ begin_frame()
+            user_id: ID người dùng nhận diện được (None nếu không xác định)
+            confidence: Độ tin cậy
+            candidates: Danh sách ứng viên (tùy chọn)
+
+        Returns:
+            tuple: (user_id, confidence, candidates) cần hiển thị cho track
+        """
+        self.verifications += 1
+        first = track["verified_frame"] is None
+        track["verified_frame"] = self.frame_index
+        track["verified_bbox"] = track["bbox"]
+        if first or user_id == track["user_id"] or track["user_id"] is None:
+            # Track mới, cùng danh tính, hoặc khuôn mặt chưa xác định nay đã nhận ra: nhận ngay
+            if not first and user_id != track["user_id"]:
+                self.switches += 1
+            track.update(user_id=user_id, confidence=confidence, candidates=candidates, votes=0)
+        else:
+            # Kết quả khác danh tính hiện tại: chỉ đổi khi đủ số lần liên tiếp
+            track["votes"] += 1
+            if track["votes"] >= self.switch_votes:
+                self.switches += 1
+                track.update(user_id=user_id, confidence=confidence, candidates=candidates, votes=0)
+        return track["user_id"], track["confidence"], track["candidates"]
+
+    def stats(self):
+        """Số lần tra cứu, số lần phải nhận diện, tỷ lệ dùng lại kết quả và số track"""
+        return {
+            "lookups": self.lookups,
+            "verifications": self.verifications,
+            "hit_rate": 1.0 - self.verifications / float(self.lookups) if self.lookups else 0.0,
+            "switches": self.switches,
+            "evictions": self.evictions,
+            "tracks": len(self.tracks),
+        }
@@ -0,0 +1,410 @@
+import os
+import json
+import struct
+import cv2
+import numpy as np
+from face_gallery import FaceGallery, HISTOGRAM_DTYPES
+
+
+class LBPHModel:
+    """
+    Mô hình LBPH lưu dạng nhị phân, tương thích với cv2.face.LBPHFaceRecognizer
+
+    Có cùng các phương thức mà chương trình dùng (train, update, predict, read,
+    write, empty, getLabels, getHistograms, ...) nhưng histogram được giữ trong
+    FaceGallery (ma trận NumPy) thay vì bên trong đối tượng OpenCV.
+
+    Định dạng nhị phân: MAGIC, độ dài header (uint32), header JSON (tham số LBP,
+    sức chứa, kích thước, kiểu lưu trữ), sau đó là số mẫu (int64), mảng nhãn
+    int32, ma trận histogram và (với thư viện lớn) chỉ mục lọc nhanh của
+    FaceGallery, mỗi phần bắt đầu ở vị trí căn lề 64 byte. Khi đọc, các ma trận
+    được memory-map nên thời gian nạp gần như không phụ thuộc số mẫu và các
+    tiến trình dùng chung một file mô hình chia sẻ cùng một bản trong bộ nhớ
+    (page cache).
+
+    Mỗi phần có chỗ cho "capacity" mẫu (phần dự trữ là vùng trống của file),
+    nên append_binary chỉ ghi các mẫu mới rồi cập nhật số mẫu: thêm khuôn mặt
+    không phải ghi lại cả file. File phiên bản 1-2 (không có phần dự trữ) vẫn
+    đọc được và được ghi lại theo phiên bản mới ở lần ghi tiếp theo.
+    Histogram có thể lưu dạng float32, float16 hoặc uint8 (xem quantize_histograms).
+    Định dạng YAML của OpenCV vẫn được hỗ trợ để nhập/xuất (read/write chọn định
+    dạng theo nội dung/phần mở rộng file).
+    """
+
+    MAGIC = b"LBPHBIN\x01"
+    ALIGNMENT = 64
+    VERSION = 3
+    # Số mẫu dự trữ tối thiểu khi ghi cả file (ngoài ra dự trữ thêm 1/4 số mẫu hiện có)
+    SPARE_SAMPLES = 16
+    YAML_EXTENSIONS = ('.yml', '.yaml', '.xml')
+
+    def __init__(self, radius=1, neighbors=8, grid_x=8, grid_y=8, threshold=np.finfo(np.float64).max,
+                 dtype="float32"):
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.threshold = threshold
+        self.dtype = dtype
+        self.gallery = self._new_gallery(np.empty((0, self._dimension()), dtype=np.float32), [])
+        # File nhị phân đang khớp với thư viện: (định danh file, số mẫu trong file, origin của thư viện)
+        self._persisted = None
+
+    def _dimension(self):
+        return self.grid_x * self.grid_y * (2 ** self.neighbors)
+
+    def _new_gallery(self, histograms, labels, **kwargs):
+        kwargs.setdefault("dtype", self.dtype)
+        return FaceGallery(histograms, labels, self.radius, self.neighbors, self.grid_x, self.grid_y, **kwargs)
+
+    def astype(self, dtype):
+        """Bản sao của mô hình với histogram lưu theo kiểu dtype ("float32", "float16" hoặc "uint8")"""
+        model = LBPHModel(self.radius, self.neighbors, self.grid_x, self.grid_y, self.threshold, dtype)
+        model.gallery = self.gallery.astype(dtype)
+        return model
+
+    # ---- Giao diện giống LBPHFaceRecognizer ----
+
+    def empty(self):
+        return len(self.gallery) == 0
+
+    def getRadius(self):
+        return self.radius
+
+    def getNeighbors(self):
+        return self.neighbors
+
+    def getGridX(self):
+        return self.grid_x
+
+    def getGridY(self):
+        return self.grid_y
+
+    def getThreshold(self):
+        return self.threshold
+
+    def getLabels(self):
+        return self.gallery.labels.reshape(-1, 1)
+
+    def getHistograms(self):
+        return [h.reshape(1, -1) for h in self.gallery.dequantized()]
+
+    def train(self, src, labels):
+        """Huấn luyện lại từ đầu với các khuôn mặt xám src và nhãn tương ứng"""
+        self.gallery = self._new_gallery(self.gallery.compute_histograms(src), np.asarray(labels).ravel())
+
+    def update(self, src, labels):
+        """Thêm khuôn mặt mới (thư viện cũ không bị thay đổi, xem FaceGallery.extended)"""
+        self.gallery = self.gallery.extended(self.gallery.compute_histograms(src), np.asarray(labels).ravel())
+
+    def predict(self, src):
+        """
+        Nhãn gần nhất và khoảng cách (giống LBPHFaceRecognizer.predict khi thư
+        viện không lớn hơn gallery.shortlist, xấp xỉ khi lớn hơn - xem FaceGallery)
+        """
+        matches = self.gallery.match([src], k=1)[0]
+        if not matches or matches[0][1] >= self.threshold:
+            return -1, float(np.finfo(np.float64).max)
+        return matches[0]
+
+    def read(self, path, writable=False):
+        """
+        Nạp mô hình, tự nhận định dạng nhị phân hoặc YAML của OpenCV
+
+        Args:
+            path: Đường dẫn file
+            writable: Với file nhị phân, cho phép update() ghi mẫu mới thẳng vào phần dự
+                      trữ của file đang memory-map (xem load_binary)
+        """
+        with open(path, 'rb') as f:
+            magic = f.read(len(self.MAGIC))
+        if magic == self.MAGIC:
+            self.load_binary(path, writable=writable)
+        else:
+            self.import_yaml(path)
+
+    def write(self, path):
+        """Ghi mô hình: YAML của OpenCV nếu phần mở rộng là .yml/.yaml/.xml, ngược lại nhị phân"""
+        if path.lower().endswith(self.YAML_EXTENSIONS):
+            self.export_yaml(path)
+        else:
+            self.save_binary(path)
+
+    # ---- Định dạng nhị phân ----
+
+    @classmethod
+    def _layout(cls, header_length, header):
+        """
+        Vị trí các phần dữ liệu trong file (mỗi phần căn lề ALIGNMENT byte)
+
+        File phiên bản 1 chỉ có labels và histograms (float32). Từ phiên bản 3, số mẫu
+        nằm trong phần "count" và các phần khác có chỗ cho header["capacity"] mẫu.
+
+        Returns:
+            dict: {tên phần: (vị trí, dtype, shape)} theo thứ tự trong file
+        """
+        count, dim = header.get("capacity", header.get("count")), header["dim"]
+        dtype = np.dtype(header.get("dtype", "float32"))
+        sections = [("count", np.int64, (1,))] if header.get("version", 1) >= 3 else []
+        sections.append(("labels", np.int32, (count,)))
+        if header.get("scaled"):
+            sections.append(("scales", np.float32, (count,)))
+        sections.append(("histograms", dtype, (count, dim)))
+        if header.get("index"):
+            if header.get("scaled"):
+                sections.append(("index_scales", np.float32, (count,)))
+            sections.append(("index", dtype, (count, dim)))
+
+        layout = {}
+        offset = len(cls.MAGIC) + 4 + header_length
+        for name, section_dtype, shape in sections:
+            offset = (offset + cls.ALIGNMENT - 1) // cls.ALIGNMENT * cls.ALIGNMENT
+            layout[name] = (offset, np.dtype(section_dtype), shape)
+            offset += np.dtype(section_dtype).itemsize * int(np.prod(shape))
+        return layout
+
+    def _sections(self, with_index):
+        """Các mảng của thư viện theo tên phần trong file"""
+        gallery = self.gallery
+        sections = {"labels": gallery.labels, "histograms": gallery.histograms}
+        if gallery.scales is not None:
+            sections["scales"] = gallery.scales
+        if with_index:
+            sections["index"], sections["index_scales"] = gallery.shortlist_index()
+        return sections
+
+    def _needs_index(self):
+        gallery = self.gallery
+        return bool(gallery.shortlist) and len(gallery) > gallery.shortlist
+
+    def _mark_persisted(self, path, count):
+        stat = os.stat(path)
+        self._persisted = ((stat.st_ino, stat.st_dev), count, self.gallery.origin)
+
+    def save_binary(self, path, capacity=None):
+        """
+        Ghi mô hình ra file nhị phân
+
+        Chỉ mục lọc nhanh chỉ được ghi khi thư viện lớn hơn shortlist (khi đó mới được dùng),
+        để mọi tiến trình memory-map cùng một bản thay vì tự tính.
+
+        Args:
+            path: Đường dẫn file
+            capacity: Số mẫu tối đa mà file chứa được trước khi phải ghi lại (mặc định:
+                      số mẫu hiện có + max(SPARE_SAMPLES, 1/4 số mẫu))
+        """
+        gallery = self.gallery
+        count = len(gallery)
+        if capacity is None:
+            capacity = count + max(self.SPARE_SAMPLES, count // 4)
+        with_index = self._needs_index()
+        sections = self._sections(with_index)
+        sections["count"] = np.array([count], dtype=np.int64)
+        header = {
+            "version": self.VERSION,
+            "radius": self.radius, "neighbors": self.neighbors,
+            "grid_x": self.grid_x, "grid_y": self.grid_y,
+            "threshold": float(self.threshold),
+            "capacity": int(max(capacity, count)), "dim": int(gallery.dimension), "dtype": gallery.dtype,
+            "scaled": gallery.scales is not None, "index": with_index,
+        }
+        encoded = json.dumps(header).encode('utf-8')
+
+        with open(path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<I', len(encoded)))
+            f.write(encoded)
+            end = f.tell()
+            for name, (offset, dtype, shape) in self._layout(len(encoded), header).items():
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(np.ascontiguousarray(sections[name], dtype=dtype).data)
+                # Phần dự trữ để trống (vùng trống của file, không chiếm đĩa trên hầu hết hệ thống file)
+                end = offset + dtype.itemsize * int(np.prod(shape))
+                f.seek(end)
+            f.truncate(end)
+        self._mark_persisted(path, count)
+
+    def append_binary(self, path):
+        """
+        Ghi các mẫu mới (thêm bằng update() sau lần đọc/ghi file gần nhất) vào phần dự trữ của file
+
+        Các mẫu được ghi trước, số mẫu sau cùng (8 byte) nên tiến trình khác đọc
+        file luôn thấy bản cũ hoặc bản mới hoàn chỉnh.
+
+        Returns:
+            bool: False nếu không ghi thêm được (file khác với lần đọc/ghi gần nhất, thư
+                  viện đã được huấn luyện lại, hết chỗ dự trữ, cần thêm chỉ mục lọc nhanh...);
+                  khi đó cần ghi lại cả file bằng save_binary
+        """
+        if self._persisted is None:
+            return False
+        identity, persisted_count, origin = self._persisted
+        gallery = self.gallery
+        try:
+            stat = os.stat(path)
+            header = self.read_header(path)
+        except (OSError, ValueError):
+            return False
+        count = len(gallery)
+        if ((stat.st_ino, stat.st_dev) != identity or gallery.origin is not origin
+                or header.get("version", 1) < 3 or header["count"] != persisted_count
+                or count < persisted_count or count > header["capacity"]
+                or header["dim"] != gallery.dimension or header["dtype"] != gallery.dtype
+                or header["scaled"] != (gallery.scales is not None)
+                or (self._needs_index() and not header["index"])):
+            return False
+        if count == persisted_count:
+            return True
+
+        sections = self._sections(header["index"])
+        layout = header["layout"]
+        with open(path, 'r+b') as f:
+            for name, (offset, dtype, shape) in layout.items():
+                if name == "count":
+                    continue
+                row_bytes = dtype.itemsize * int(np.prod(shape[1:]))
+                f.seek(offset + persisted_count * row_bytes)
+                f.write(np.ascontiguousarray(sections[name][persisted_count:count], dtype=dtype).data)
+            f.flush()
+            f.seek(layout["count"][0])
+            f.write(struct.pack('<q', count))
+        self._persisted = (identity, count, origin)
+        return True
+
+    @classmethod
+    def read_header(cls, path):
+        """
+        Đọc header của file nhị phân (thêm "layout": vị trí các phần dữ liệu, xem _layout)
+
+        Raises:
+            ValueError: File không phải mô hình nhị phân, kiểu histogram không hỗ trợ hoặc
+                        file ngắn hơn bố cục trong header (bị cắt ngắn)
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"'{path}' không phải file mô hình nhị phân")
+            (length,) = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(length).decode('utf-8'))
+            if header.get("dtype", "float32") not in HISTOGRAM_DTYPES:
+                raise ValueError(f"'{path}': kiểu histogram không hỗ trợ: {header['dtype']}")
+            header["layout"] = cls._layout(length, header)
+            if "count" in header["layout"]:
+                f.seek(header["layout"]["count"][0])
+                (header["count"],) = struct.unpack('<q', f.read(8))
+            offset, dtype, shape = list(header["layout"].values())[-1]
+            if os.fstat(f.fileno()).st_size < offset + dtype.itemsize * int(np.prod(shape)):
+                raise ValueError(f"'{path}': file mô hình bị cắt ngắn")
+        return header
+
+    @classmethod
+    def stored_count(cls, path):
+        """Số mẫu trong file nhị phân, None nếu không đọc được"""
+        try:
+            return cls.read_header(path)["count"]
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+
+    def load_binary(self, path, mmap=None, writable=False):
+        """
+        Nạp file nhị phân
+
+        Args:
+            path: Đường dẫn file
+            mmap: Memory-map các ma trận thay vì đọc vào bộ nhớ. Mặc định bật, trừ trên
+                  Windows (file đang được map không thể bị thay thế bằng os.replace)
+            writable: Memory-map cả phần dự trữ ở chế độ ghi được: update() ghi mẫu mới
+                      thẳng vào file (chưa có hiệu lực tới khi append_binary cập nhật số
+                      mẫu) thay vì chép thư viện ra bộ nhớ. Chỉ dùng ở tiến trình giữ khóa
+                      ghi mô hình (xem FaceRecognizer._model_update)
+        """
+        if mmap is None:
+            mmap = os.name != 'nt'
+        header = self.read_header(path)
+        self.radius = header["radius"]
+        self.neighbors = header["neighbors"]
+        self.grid_x = header["grid_x"]
+        self.grid_y = header["grid_y"]
+        self.threshold = header["threshold"]
+        self.dtype = header.get("dtype", "float32")
+        # Bố cục histogram phải khớp với tham số LBP (số ô lưới x số mẫu LBP)
+        if header["dim"] != self._dimension():
+            raise ValueError(f"'{path}': kích thước histogram {header['dim']} không khớp với tham số LBP "
+                             f"(grid {self.grid_x}x{self.grid_y}, neighbors {self.neighbors})")
+
+        count = header["count"]
+        if count == 0:
+            self.gallery = self._new_gallery(np.empty((0, header["dim"]), dtype=np.float32), [])
+            self._mark_persisted(path, count)
+            return
+        sections = {}
+        for name, (offset, dtype, shape) in header["layout"].items():
+            if name == "count":
+                continue
+            if mmap and len(shape) == 2:
+                # Map cả phần dự trữ; thư viện chỉ dùng count dòng đầu
+                sections[name] = np.memmap(path, dtype=dtype, mode='r+' if writable else 'r',
+                                           offset=offset, shape=shape)
+            else:
+                rows = (count,) + shape[1:]
+                sections[name] = np.fromfile(path, dtype=dtype, count=int(np.prod(rows)),
+                                             offset=offset).reshape(rows)
+        index = None
+        if "index" in sections:
+            index = (sections["index"], sections.get("index_scales"))
+        self.gallery = self._new_gallery(sections["histograms"], sections["labels"],
+                                         scales=sections.get("scales"), index=index)
+        self._mark_persisted(path, count)
+
+    # ---- Định dạng YAML của OpenCV ----
+
+    def import_yaml(self, path):
+        """Nạp file YAML/XML do LBPHFaceRecognizer.write tạo ra"""
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+        recognizer.read(path)
+        self.radius = recognizer.getRadius()
+        self.neighbors = recognizer.getNeighbors()
+        self.grid_x = recognizer.getGridX()
+        self.grid_y = recognizer.getGridY()
+        self.threshold = recognizer.getThreshold()
+        self.gallery = FaceGallery.from_recognizer(recognizer, dtype=self.dtype)
+
+    def export_yaml(self, path):
+        """Xuất mô hình theo định dạng mà LBPHFaceRecognizer.read đọc được"""
+        fs = cv2.FileStorage(path, cv2.FILE_STORAGE_WRITE)
+        try:
+            fs.startWriteStruct("opencv_lbphfaces", cv2.FileNode_MAP)
+            fs.write("threshold", float(self.threshold))
+            fs.write("radius", int(self.radius))
+            fs.write("neighbors", int(self.neighbors))
+            fs.write("grid_x", int(self.grid_x))
+            fs.write("grid_y", int(self.grid_y))
+            fs.startWriteStruct("histograms", cv2.FileNode_SEQ)
+            for histogram in self.getHistograms():
+                fs.write("", histogram)
+            fs.endWriteStruct()
+            fs.write("labels", self.getLabels().astype(np.int32))
+            fs.startWriteStruct("labelsInfo", cv2.FileNode_SEQ)
+            fs.endWriteStruct()
+            fs.endWriteStruct()
+        finally:
+            fs.release()
+
+
+def convert_model(src_path, dst_path, dtype=None):
+    """
+    Chuyển đổi mô hình giữa định dạng nhị phân và YAML (định dạng đích theo phần mở rộng)
+
+    Args:
+        src_path: File nguồn
+        dst_path: File đích
+        dtype: Kiểu lưu histogram trong file nhị phân đích (mặc định: giữ nguyên)
+
+    Returns:
+        int: Số mẫu trong mô hình
+    """
+    model = LBPHModel()
+    model.read(src_path)
+    if dtype is not None:
+        model = model.astype(dtype)
+    model.write(dst_path)
+    return len(model.gallery)
@@ -3,7 +3,13 @@ import os
 import argparse
 import json
 import shutil
+import csv
+import time
+from datetime import datetime
+from multiprocessing import Pool
 from face_recognizer import FaceRecognizer
+from face_gallery import HISTOGRAM_DTYPES, quantization_report
+from detector_profiles import resolve_detector_options
 
 def list_users(recognizer):
     """Liệt kê tất cả người dùng trong cơ sở dữ liệu"""
@@ -58,73 +64,7 @@ def add_face(recognizer, user_id, image_path):
         return False
     
     try:
-        # Chuyển từ màu sang ảnh xám
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Phát hiện khuôn mặt bằng cascade classifier
-        faces = recognizer.face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.1,
-            minNeighbors=5,
-            minSize=(30, 30)
-        )
-        
-        if len(faces) == 0:
-            print("Không phát hiện khuôn mặt trong ảnh")
-            return False
-        
-        # Lấy thông tin người dùng hiện tại
-        user_info = recognizer.users_data[user_id]
-        user_dir = os.path.join(recognizer.data_dir, user_id)
-        
-        # Tạo thư mục người dùng nếu chưa tồn tại
-        os.makedirs(user_dir, exist_ok=True)
-        
-        # Chuẩn bị các thư mục cho ảnh khuôn mặt
-        faces_dir = os.path.join(user_dir, "faces")
-        os.makedirs(faces_dir, exist_ok=True)
-        
-        # Cắt khuôn mặt đầu tiên
-        x, y, w, h = faces[0]
-        face_roi = gray[y:y+h, x:x+w]
-        
-        # Đếm số ảnh hiện tại để tạo tên file mới
-        existing_faces = user_info.get("face_images", [])
-        if not existing_faces and "face_image" in user_info:  # Hỗ trợ định dạng cũ
-            existing_faces = [user_info["face_image"]]
-            # Chuyển đổi từ định dạng cũ sang mới
-            if "face_image" in user_info:
-                # Di chuyển ảnh cũ vào thư mục faces nếu cần
-                old_face = user_info["face_image"]
-                if os.path.exists(old_face) and os.path.dirname(old_face) != faces_dir:
-                    new_path = os.path.join(faces_dir, f"{user_id}_face_1.jpg")
-                    shutil.copy2(old_face, new_path)
-                    existing_faces = [new_path]
-        
-        # Tạo tên file mới
-        next_index = len(existing_faces) + 1
-        new_face_filename = os.path.join(faces_dir, f"{user_id}_face_{next_index}.jpg")
-        
-        # Lưu ảnh khuôn mặt mới
-        cv2.imwrite(new_face_filename, face_roi)
-        
-        # Cập nhật danh sách ảnh khuôn mặt
-        existing_faces.append(new_face_filename)
-        user_info["face_images"] = existing_faces
-        
-        # Xóa trường face_image cũ nếu có
-        if "face_image" in user_info:
-            del user_info["face_image"]
-        
-        # Lưu thông tin cập nhật
-        recognizer._save_users_data()
-        
-        # Cập nhật lại mô hình nhận diện
-        print("Đang cập nhật mô hình nhận diện...")
-        recognizer._update_recognition_model()
-        
-        print(f"Đã thêm ảnh khuôn mặt mới (số {next_index}) cho người dùng {user_id}")
-        return True
+        return recognizer.add_face(user_id, image)
         
     except Exception as e:
         print(f"Lỗi khi thêm ảnh khuôn mặt: {str(e)}")
@@ -189,11 +129,11 @@ def remove_face(recognizer, user_id, face_index):
         user_info["face_images"] = face_images
         
         # Lưu thông tin cập nhật
-        recognizer._save_users_data()
+        recognizer.save_user(user_id)
         
-        # Cập nhật lại mô hình nhận diện
+        # Cập nhật lại mô hình nhận diện cho riêng người dùng này
         print("Đang cập nhật mô hình nhận diện...")
-        recognizer._update_recognition_model()
+        recognizer.refresh_user_in_model(user_id)
         
         print(f"Đã xóa ảnh khuôn mặt số {face_index} của người dùng {user_id}")
         return True
@@ -201,6 +141,136 @@ def remove_face(recognizer, user_id, face_index):
         print(f"Lỗi khi xóa ảnh khuôn mặt: {str(e)}")
         return False
 
+# Bộ phát hiện của từng tiến trình con khi nhập hàng loạt (nạp cascade một lần mỗi worker)
+_import_detector = None
+
+def _init_import_worker(cascade_path, detector_options):
+    """Khởi tạo tiến trình con cho lệnh import"""
+    global _import_detector
+    cv2.setNumThreads(1)
+    from face_detector import FaceDetector
+    _import_detector = FaceDetector(cascade_path, **detector_options)
+
+def _detect_import_face(task):
+    """Đọc ảnh, phát hiện và cắt khuôn mặt lớn nhất (chạy trong tiến trình con)"""
+    user_id, image_path = task
+    image = cv2.imread(image_path)
+    if image is None:
+        return user_id, image_path, None, "Không thể đọc ảnh"
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    faces = _import_detector.detect_gray(gray)
+    if len(faces) == 0:
+        return user_id, image_path, None, "Không phát hiện khuôn mặt"
+    x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+    return user_id, image_path, gray[y:y+h, x:x+w].copy(), None
+
+def collect_import_tasks(source_dir=None, manifest=None):
+    """
+    Thu thập danh sách ảnh cần nhập
+    
+    Args:
+        source_dir: Thư mục gốc, mỗi thư mục con là một người dùng (tên thư mục = ID)
+        manifest: File CSV với các cột user_id, name, image (các cột khác là thông tin bổ sung)
+        
+    Returns:
+        tasks: Danh sách (user_id, đường dẫn ảnh)
+        users: Thông tin người dùng {user_id: {"name": ..., ...}}
+    """
+    tasks = []
+    users = {}
+    if manifest:
+        manifest_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, 'r', encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                user_id = (row.pop("user_id", "") or "").strip()
+                image_path = (row.pop("image", "") or "").strip()
+                if not user_id or not image_path:
+                    continue
+                if not os.path.isabs(image_path):
+                    image_path = os.path.join(manifest_dir, image_path)
+                name = (row.pop("name", "") or "").strip() or user_id
+                info = users.setdefault(user_id, {"name": name})
+                info.update({k: v for k, v in row.items() if k and v})
+                tasks.append((user_id, image_path))
+    else:
+        for user_id in sorted(os.listdir(source_dir)):
+            user_dir = os.path.join(source_dir, user_id)
+            if not os.path.isdir(user_dir):
+                continue
+            users[user_id] = {"name": user_id}
+            for filename in sorted(os.listdir(user_dir)):
+                if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
+                    tasks.append((user_id, os.path.join(user_dir, filename)))
+    return tasks, users
+
+def import_users(recognizer, cascade_path, tasks, users, workers=None, detector_options=None):
+    """
+    Nhập hàng loạt người dùng và ảnh khuôn mặt, huấn luyện mô hình một lần ở cuối
+    
+    Phát hiện và cắt khuôn mặt chạy song song trên nhiều tiến trình. Ảnh lỗi
+    được ghi nhận và bỏ qua, không làm dừng cả lô.
+    
+    Args:
+        recognizer: FaceRecognizer
+        cascade_path: Đường dẫn file cascade cho các tiến trình con
+        tasks: Danh sách (user_id, đường dẫn ảnh)
+        users: Thông tin người dùng {user_id: {"name": ..., ...}}
+        workers: Số tiến trình (mặc định: số lõi CPU)
+        detector_options: Tham số FaceDetector của các tiến trình con (vd: từ một profile)
+        
+    Returns:
+        dict: Thống kê và danh sách ảnh lỗi
+    """
+    workers = workers or os.cpu_count() or 1
+    failures = []
+    imported = 0
+    new_users = 0
+    touched_users = set()
+    start_time = time.time()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    with Pool(workers, initializer=_init_import_worker, initargs=(cascade_path, detector_options or {})) as pool:
+        for done, (user_id, image_path, face_roi, error) in enumerate(
+                pool.imap_unordered(_detect_import_face, tasks, chunksize=4), 1):
+            if error:
+                failures.append({"user_id": user_id, "image": image_path, "error": error})
+            else:
+                # Tạo người dùng mới nếu chưa có
+                if user_id not in recognizer.users_data:
+                    info = dict(users.get(user_id, {"name": user_id}))
+                    recognizer.users_data[user_id] = {
+                        "name": info.pop("name", user_id),
+                        "face_images": [],
+                        "created_at": now,
+                        "last_recognized": None,
+                        **info
+                    }
+                    new_users += 1
+                user_info = recognizer.users_data[user_id]
+                touched_users.add(user_id)
+                face_images = FaceRecognizer.get_face_paths(user_info)
+                
+                # Lưu ảnh khuôn mặt và thêm vào kho (chưa huấn luyện)
+                face_filename = recognizer.new_face_path(user_id, face_images)
+                cv2.imwrite(face_filename, face_roi)
+                user_info["face_images"] = face_images + [face_filename]
+                user_info.pop("face_image", None)
+                recognizer.face_store.append(user_id, [face_roi], [face_filename])
+                imported += 1
+            
+            if done % 50 == 0 or done == len(tasks):
+                elapsed = time.time() - start_time
+                print(f"Đã xử lý {done}/{len(tasks)} ảnh ({done / elapsed:.1f} ảnh/giây), "
+                      f"thành công: {imported}, lỗi: {len(failures)}")
+    
+    # Lưu cơ sở dữ liệu (một giao dịch) và huấn luyện mô hình đúng một lần
+    recognizer._save_users_data(touched_users)
+    if imported:
+        recognizer._update_recognition_model()
+    
+    return {"total": len(tasks), "imported": imported, "new_users": new_users,
+            "failures": failures, "elapsed": time.time() - start_time}
+
 def main():
     # Thư mục hiện tại và thư mục dự án
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -218,6 +288,8 @@ def main():
     
     # Phân tích tham số dòng lệnh
     parser = argparse.ArgumentParser(description='Quản lý người dùng cho hệ thống nhận diện khuôn mặt')
+    parser.add_argument('--profile',
+                        help='Profile tham số phát hiện khuôn mặt đã lưu bằng autotune.py (mặc định: default)')
     subparsers = parser.add_subparsers(dest='command', help='Lệnh')
     
     # Lệnh liệt kê người dùng
@@ -248,6 +320,47 @@ def main():
     delete_parser = subparsers.add_parser('delete', help='Xóa người dùng')
     delete_parser.add_argument('--id', required=True, help='ID người dùng cần xóa')
     
+    # Lệnh nhập hàng loạt người dùng
+    import_parser = subparsers.add_parser('import', help='Nhập hàng loạt người dùng từ thư mục hoặc file CSV')
+    import_source = import_parser.add_mutually_exclusive_group(required=True)
+    import_source.add_argument('--dir', help='Thư mục gốc, mỗi thư mục con (tên = ID người dùng) chứa ảnh của một người')
+    import_source.add_argument('--manifest', help='File CSV với các cột user_id, name, image')
+    import_parser.add_argument('--workers', type=int, help='Số tiến trình xử lý song song (mặc định: số lõi CPU)')
+    import_parser.add_argument('--report', help='File JSON lưu danh sách ảnh lỗi')
+    
+    # Lệnh dựng lại kho khuôn mặt đóng gói từ thư mục ảnh của người dùng
+    subparsers.add_parser('rebuild-store', help='Dựng lại kho khuôn mặt đóng gói từ thư mục ảnh người dùng')
+    
+    # Lệnh huấn luyện lại toàn bộ mô hình (nén các mẫu đã xóa)
+    subparsers.add_parser('retrain', help='Huấn luyện lại toàn bộ mô hình từ ảnh khuôn mặt')
+    
+    # Lệnh giới hạn số mẫu mỗi người dùng (giữ tập con đại diện, loại ảnh gần trùng)
+    compact_parser = subparsers.add_parser('compact-gallery',
+                                           help='Giới hạn số mẫu mỗi người dùng bằng tập con đại diện')
+    compact_parser.add_argument('--max-per-user', type=int, help='Số mẫu tối đa mỗi người dùng')
+    compact_parser.add_argument('--duplicate-distance', type=float, default=10.0,
+                                help='Khoảng cách chi-square dưới ngưỡng này được xem là ảnh gần trùng (0: không loại)')
+    compact_parser.add_argument('--id', help='Chỉ nén mẫu của người dùng này')
+    compact_parser.add_argument('--dry-run', action='store_true', help='Chỉ liệt kê ảnh sẽ bị loại')
+    
+    # Lệnh xuất/nhập mô hình (nhị phân <-> YAML của OpenCV)
+    export_parser = subparsers.add_parser('export-model', help='Xuất mô hình nhận diện ra file')
+    export_parser.add_argument('--output', required=True,
+                               help='File đích (.yml/.yaml/.xml: YAML của OpenCV, khác: nhị phân)')
+    import_model_parser = subparsers.add_parser('import-model', help='Nạp mô hình từ file YAML hoặc nhị phân')
+    import_model_parser.add_argument('--input', required=True, help='File mô hình cần nạp')
+    
+    # Lệnh đổi kiểu lưu histogram của mô hình và báo cáo độ chính xác/bộ nhớ
+    quantize_parser = subparsers.add_parser('quantize-model', help='Đổi kiểu lưu histogram của mô hình')
+    quantize_parser.add_argument('--dtype', required=True, choices=HISTOGRAM_DTYPES,
+                                 help='Kiểu lưu histogram (float32: đầy đủ, float16: 1/2, uint8: 1/4 bộ nhớ)')
+    report_parser = subparsers.add_parser('model-report',
+                                          help='So sánh độ chính xác và bộ nhớ của các kiểu lưu histogram')
+    report_parser.add_argument('--samples', type=int, default=200, help='Số mẫu dùng làm probe')
+    
+    # Lệnh nhập lại dữ liệu từ users_database.json và face_encodings.pkl (định dạng cũ)
+    subparsers.add_parser('migrate-db', help='Chuyển dữ liệu từ users_database.json/face_encodings.pkl sang SQLite')
+    
     # Lệnh cập nhật thông tin người dùng
     update_parser = subparsers.add_parser('update', help='Cập nhật thông tin người dùng')
     update_parser.add_argument('--id', required=True, help='ID người dùng cần cập nhật')
@@ -262,7 +375,7 @@ def main():
     
     # Khởi tạo bộ nhận diện
     try:
-        recognizer = FaceRecognizer(cascade_path)
+        recognizer = FaceRecognizer(cascade_path, detector_profile=args.profile)
         print("Đã khởi tạo bộ nhận diện thành công")
     except Exception as e:
         print(f"Lỗi khi khởi tạo bộ nhận diện: {str(e)}")
@@ -354,12 +467,113 @@ def main():
             
             # Xóa người dùng
             del recognizer.users_data[args.id]
-            recognizer._save_users_data()
-            recognizer._update_recognition_model()
+            recognizer.save_user(args.id)
+            recognizer.remove_user_from_model(args.id)
             print(f"Đã xóa người dùng {args.id} ({user_name})")
         else:
             print(f"Không tìm thấy người dùng với ID: {args.id}")
     
+    elif args.command == 'import':
+        source = args.dir or args.manifest
+        if args.dir and not os.path.isdir(args.dir):
+            print(f"Lỗi: Không tìm thấy thư mục '{args.dir}'")
+            return
+        if args.manifest and not os.path.isfile(args.manifest):
+            print(f"Lỗi: Không tìm thấy file '{args.manifest}'")
+            return
+        
+        tasks, users = collect_import_tasks(args.dir, args.manifest)
+        if not tasks:
+            print(f"Không tìm thấy ảnh nào trong '{source}'")
+            return
+        print(f"Đang nhập {len(tasks)} ảnh của {len(users)} người dùng từ '{source}'...")
+        
+        stats = import_users(recognizer, cascade_path, tasks, users, args.workers,
+                             resolve_detector_options(args.profile))
+        
+        print(f"\nĐã nhập {stats['imported']}/{stats['total']} ảnh, "
+              f"{stats['new_users']} người dùng mới, thời gian {stats['elapsed']:.1f} giây")
+        if stats['failures']:
+            print(f"Có {len(stats['failures'])} ảnh lỗi:")
+            for failure in stats['failures'][:20]:
+                print(f"- {failure['image']}: {failure['error']}")
+            if len(stats['failures']) > 20:
+                print(f"... và {len(stats['failures']) - 20} ảnh khác")
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(stats['failures'], f, ensure_ascii=False, indent=4)
+            print(f"Đã lưu danh sách ảnh lỗi tại '{args.report}'")
+    
+    elif args.command == 'rebuild-store':
+        print("Đang dựng lại kho khuôn mặt...")
+        recognizer.rebuild_face_store()
+    
+    elif args.command == 'retrain':
+        print("Đang huấn luyện lại toàn bộ mô hình nhận diện...")
+        recognizer._update_recognition_model()
+    
+    elif args.command == 'compact-gallery':
+        if args.id and args.id not in recognizer.users_data:
+            print(f"Không tìm thấy người dùng với ID: {args.id}")
+            return
+        before = len(recognizer.face_store)
+        retired = recognizer.compact_gallery(args.max_per_user, args.duplicate_distance,
+                                             [args.id] if args.id else None, args.dry_run)
+        for user_id, paths in retired.items():
+            print(f"{user_id}: loại {len(paths)} ảnh")
+            for face_path in paths:
+                print(f"  - {face_path}")
+        num_retired = sum(len(paths) for paths in retired.values())
+        if args.dry_run:
+            print(f"Sẽ loại {num_retired}/{before} mẫu của {len(retired)} người dùng (chưa thay đổi dữ liệu)")
+        else:
+            print(f"Đã loại {num_retired} mẫu của {len(retired)} người dùng, còn {len(recognizer.face_store)} mẫu "
+                  f"(ảnh bị loại vẫn được giữ trên đĩa, trong trường retired_faces)")
+    
+    elif args.command == 'export-model':
+        if recognizer.recognizer.empty():
+            print("Chưa có mô hình nhận diện để xuất")
+            return
+        recognizer.export_model(args.output)
+        print(f"Đã xuất mô hình ({len(recognizer.recognizer.gallery)} mẫu) ra '{args.output}'")
+    
+    elif args.command == 'import-model':
+        if not os.path.isfile(args.input):
+            print(f"Lỗi: Không tìm thấy file '{args.input}'")
+            return
+        recognizer.import_model(args.input)
+        print(f"Đã nạp mô hình ({len(recognizer.recognizer.gallery)} mẫu) từ '{args.input}'")
+    
+    elif args.command == 'quantize-model':
+        if recognizer.recognizer.empty():
+            print("Chưa có mô hình nhận diện")
+            return
+        old_bytes = recognizer.recognizer.gallery.histograms.nbytes
+        recognizer.quantize_model(args.dtype)
+        new_bytes = recognizer.recognizer.gallery.histograms.nbytes
+        print(f"Đã chuyển histogram sang {args.dtype}: {old_bytes / 1e6:.1f} MB -> {new_bytes / 1e6:.1f} MB")
+    
+    elif args.command == 'model-report':
+        gallery = recognizer.recognizer.gallery
+        if len(gallery) < 2:
+            print("Mô hình cần ít nhất 2 mẫu")
+            return
+        print(f"Mô hình: {len(gallery)} mẫu, kiểu lưu hiện tại {gallery.dtype}")
+        if gallery.dtype != "float32":
+            print("Lưu ý: mô hình đã được lượng tử hóa, kết quả float32 là giá trị giải lượng tử")
+        print(f"{'Kiểu':<8} {'Bộ nhớ (MB)':>12} {'Byte/mẫu':>10} {'Trùng float32':>14} "
+              f"{'Đúng nhãn':>10} {'Sai số KC':>10}")
+        for row in quantization_report(gallery, samples=args.samples):
+            print(f"{row['dtype']:<8} {row['bytes'] / 1e6:>12.1f} {row['bytes_per_sample']:>10} "
+                  f"{row['agreement']:>14.1%} {row['accuracy']:>10.1%} {row['distance_error']:>10.2%}")
+    
+    elif args.command == 'migrate-db':
+        if not os.path.exists(recognizer.legacy_users_file):
+            print(f"Không tìm thấy file '{recognizer.legacy_users_file}'")
+            return
+        num_users, num_labels = recognizer.migrate_legacy_files()
+        print(f"Đã chuyển {num_users} người dùng và {num_labels} nhãn sang {recognizer.users_db_file}")
+    
     elif args.command == 'update':
         print(f"Đang cập nhật thông tin người dùng {args.id}...")
         if args.id not in recognizer.users_data:
@@ -387,7 +601,7 @@ def main():
                 return
         
         # Lưu thông tin đã cập nhật
-        recognizer._save_users_data()
+        recognizer.save_user(args.id)
         print(f"Đã cập nhật thông tin cho người dùng {args.id}")
     
     else:
@@ -0,0 +1,274 @@
+import time
+import bisect
+import threading
+import contextlib
+from persistence import atomic_write_bytes
+
+# Biên trên của các bucket độ trễ (giây), dãy 1-2.5-5 từ 0.1 ms tới 10 s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Mô tả các giai đoạn và số liệu quen thuộc (dùng cho dòng HELP của Prometheus)
+DESCRIPTIONS = {
+    "decode": "Giải mã ảnh/đọc khung hình",
+    "cvtcolor": "Chuyển ảnh sang ảnh xám",
+    "detect": "Phát hiện khuôn mặt (detectMultiScale)",
+    "predict": "So khớp khuôn mặt với mô hình",
+    "draw": "Vẽ kết quả lên ảnh",
+    "persist": "Ghi mô hình/cơ sở dữ liệu xuống đĩa",
+    "latency": "Độ trễ từ lúc thu khung hình tới lúc hiển thị",
+    "frames": "Số ảnh/khung hình đã phát hiện",
+    "faces": "Số khuôn mặt đã phát hiện",
+    "recognitions": "Số khuôn mặt đã so khớp với mô hình",
+    "frames_dropped": "Số khung hình bị bỏ",
+    "disk_writes": "Số lần ghi dữ liệu xuống đĩa",
+    "gallery_samples": "Số mẫu trong mô hình",
+    "gallery_bytes": "Dung lượng histogram của mô hình (byte)",
+    "users": "Số người dùng",
+    "requests_rejected": "Số yêu cầu bị từ chối do quá tải",
+    "queue_depth": "Số yêu cầu đang chờ",
+    "uptime_seconds": "Thời gian chạy (giây)",
+}
+
+_DISABLED = contextlib.nullcontext()
+
+
+def timed(metrics, stage):
+    """
+    Ngữ cảnh đo thời gian một giai đoạn
+
+    Khi metrics là None (tắt đo đạc) trả về một nullcontext dùng chung nên
+    gần như không tốn chi phí.
+    """
+    return _DISABLED if metrics is None else metrics.timer(stage)
+
+
+class LatencyHistogram:
+    """
+    Histogram độ trễ với các bucket cố định (giống histogram của Prometheus)
+
+    Bộ nhớ và thời gian ghi không phụ thuộc số lần đo; phân vị (p50/p95/p99)
+    được nội suy tuyến tính trong bucket chứa nó.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Phân vị q (0-1) tính bằng giây, 0.0 nếu chưa có lần đo nào"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.max
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    Số liệu hiệu năng: histogram độ trễ theo giai đoạn, bộ đếm và gauge
+
+    Được gắn vào FaceDetector/FaceRecognizer bằng attach_metrics(); các đối tượng
+    chưa gắn không đo gì. Số liệu đã có sẵn ở nơi khác (hàng đợi của pipeline,
+    kích thước mô hình...) được đọc qua hàm đăng ký bằng register_counter/
+    register_gauge, chỉ khi xuất số liệu. An toàn luồng.
+    """
+
+    def __init__(self, prefix="face", buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            prefix: Tiền tố tên số liệu khi xuất theo định dạng Prometheus
+            buckets: Biên trên của các bucket độ trễ (giây)
+        """
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._collectors = {}
+        self.started_at = time.time()
+
+    def timer(self, stage):
+        """Ngữ cảnh đo thời gian của một giai đoạn (with metrics.timer("detect"): ...)"""
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        """Ghi một lần đo độ trễ (giây) của giai đoạn"""
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram(self.buckets)
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1):
+        """Tăng bộ đếm"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """Đặt giá trị gauge"""
+        with self._lock:
+            self.gauges[name] = value
+
+    def register_counter(self, name, fn):
+        """Bộ đếm có giá trị lấy từ fn() lúc xuất số liệu (vd: số khung bị bỏ của hàng đợi); đăng ký lại sẽ thay hàm cũ"""
+        self._collectors[name] = ("counter", fn)
+
+    def register_gauge(self, name, fn):
+        """Gauge có giá trị lấy từ fn() lúc xuất số liệu (vd: số mẫu trong mô hình); đăng ký lại sẽ thay hàm cũ"""
+        self._collectors[name] = ("gauge", fn)
+
+    def snapshot(self):
+        """
+        Bản chụp các số liệu hiện tại
+
+        Returns:
+            dict: latency ({giai đoạn: count, sum_ms, p50_ms, p95_ms, p99_ms, max_ms}),
+                  counters, gauges
+        """
+        with self._lock:
+            latency = {stage: {
+                "count": h.count,
+                "sum_ms": h.sum * 1000,
+                "p50_ms": h.quantile(0.5) * 1000,
+                "p95_ms": h.quantile(0.95) * 1000,
+                "p99_ms": h.quantile(0.99) * 1000,
+                "max_ms": h.max * 1000,
+            } for stage, h in self.histograms.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        for name, (kind, fn) in list(self._collectors.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"Lỗi khi đọc số liệu '{name}': {str(e)}")
+                continue
+            (counters if kind == "counter" else gauges)[name] = value
+        gauges["uptime_seconds"] = time.time() - self.started_at
+        return {"latency": latency, "counters": counters, "gauges": gauges}
+
+    def to_prometheus(self):
+        """Số liệu theo định dạng văn bản của Prometheus (text exposition format 0.0.4)"""
+        snapshot = self.snapshot()
+        with self._lock:
+            histograms = {stage: (list(h.counts), h.count, h.sum) for stage, h in self.histograms.items()}
+        prefix = self.prefix
+        lines = []
+
+        name = f"{prefix}_stage_duration_seconds"
+        lines.append(f"# HELP {name} Thời gian xử lý theo giai đoạn")
+        lines.append(f"# TYPE {name} histogram")
+        for stage, (counts, count, total) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total:.9g}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+        # Phân vị tính sẵn, tiện cho các công cụ không tự tính được từ bucket
+        name = f"{prefix}_stage_latency_seconds"
+        lines.append(f"# HELP {name} Phân vị độ trễ theo giai đoạn (p50/p95/p99)")
+        lines.append(f"# TYPE {name} gauge")
+        for stage, values in sorted(snapshot["latency"].items()):
+            for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                lines.append(f'{name}{{stage="{stage}",quantile="{quantile}"}} {values[key] / 1000:.9g}')
+
+        for kind, values, suffix in (("counter", snapshot["counters"], "_total"), ("gauge", snapshot["gauges"], "")):
+            for key, value in sorted(values.items()):
+                name = f"{prefix}_{key}{suffix}"
+                lines.append(f"# HELP {name} {DESCRIPTIONS.get(key, key)}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {float(value):.9g}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Ghi số liệu ra file (vd: cho textfile collector của node_exporter), ghi an toàn qua file tạm"""
+        atomic_write_bytes(path, self.to_prometheus().encode('utf-8'))
+
+    def summary(self):
+        """Các dòng tóm tắt độ trễ theo giai đoạn và bộ đếm, dùng để in khi kết thúc"""
+        snapshot = self.snapshot()
+        lines = [f"{stage:<10} n={values['count']:<7} p50 {values['p50_ms']:7.2f} ms  "
+                 f"p95 {values['p95_ms']:7.2f} ms  p99 {values['p99_ms']:7.2f} ms"
+                 for stage, values in sorted(snapshot["latency"].items())]
+        lines += [f"{name}: {value}" for name, value in sorted(snapshot["counters"].items())]
+        return lines
+
+
+class MetricsExporter:
+    """Ghi số liệu ra file Prometheus định kỳ ở luồng nền (và một lần khi dừng)"""
+
+    def __init__(self, metrics, path, interval=10.0):
+        """
+        Args:
+            metrics: Metrics cần xuất
+            path: File đích
+            interval: Chu kỳ ghi (giây)
+        """
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Bắt đầu ghi định kỳ ở luồng nền"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Dừng luồng nền và ghi lần cuối"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.export()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.export()
+
+    def export(self):
+        """Ghi số liệu ra file một lần"""
+        try:
+            self.metrics.write_prometheus(self.path)
+        except Exception as e:
+            print(f"Lỗi khi ghi số liệu ra '{self.path}': {str(e)}")
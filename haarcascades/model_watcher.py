@@ -0,0 +1,102 @@
+import time
+import threading
+
+
+class ModelWatcher:
+    """
+    Tự động nạp lại mô hình và cơ sở dữ liệu người dùng khi chúng thay đổi trên đĩa
+
+    Luồng nền định kỳ so sánh dấu hiệu của face_model.lbph (mtime, kích thước) và
+    cơ sở dữ liệu người dùng (data_version của SQLite) với bản đã nạp. Khi một file thay
+    đổi và giữ nguyên qua hai lần kiểm tra liên tiếp (tránh đọc lúc tiến trình
+    khác đang ghi dở một loạt file), FaceRecognizer.reload() nạp bản mới ở luồng
+    nền rồi thay thế bản cũ trong một bước: luồng xử lý khung hình không phải chờ.
+    """
+
+    def __init__(self, recognizer, interval=2.0, on_reload=None, lock=None):
+        """
+        Args:
+            recognizer: FaceRecognizer cần theo dõi
+            interval: Chu kỳ kiểm tra (giây)
+            on_reload: Hàm gọi sau mỗi lần nạp lại, nhận danh sách file đã thay đổi (tùy chọn)
+            lock: Khóa giữ trong lúc nạp lại, dùng khi recognizer cũng được dùng để ghi (tùy chọn)
+        """
+        self.recognizer = recognizer
+        self.interval = interval
+        self.on_reload = on_reload
+        self.lock = lock
+
+        self._pending = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Thống kê
+        self.reload_count = 0
+        self.error_count = 0
+        self.last_reload = None
+
+    def start(self):
+        """Bắt đầu theo dõi ở luồng nền"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Dừng theo dõi"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.check()
+
+    def check(self):
+        """
+        Kiểm tra thay đổi một lần và nạp lại nếu cần
+
+        Returns:
+            bool: True nếu đã nạp lại
+        """
+        changed = self.recognizer.changed_files()
+        if not changed:
+            self._pending = None
+            return False
+
+        signature = [(path, self.recognizer._signature(path)) for path in changed]
+        if signature != self._pending:
+            # File vừa thay đổi: chờ đến lần kiểm tra sau để chắc chắn việc ghi đã xong
+            self._pending = signature
+            return False
+        self._pending = None
+
+        try:
+            if self.lock is not None:
+                with self.lock:
+                    self.recognizer.reload(changed)
+            else:
+                self.recognizer.reload(changed)
+        except Exception as e:
+            self.error_count += 1
+            print(f"Lỗi khi nạp lại mô hình: {str(e)}")
+            return False
+
+        self.reload_count += 1
+        self.last_reload = time.time()
+        print(f"Đã nạp lại dữ liệu nhận diện (phiên bản mô hình {self.recognizer.model_version}, "
+              f"thế hệ {self.recognizer.generation})")
+        if self.on_reload is not None:
+            self.on_reload(changed)
+        return True
+
+    def stats(self):
+        """Phiên bản mô hình, thế hệ dữ liệu và số lần nạp lại"""
+        return {
+            "model_version": self.recognizer.model_version,
+            "generation": self.recognizer.generation,
+            "reloads": self.reload_count,
+            "reload_errors": self.error_count,
+            "last_reload": self.last_reload,
+        }
@@ -0,0 +1,250 @@
+import os
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from face_detector import FaceDetector
+from box_utils import iou, expand_box, merge_regions, non_max_suppression, weighted_box_fusion
+from metrics import timed
+
+# Các cascade thêm vào cascade chính khi kết hợp (--combine-cascades)
+DEFAULT_EXTRA_CASCADES = ("haarcascade_frontalface_alt2.xml", "haarcascade_profileface.xml")
+
+# Cách gộp kết quả của các cascade
+FUSION_METHODS = ("weighted", "nms")
+
+
+def find_cascade(name, search_dirs=None):
+    """
+    Tìm file cascade theo tên
+
+    Args:
+        name: Tên file (vd: haarcascade_frontalface_alt2.xml) hoặc đường dẫn
+        search_dirs: Các thư mục tìm kiếm (mặc định: thư mục haarcascades,
+                     sau đó thư mục dữ liệu đi kèm OpenCV - cv2.data.haarcascades)
+
+    Returns:
+        str: Đường dẫn file, None nếu không tìm thấy
+    """
+    if os.path.isfile(name):
+        return name
+    if search_dirs is None:
+        search_dirs = [os.path.dirname(os.path.abspath(__file__))]
+        data = getattr(cv2, "data", None)
+        if data is not None:
+            search_dirs.append(data.haarcascades)
+    for directory in search_dirs:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def resolve_cascades(names, search_dirs=None):
+    """Đường dẫn của các cascade tìm thấy (không trùng lặp); cascade không có được bỏ qua kèm cảnh báo"""
+    paths = []
+    for name in names:
+        path = find_cascade(name, search_dirs)
+        if path is None:
+            print(f"Bỏ qua cascade '{name}': không tìm thấy trong thư mục haarcascades hoặc dữ liệu của OpenCV")
+        elif os.path.abspath(path) not in [os.path.abspath(p) for p in paths]:
+            paths.append(path)
+    return paths
+
+
+def cascade_label(path):
+    """Tên ngắn của cascade, vd: haarcascade_frontalface_alt2.xml -> frontalface_alt2"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name[len("haarcascade_"):] if name.startswith("haarcascade_") else name
+
+
+class _CascadeJob:
+    """Một lượt chạy cascade trên ảnh xám dùng chung (hoặc bản lật ngang của nó)"""
+    __slots__ = ("label", "source", "cascade", "mirrored", "gated")
+
+    def __init__(self, label, source, cascade, mirrored, gated):
+        self.label = label
+        self.source = source
+        self.cascade = cascade
+        self.mirrored = mirrored
+        self.gated = gated
+
+
+class MultiCascadeDetector(FaceDetector):
+    """
+    Bộ phát hiện kết hợp nhiều Haar Cascade (vd: frontalface_default + alt2 + profileface)
+
+    Các cascade chạy song song trên một pool luồng (OpenCV nhả GIL trong
+    detectMultiScale) và dùng chung một ảnh xám; kết quả được gộp bằng NMS
+    hoặc gộp khung có trọng số. Cascade mặt nghiêng (profileface) chỉ học mặt
+    quay về một phía nên được chạy thêm trên ảnh lật ngang.
+
+    Cascade phụ có thể được chặn bởi một lượt kiểm tra rẻ: chạy trên ảnh thu
+    nhỏ gate_scale lần (khoảng gate_scale² chi phí). Không có ứng viên thì bỏ
+    qua cascade đó, có thì chỉ quét lại ở độ phân giải đầy đủ quanh các ứng
+    viên. Khuôn mặt nhỏ hơn cửa sổ cascade / gate_scale khi đó chỉ được tìm
+    bởi cascade chính.
+
+    Chỉ _detect_gray được thay nên theo dõi, metrics, StreamingFaceDetector...
+    dùng được như với FaceDetector.
+    """
+
+    def __init__(self, cascade_paths, fusion="weighted", iou_threshold=0.3, min_votes=1,
+                 gate=True, gate_scale=0.5, gate_min_neighbors=2, gate_padding=0.5,
+                 workers=None, **detector_options):
+        """
+        Args:
+            cascade_paths: Các file cascade; file đầu tiên là cascade chính (không bị chặn)
+            fusion: "weighted" (trung bình có trọng số theo số lượt phát hiện) hoặc "nms" (giữ khung lớn nhất)
+            iou_threshold: Ngưỡng IoU để coi các khung của nhiều cascade là cùng một khuôn mặt
+            min_votes: Số cascade tối thiểu phải cùng tìm thấy một khuôn mặt (tăng độ chính xác)
+            gate: Chặn các cascade phụ bằng lượt kiểm tra trên ảnh thu nhỏ
+            gate_scale: Tỷ lệ ảnh của lượt kiểm tra so với ảnh phát hiện (0-1.0)
+            gate_min_neighbors: minNeighbors của lượt kiểm tra (thấp để không bỏ sót ứng viên)
+            gate_padding: Độ mở rộng vùng quét lại quanh mỗi ứng viên (% kích thước khung)
+            workers: Số luồng chạy cascade (mặc định: bằng số lượt chạy); 1 để chạy tuần tự
+            detector_options: Tham số chung cho FaceDetector (scale_factor, min_neighbors, min_size,
+                              detection_scale, max_detection_side)
+        """
+        if not cascade_paths:
+            raise ValueError("Cần ít nhất một file cascade")
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Cách gộp không hợp lệ '{fusion}' (có: {', '.join(FUSION_METHODS)})")
+        super().__init__(cascade_paths[0], **detector_options)
+        self.fusion = fusion
+        self.iou_threshold = iou_threshold
+        self.min_votes = min_votes
+        self.gate_scale = gate_scale
+        self.gate_min_neighbors = gate_min_neighbors
+        self.gate_padding = gate_padding
+
+        self.jobs = []
+        for source, path in enumerate(cascade_paths):
+            label = cascade_label(path)
+            cascade = self.face_cascade if source == 0 else self._load_cascade(path)
+            gated = gate and source > 0
+            self.jobs.append(_CascadeJob(label, source, cascade, False, gated))
+            if "profile" in label:
+                # Lượt trên ảnh lật cần bộ phân loại riêng để chạy song song với lượt không lật
+                self.jobs.append(_CascadeJob(label + "_flip", source, self._load_cascade(path, False),
+                                             True, gated))
+
+        # Lượt của cascade chính chạy ngay trên luồng gọi, các lượt còn lại trên pool
+        workers = min(workers or len(self.jobs), len(self.jobs))
+        self._executor = ThreadPoolExecutor(max_workers=workers - 1) if workers > 1 else None
+
+        # Thống kê theo lượt chạy: số lần chạy, số lần bị chặn, số khuôn mặt tìm thấy
+        self.stats = {job.label: {"runs": 0, "gated": 0, "faces": 0} for job in self.jobs}
+
+    @staticmethod
+    def _load_cascade(path, verbose=True):
+        cascade = cv2.CascadeClassifier(path)
+        if cascade.empty():
+            raise ValueError(f"Không thể tải cascade từ {path}")
+        if verbose:
+            print(f"Đã tải thành công bộ phân loại từ {path}")
+        return cascade
+
+    def close(self):
+        """Dừng pool luồng"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _detect_gray(self, gray, min_size, max_size):
+        flipped = cv2.flip(gray, 1) if any(job.mirrored for job in self.jobs) else None
+
+        def run(job):
+            return self._run_job(job, flipped if job.mirrored else gray, min_size, max_size)
+
+        if self._executor is not None:
+            futures = [self._executor.submit(run, job) for job in self.jobs[1:]]
+            results = [run(self.jobs[0])] + [future.result() for future in futures]
+        else:
+            results = [run(job) for job in self.jobs]
+
+        boxes, counts, sources = [], [], []
+        for job, (faces, job_counts, skipped) in zip(self.jobs, results):
+            stats = self.stats[job.label]
+            stats["runs"] += 1
+            stats["gated"] += int(skipped)
+            stats["faces"] += len(faces)
+            boxes.append(faces)
+            counts.append(job_counts)
+            sources += [job.source] * len(faces)
+        return self._fuse(np.concatenate(boxes), np.concatenate(counts), sources)
+
+    def _run_job(self, job, gray, min_size, max_size):
+        """
+        Returns:
+            tuple: (mảng N x 4 các khung theo tọa độ ảnh chưa lật, số lượt phát hiện của từng khung,
+                    True nếu cascade bị lượt kiểm tra chặn)
+        """
+        skipped = False
+        with timed(self.metrics, f"detect_{job.label}"):
+            if job.gated:
+                faces, counts = self._gated_detect(job.cascade, gray, min_size, max_size)
+                skipped = faces is None
+            else:
+                faces, counts = self._run_cascade(job.cascade, gray, min_size, max_size)
+        if skipped:
+            return np.empty((0, 4), dtype=np.int32), np.empty(0, dtype=np.int32), True
+
+        faces = np.array(faces, dtype=np.int32).reshape(-1, 4)
+        counts = np.asarray(counts, dtype=np.int32).reshape(-1)
+        if job.mirrored and len(faces):
+            faces[:, 0] = gray.shape[1] - faces[:, 0] - faces[:, 2]
+        return faces, counts, False
+
+    def _gated_detect(self, cascade, gray, min_size, max_size):
+        """
+        Lượt kiểm tra trên ảnh thu nhỏ, sau đó quét lại quanh các ứng viên
+
+        Returns:
+            tuple: (các khung, số lượt phát hiện), các khung là None nếu không có ứng viên
+        """
+        scale = self.get_detection_scale(gray.shape) * self.gate_scale
+        # Ảnh quá nhỏ để kiểm tra: chạy cascade như bình thường
+        if min(gray.shape[:2]) * scale < 64:
+            return self._run_cascade(cascade, gray, min_size, max_size)
+
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        candidates = cascade.detectMultiScale(
+            small,
+            scaleFactor=self.scale_factor,
+            minNeighbors=self.gate_min_neighbors,
+            minSize=(max(1, int(round(min_size[0] * scale))), max(1, int(round(min_size[1] * scale))))
+        )
+        if len(candidates) == 0:
+            return None, None
+
+        candidates = np.asarray(candidates) / scale
+        regions = merge_regions([expand_box(box, self.gate_padding, gray.shape) for box in candidates])
+        # Chỉ quét lại các kích thước gần kích thước ứng viên
+        lo = int(candidates[:, 2:].min() * 0.6)
+        hi = int(np.ceil(candidates[:, 2:].max() * 1.6))
+        min_size = (max(min_size[0], lo), max(min_size[1], lo))
+        if max_size:
+            max_size = (min(max_size[0], hi), min(max_size[1], hi))
+        else:
+            max_size = (hi, hi)
+        boxes, counts = [], []
+        for x1, y1, x2, y2 in regions:
+            faces, region_counts = self._run_cascade(cascade, gray[y1:y2, x1:x2], min_size, max_size)
+            for (x, y, w, h), count in zip(faces, region_counts):
+                boxes.append((x + x1, y + y1, w, h))
+                counts.append(count)
+        return boxes, counts
+
+    def _fuse(self, boxes, counts, sources):
+        """Gộp các khung của mọi cascade, giữ khuôn mặt được ít nhất min_votes cascade tìm thấy"""
+        if len(boxes) == 0:
+            return boxes
+        if self.fusion == "nms":
+            fused = non_max_suppression(boxes, self.iou_threshold)
+        else:
+            fused, _ = weighted_box_fusion(boxes, counts, self.iou_threshold)
+        if self.min_votes > 1:
+            keep = [len({sources[i] for i in range(len(boxes)) if iou(box, boxes[i]) >= self.iou_threshold})
+                    >= self.min_votes for box in fused]
+            fused = fused[np.asarray(keep, dtype=bool)]
+        return fused
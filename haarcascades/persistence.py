@@ -0,0 +1,158 @@
+import os
+import json
+import atexit
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def atomic_write_bytes(path, data):
+    """
+    Ghi file an toàn: ghi vào file tạm cùng thư mục rồi đổi tên
+
+    Tiến trình khác đọc file luôn thấy bản cũ hoặc bản mới hoàn chỉnh,
+    không bao giờ thấy file ghi dở.
+
+    Args:
+        path: Đường dẫn file đích
+        data: Nội dung (bytes)
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    # Giữ quyền truy cập của file cũ (mkstemp tạo file chỉ chủ sở hữu đọc được)
+    mode = os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Khóa độc quyền giữa các tiến trình qua một file khóa (chờ đến khi lấy được khóa)
+
+    Khóa gắn với file đang mở nên cũng loại trừ các luồng của cùng tiến trình,
+    và được nhả khi tiến trình bị ngắt. Không gọi lồng nhau trên cùng một file.
+
+    Args:
+        path: Đường dẫn file khóa (được tạo nếu chưa có)
+    """
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write_json(path, data):
+    """Ghi dữ liệu JSON (indent=4, giữ ký tự Unicode) theo cách an toàn (xem atomic_write_bytes)"""
+    text = json.dumps(data, ensure_ascii=False, indent=4)
+    atomic_write_bytes(path, text.encode('utf-8'))
+
+
+class WriteBehindFlusher:
+    """
+    Ghi trễ (write-behind): gom các thay đổi trong bộ nhớ và ghi xuống đĩa ở luồng nền
+
+    Luồng gọi mark_dirty() không bao giờ chờ đĩa. Dữ liệu được ghi khi đủ
+    max_pending thay đổi hoặc sau mỗi interval giây, và khi đóng/thoát chương trình.
+    """
+
+    def __init__(self, flush_fn, interval=5.0, max_pending=100):
+        """
+        Args:
+            flush_fn: Hàm ghi dữ liệu, nhận tập các khóa đã thay đổi
+            interval: Thời gian tối đa (giây) một thay đổi chờ trong bộ nhớ
+            max_pending: Số khóa thay đổi tối đa trước khi ghi ngay
+        """
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+        # Thống kê
+        self.write_count = 0
+        self.error_count = 0
+
+    def mark_dirty(self, key):
+        """Đánh dấu một khóa đã thay đổi (không chặn)"""
+        with self._lock:
+            self._dirty.add(key)
+            pending = len(self._dirty)
+            if self._thread is None and not self._closed:
+                self._start()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def pending(self):
+        """Số khóa đang chờ ghi"""
+        with self._lock:
+            return len(self._dirty)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Ghi ngay các thay đổi đang chờ"""
+        with self._flush_lock:
+            with self._lock:
+                keys = self._dirty
+                self._dirty = set()
+            if not keys:
+                return
+            try:
+                self.flush_fn(keys)
+                self.write_count += 1
+            except Exception as e:
+                self.error_count += 1
+                print(f"Lỗi khi ghi dữ liệu xuống đĩa: {str(e)}")
+                # Giữ lại để thử ghi lần sau
+                with self._lock:
+                    self._dirty |= keys
+
+    def close(self):
+        """Dừng luồng nền và ghi nốt các thay đổi còn lại"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+        self.flush()
@@ -0,0 +1,310 @@
+import cv2
+import os
+import json
+import queue
+import argparse
+import threading
+import numpy as np
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from flask import Flask, Response, request, jsonify
+from flask_cors import CORS
+from face_recognizer import FaceRecognizer
+from batch_scheduler import BatchScheduler, SchedulerOverloaded
+from model_watcher import ModelWatcher
+from metrics import Metrics, MetricsExporter, timed
+from detector_profiles import resolve_detector_options
+
+
+class RecognizerPool:
+    """
+    Nhóm các FaceRecognizer đã nạp sẵn cascade và mô hình LBPH
+
+    Mỗi yêu cầu mượn một bộ nhận diện trong suốt thời gian xử lý nên các luồng
+    không dùng chung một đối tượng OpenCV. Sau khi đăng ký người dùng mới,
+    invalidate() tăng thế hệ dữ liệu; mỗi bộ nhận diện tự nạp lại mô hình
+    ở lần được mượn tiếp theo.
+    """
+
+    def __init__(self, cascade_path, size=2, data_dir="user_data", metrics=None, **detector_options):
+        """
+        Args:
+            cascade_path: Đường dẫn file Haar Cascade
+            size: Số bộ nhận diện (số yêu cầu được xử lý đồng thời)
+            data_dir: Thư mục dữ liệu người dùng
+            metrics: Metrics gắn cho mọi bộ nhận diện trong pool (tùy chọn)
+            detector_options: Tham số cho FaceDetector
+        """
+        self.size = max(1, size)
+        self.generation = 0
+        self._generation_lock = threading.Lock()
+        self._available = queue.Queue()
+        for _ in range(self.size):
+            recognizer = FaceRecognizer(cascade_path, data_dir=data_dir, read_only=True, **detector_options)
+            recognizer.attach_metrics(metrics)
+            self._available.put((recognizer, self.generation))
+
+    def invalidate(self):
+        """Đánh dấu dữ liệu trên đĩa đã thay đổi"""
+        with self._generation_lock:
+            self.generation += 1
+
+    @contextmanager
+    def acquire(self):
+        """Mượn một bộ nhận diện, chờ nếu tất cả đang bận"""
+        recognizer, generation = self._available.get()
+        try:
+            if generation != self.generation:
+                generation = self.generation
+                recognizer.reload()
+            yield recognizer
+        finally:
+            self._available.put((recognizer, generation))
+
+
+def decode_image(req, metrics=None):
+    """
+    Giải mã ảnh JPEG/PNG trực tiếp từ bộ đệm của yêu cầu (không ghi file tạm)
+
+    Nhận ảnh từ trường 'image' của form multipart hoặc từ thân yêu cầu.
+    Thời gian giải mã được ghi vào giai đoạn decode của metrics (nếu có).
+
+    Returns:
+        numpy.ndarray: Ảnh BGR hoặc None nếu không giải mã được
+    """
+    if 'image' in req.files:
+        data = req.files['image'].read()
+    else:
+        data = req.get_data(cache=False)
+    if not data:
+        return None
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    with timed(metrics, "decode"):
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def _error(message, status=400):
+    return jsonify({"error": message}), status
+
+
+def create_app(cascade_path, workers=2, data_dir="user_data", confidence=30.0, detector_options=None,
+               batch_size=8, batch_wait=0.005, queue_size=64, request_timeout=30.0, reload_interval=2.0,
+               max_samples_per_user=None, metrics=None):
+    """
+    Tạo ứng dụng Flask phục vụ phát hiện, nhận diện và đăng ký khuôn mặt
+
+    Args:
+        cascade_path: Đường dẫn file Haar Cascade
+        workers: Số bộ nhận diện nạp sẵn trong pool
+        data_dir: Thư mục dữ liệu người dùng
+        confidence: Ngưỡng độ tin cậy mặc định cho /recognize
+        detector_options: Tham số cho FaceDetector (vd: max_detection_side)
+        batch_size: Số yêu cầu /recognize tối đa gom vào một lô
+        batch_wait: Thời gian tối đa (giây) chờ đóng lô
+        queue_size: Số yêu cầu /recognize tối đa đang chờ, vượt quá sẽ trả về 503
+        request_timeout: Thời gian tối đa (giây) chờ kết quả của một yêu cầu
+        reload_interval: Chu kỳ (giây) kiểm tra thay đổi từ tiến trình khác (0: tắt)
+        max_samples_per_user: Số mẫu tối đa mỗi người dùng khi đăng ký qua /enroll (None: không giới hạn)
+        metrics: Metrics ghi thời gian theo giai đoạn, phục vụ tại /metrics (None: tắt đo đạc)
+
+    Returns:
+        Flask: Ứng dụng đã cấu hình
+    """
+    detector_options = detector_options or {}
+    app = Flask(__name__)
+    CORS(app)
+
+    pool = RecognizerPool(cascade_path, workers, data_dir, metrics, **detector_options)
+    # Bộ nhận diện duy nhất được phép ghi dữ liệu (đăng ký, last_recognized)
+    admin = FaceRecognizer(cascade_path, data_dir=data_dir, max_samples_per_user=max_samples_per_user,
+                           **detector_options)
+    admin.attach_metrics(metrics)
+    admin_lock = threading.Lock()
+
+    def recognize_batch(items):
+        # Cả lô dùng chung một bộ nhận diện đã mượn; khuôn mặt của mọi ảnh được so khớp trong một lần
+        images, thresholds = zip(*items)
+        with pool.acquire() as recognizer:
+            return recognizer.recognize_images(list(images), list(thresholds))
+
+    scheduler = BatchScheduler(recognize_batch, max_batch_size=batch_size, max_wait=batch_wait,
+                               max_queue=queue_size, workers=pool.size)
+
+    # Người dùng thêm/xóa bằng manage_users.py: nạp lại bộ ghi, các worker nạp lại ở lần mượn sau
+    watcher = None
+    if reload_interval > 0:
+        watcher = ModelWatcher(admin, interval=reload_interval, lock=admin_lock,
+                               on_reload=lambda changed: pool.invalidate()).start()
+
+    app.config["RECOGNIZER_POOL"] = pool
+    app.config["MODEL_WATCHER"] = watcher
+    app.config["BATCH_SCHEDULER"] = scheduler
+    app.config["ADMIN_RECOGNIZER"] = admin
+    app.config["METRICS"] = metrics
+
+    if metrics is not None:
+        metrics.register_counter("requests_rejected", lambda: scheduler.rejected_count)
+        metrics.register_gauge("queue_depth", scheduler.depth)
+
+        @app.route('/metrics', methods=['GET'])
+        def metrics_endpoint():
+            return Response(metrics.to_prometheus(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({"status": "ok", "workers": pool.size, "users": len(admin.users_data),
+                        "model_version": admin.model_version, "generation": pool.generation,
+                        "scheduler": scheduler.stats()})
+
+    @app.route('/detect', methods=['POST'])
+    def detect():
+        image = decode_image(request, metrics)
+        if image is None:
+            return _error("Không thể giải mã ảnh (cần JPEG/PNG)")
+        with pool.acquire() as recognizer:
+            detection = recognizer.analyze(image)
+        faces = [[int(v) for v in bbox] for bbox in detection.faces]
+        return jsonify({"faces": faces, "num_faces": len(faces)})
+
+    @app.route('/recognize', methods=['POST'])
+    def recognize():
+        image = decode_image(request, metrics)
+        if image is None:
+            return _error("Không thể giải mã ảnh (cần JPEG/PNG)")
+        try:
+            threshold = float(request.args.get('confidence', confidence))
+        except ValueError:
+            return _error("Tham số confidence không hợp lệ")
+
+        try:
+            future = scheduler.submit((image, threshold))
+        except SchedulerOverloaded as e:
+            response = jsonify({"error": str(e)})
+            response.headers["Retry-After"] = "1"
+            return response, 503
+        try:
+            recognized_faces = future.result(timeout=request_timeout)
+        except FutureTimeoutError:
+            # Lô vẫn được xử lý xong ở nền, kết quả muộn bị bỏ qua
+            return _error(f"Quá thời gian chờ nhận diện ({request_timeout:g} giây)", 504)
+
+        results = []
+        for face_info in recognized_faces:
+            if face_info["user_id"] is not None:
+                admin.mark_recognized(face_info["user_id"])
+            results.append({
+                "user_id": face_info["user_id"],
+                "name": face_info["name"],
+                "confidence": round(float(face_info["confidence"]), 2),
+                "bbox": [int(v) for v in face_info["bbox"]]
+            })
+        return jsonify({"recognized": results, "num_faces": len(results)})
+
+    @app.route('/enroll', methods=['POST'])
+    def enroll():
+        image = decode_image(request, metrics)
+        if image is None:
+            return _error("Không thể giải mã ảnh (cần JPEG/PNG)")
+        user_id = request.values.get('user_id')
+        if not user_id:
+            return _error("Thiếu user_id")
+
+        info = request.values.get('info')
+        try:
+            additional_info = json.loads(info) if info else None
+        except ValueError:
+            return _error("Trường info phải là JSON")
+
+        with admin_lock:
+            if user_id in admin.users_data:
+                created = False
+                success = admin.add_face(user_id, image)
+            else:
+                name = request.values.get('name')
+                if not name:
+                    return _error("Thiếu name cho người dùng mới")
+                created = True
+                success = admin.add_user(user_id, name, image, additional_info)
+            if success:
+                pool.invalidate()
+
+        if not success:
+            return _error("Không phát hiện khuôn mặt trong ảnh", 422)
+        return jsonify({"user_id": user_id, "created": created,
+                        "name": admin.users_data[user_id]["name"]}), 201 if created else 200
+
+    return app
+
+
+def main():
+    # Đường dẫn thư mục chứa file này
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description='Máy chủ REST phát hiện và nhận diện khuôn mặt')
+    parser.add_argument('--host', default='127.0.0.1', help='Địa chỉ lắng nghe')
+    parser.add_argument('--port', type=int, default=5000, help='Cổng lắng nghe')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Số bộ nhận diện nạp sẵn (số yêu cầu xử lý đồng thời)')
+    parser.add_argument('--cascade', default='haarcascade_frontalface_default.xml',
+                        help='Tên file cascade trong thư mục haarcascades')
+    parser.add_argument('--data-dir', default='user_data', help='Thư mục dữ liệu người dùng')
+    parser.add_argument('--confidence', type=float, default=30.0,
+                        help='Ngưỡng độ tin cậy mặc định cho /recognize')
+    parser.add_argument('--batch-size', type=int, default=8,
+                        help='Số yêu cầu /recognize tối đa gom vào một lô')
+    parser.add_argument('--batch-wait-ms', type=float, default=5.0,
+                        help='Thời gian tối đa (ms) chờ đóng một lô')
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help='Số yêu cầu chờ tối đa, vượt quá sẽ trả về 503')
+    parser.add_argument('--reload-interval', type=float, default=2.0,
+                        help='Chu kỳ (giây) kiểm tra mô hình/người dùng thay đổi từ tiến trình khác (0: tắt)')
+    parser.add_argument('--max-samples-per-user', type=int,
+                        help='Số mẫu tối đa mỗi người dùng khi đăng ký, chỉ giữ tập con đại diện')
+    parser.add_argument('--detect-max-side', type=int,
+                        help='Thu nhỏ ảnh để cạnh dài nhất không vượt quá giá trị này trước khi phát hiện')
+    parser.add_argument('--profile',
+                        help='Profile tham số phát hiện đã lưu bằng autotune.py (vd: kiosk-fast); '
+                             '--detect-max-side ghi đè profile')
+    parser.add_argument('--metrics', action='store_true',
+                        help='Đo thời gian từng giai đoạn và phục vụ số liệu Prometheus tại /metrics')
+    parser.add_argument('--metrics-file',
+                        help='Ghi số liệu Prometheus ra file này định kỳ (bật --metrics)')
+    parser.add_argument('--metrics-interval', type=float, default=10.0,
+                        help='Chu kỳ (giây) ghi file số liệu (mặc định: 10)')
+
+    args = parser.parse_args()
+
+    cascade_path = os.path.join(current_dir, args.cascade)
+    if not os.path.isfile(cascade_path):
+        print(f"Lỗi: Không tìm thấy file cascade '{cascade_path}'")
+        return
+
+    try:
+        detector_options = resolve_detector_options(args.profile, max_detection_side=args.detect_max_side)
+    except ValueError as e:
+        print(f"Lỗi: {str(e)}")
+        return
+
+    metrics = Metrics() if args.metrics or args.metrics_file else None
+
+    print(f"Đang nạp {args.workers} bộ nhận diện...")
+    app = create_app(cascade_path, args.workers, args.data_dir, args.confidence, detector_options,
+                     batch_size=args.batch_size, batch_wait=args.batch_wait_ms / 1000.0,
+                     queue_size=args.queue_size, reload_interval=args.reload_interval,
+                     max_samples_per_user=args.max_samples_per_user, metrics=metrics)
+    metrics_exporter = None
+    if args.metrics_file:
+        metrics_exporter = MetricsExporter(metrics, args.metrics_file, args.metrics_interval).start()
+    try:
+        app.run(host=args.host, port=args.port, threaded=True)
+    finally:
+        if metrics_exporter is not None:
+            metrics_exporter.stop()
+        if app.config["MODEL_WATCHER"] is not None:
+            app.config["MODEL_WATCHER"].stop()
+        app.config["BATCH_SCHEDULER"].close()
+        app.config["ADMIN_RECOGNIZER"].close()
+
+
+if __name__ == '__main__':
+    main()
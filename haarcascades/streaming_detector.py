@@ -0,0 +1,126 @@
+import cv2
+import numpy as np
+from box_utils import expand_box, merge_regions, non_max_suppression
+
+
+class StreamingFaceDetector:
+    """
+    Bộ phát hiện cho luồng video: chỉ quét lại vùng quanh khuôn mặt ở khung trước
+
+    Giữa hai khung hình liên tiếp khuôn mặt chỉ dịch chuyển một chút, nên cascade
+    chỉ chạy trên các vùng mở rộng quanh khung cũ, với kích thước khuôn mặt giới
+    hạn quanh kích thước cũ. Quét toàn khung được thực hiện định kỳ hoặc khi có
+    chuyển động ngoài các vùng đang theo dõi, để phát hiện người mới xuất hiện.
+
+    Dùng trực tiếp qua update(gray) hoặc gắn vào FaceDetector/FaceRecognizer bằng
+    attach_tracker() để detect_faces và recognize_face tự động sử dụng.
+    """
+
+    def __init__(self, detector, full_scan_interval=30, roi_padding=0.5,
+                 size_tolerance=0.4, motion_threshold=0.01, motion_delta=25,
+                 iou_threshold=0.3, motion_width=160):
+        """
+        Args:
+            detector: FaceDetector dùng để chạy cascade
+            full_scan_interval: Quét toàn khung ít nhất mỗi bao nhiêu khung hình
+            roi_padding: Độ mở rộng vùng tìm kiếm quanh khung cũ (% kích thước khuôn mặt)
+            size_tolerance: Kích thước khuôn mặt mới được phép lệch bao nhiêu so với khung cũ
+            motion_threshold: Tỷ lệ điểm ảnh thay đổi ngoài các vùng để kích hoạt quét toàn khung
+                              (None để tắt phát hiện chuyển động)
+            motion_delta: Độ chênh lệch mức xám để coi là điểm ảnh thay đổi
+            iou_threshold: Ngưỡng IoU khi gộp khung trùng lặp giữa các vùng
+            motion_width: Chiều rộng ảnh thu nhỏ dùng để phát hiện chuyển động
+        """
+        self.detector = detector
+        self.full_scan_interval = max(1, full_scan_interval)
+        self.roi_padding = roi_padding
+        self.size_tolerance = size_tolerance
+        self.motion_threshold = motion_threshold
+        self.motion_delta = motion_delta
+        self.iou_threshold = iou_threshold
+        self.motion_width = motion_width
+
+        self.prev_faces = np.empty((0, 4), dtype=np.int32)
+        self.prev_motion_frame = None
+        self.frames_since_full_scan = 0
+
+        # Thống kê
+        self.full_scans = 0
+        self.roi_scans = 0
+        self.motion_triggers = 0
+
+    def reset(self):
+        """Quên các khuôn mặt trước đó, lần cập nhật tiếp theo sẽ quét toàn khung"""
+        self.prev_faces = np.empty((0, 4), dtype=np.int32)
+        self.prev_motion_frame = None
+        self.frames_since_full_scan = 0
+
+    def update(self, gray):
+        """
+        Phát hiện khuôn mặt trên khung hình mới
+
+        Args:
+            gray: Ảnh xám của khung hình
+
+        Returns:
+            faces: Các khung (x, y, w, h) theo tọa độ ảnh gốc
+        """
+        regions = [expand_box(box, self.roi_padding, gray.shape) for box in self.prev_faces]
+        motion_frame = self._motion_frame(gray)
+
+        full_scan = (len(regions) == 0 or
+                     self.frames_since_full_scan >= self.full_scan_interval - 1)
+        if not full_scan and self._motion_outside(motion_frame, regions, gray.shape):
+            self.motion_triggers += 1
+            full_scan = True
+
+        if full_scan:
+            faces = self.detector.detect_gray(gray)
+            self.frames_since_full_scan = 0
+            self.full_scans += 1
+        else:
+            faces = self._scan_regions(gray, regions)
+            self.frames_since_full_scan += 1
+            self.roi_scans += 1
+
+        self.prev_faces = np.asarray(faces, dtype=np.int32).reshape(-1, 4)
+        self.prev_motion_frame = motion_frame
+        return faces
+
+    def _scan_regions(self, gray, regions):
+        """Chạy cascade trên từng vùng đã gộp và gộp kết quả về tọa độ ảnh gốc"""
+        sizes = self.prev_faces[:, 2:4]
+        min_side = int(sizes.min() * (1 - self.size_tolerance))
+        max_side = int(np.ceil(sizes.max() * (1 + self.size_tolerance)))
+        min_size = (max(min_side, self.detector.min_size[0]), max(min_side, self.detector.min_size[1]))
+        max_size = (max_side, max_side)
+
+        boxes = []
+        for (x1, y1, x2, y2) in merge_regions(regions):
+            roi = gray[y1:y2, x1:x2]
+            if roi.shape[0] < min_size[1] or roi.shape[1] < min_size[0]:
+                continue
+            for (x, y, w, h) in self.detector.detect_gray(roi, min_size=min_size, max_size=max_size):
+                boxes.append((x + x1, y + y1, w, h))
+        return non_max_suppression(boxes, self.iou_threshold)
+
+    def _motion_frame(self, gray):
+        if self.motion_threshold is None:
+            return None
+        h, w = gray.shape[:2]
+        scale = min(1.0, self.motion_width / float(w))
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def _motion_outside(self, motion_frame, regions, image_shape):
+        """Kiểm tra có chuyển động đáng kể ngoài các vùng đang theo dõi hay không"""
+        if motion_frame is None or self.prev_motion_frame is None:
+            return False
+        if motion_frame.shape != self.prev_motion_frame.shape:
+            return True
+
+        changed = cv2.absdiff(motion_frame, self.prev_motion_frame) > self.motion_delta
+        scale = motion_frame.shape[1] / float(image_shape[1])
+        for (x1, y1, x2, y2) in regions:
+            changed[int(y1 * scale):int(np.ceil(y2 * scale)), int(x1 * scale):int(np.ceil(x2 * scale))] = False
+        return changed.mean() > self.motion_threshold
@@ -0,0 +1,323 @@
+import os
+import json
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class UserStore:
+    """
+    Cơ sở dữ liệu người dùng và ánh xạ nhãn của mô hình trên SQLite
+
+    Mỗi người dùng là một dòng (tra cứu theo user_id qua khóa chính), ánh xạ
+    nhãn LBPH -> người dùng có chỉ mục theo cả hai chiều. Cập nhật
+    last_recognized chỉ ghi đúng các dòng thay đổi thay vì ghi lại toàn bộ file.
+
+    Chế độ WAL cho phép nhiều tiến trình đọc trong khi một tiến trình ghi
+    (manage_users.py chạy song song với webcam/máy chủ), và mỗi thay đổi
+    là một giao dịch nên các tiến trình không ghi đè dữ liệu của nhau.
+
+    Mỗi kết nối nhớ bản dữ liệu đọc/ghi gần nhất; replace_users và
+    save_model_state chỉ ghi các dòng khác với bản đó, nên dòng do tiến trình
+    khác thêm vào trong lúc này được giữ nguyên. Nhãn mới được cấp và
+    model_version được tăng ngay trong cơ sở dữ liệu.
+    """
+
+    DB_FILE = "users.db"
+    SCHEMA_VERSION = 1
+
+    # Các trường có cột riêng; các trường khác của người dùng lưu dạng JSON
+    USER_COLUMNS = ("name", "created_at", "last_recognized")
+
+    def __init__(self, data_dir, timeout=10.0):
+        """
+        Args:
+            data_dir: Thư mục dữ liệu người dùng
+            timeout: Thời gian tối đa (giây) chờ khi cơ sở dữ liệu đang bị khóa ghi
+        """
+        self.db_file = os.path.join(data_dir, self.DB_FILE)
+        self.created = not os.path.exists(self.db_file)
+        self._lock = threading.RLock()
+        # Bản dữ liệu đọc/ghi gần nhất của kết nối này: {user_id: dòng} và trạng thái mô hình
+        self._seen_users = {}
+        self._seen_model = {}
+        # Dùng chung một kết nối giữa các luồng (luồng ghi nền, luồng nạp lại), bảo vệ bằng khóa
+        self._conn = sqlite3.connect(self.db_file, timeout=timeout, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        with self._transaction() as cur:
+            cur.execute("""CREATE TABLE IF NOT EXISTS users (
+                               user_id TEXT PRIMARY KEY,
+                               name TEXT NOT NULL,
+                               created_at TEXT,
+                               last_recognized TEXT,
+                               info TEXT NOT NULL DEFAULT '{}')""")
+            cur.execute("""CREATE TABLE IF NOT EXISTS labels (
+                               label INTEGER PRIMARY KEY,
+                               user_id TEXT NOT NULL)""")
+            cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_labels_user ON labels(user_id)")
+            cur.execute("""CREATE TABLE IF NOT EXISTS tombstones (
+                               label INTEGER PRIMARY KEY,
+                               samples INTEGER NOT NULL)""")
+            cur.execute("""CREATE TABLE IF NOT EXISTS meta (
+                               key TEXT PRIMARY KEY,
+                               value TEXT)""")
+            cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('schema_version', ?)",
+                        (str(self.SCHEMA_VERSION),))
+
+    @contextmanager
+    def _transaction(self):
+        """Giao dịch ghi: BEGIN IMMEDIATE giữ khóa ghi ngay từ đầu, tránh lỗi nâng cấp khóa giữa chừng"""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            finally:
+                cur.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def data_version(self):
+        """
+        Số phiên bản dữ liệu của SQLite: thay đổi khi tiến trình/kết nối khác ghi,
+        không thay đổi với các ghi của chính kết nối này
+        """
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    # ---- Người dùng ----
+
+    @classmethod
+    def _row_to_user(cls, row):
+        _, name, created_at, last_recognized, info = row
+        user_info = {"name": name, "created_at": created_at, "last_recognized": last_recognized}
+        user_info.update(json.loads(info))
+        return user_info
+
+    @classmethod
+    def _user_to_row(cls, user_id, user_info):
+        info = {k: v for k, v in user_info.items() if k not in cls.USER_COLUMNS}
+        return (user_id, user_info.get("name", user_id), user_info.get("created_at"),
+                user_info.get("last_recognized"), json.dumps(info, ensure_ascii=False))
+
+    def get_user(self, user_id):
+        """Thông tin một người dùng hoặc None"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return self._row_to_user(row) if row else None
+
+    def all_users(self):
+        """Toàn bộ người dùng dạng {user_id: user_info}"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM users ORDER BY rowid").fetchall()
+            self._seen_users = {row[0]: tuple(row) for row in rows}
+        return {row[0]: self._row_to_user(row) for row in rows}
+
+    def count_users(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def save_users(self, users):
+        """
+        Thêm hoặc cập nhật người dùng
+
+        Args:
+            users: Dict {user_id: user_info} các người dùng cần ghi
+        """
+        rows = [self._user_to_row(user_id, info) for user_id, info in users.items()]
+        with self._transaction() as cur:
+            self._upsert_users(cur, rows)
+
+    def _upsert_users(self, cur, rows):
+        cur.executemany("""INSERT INTO users (user_id, name, created_at, last_recognized, info)
+                           VALUES (?, ?, ?, ?, ?)
+                           ON CONFLICT(user_id) DO UPDATE SET
+                               name = excluded.name, created_at = excluded.created_at,
+                               last_recognized = excluded.last_recognized, info = excluded.info""",
+                        rows)
+        self._seen_users.update((row[0], row) for row in rows)
+
+    def delete_users(self, user_ids):
+        """Xóa người dùng"""
+        with self._transaction() as cur:
+            self._delete_users(cur, user_ids)
+
+    def _delete_users(self, cur, user_ids):
+        cur.executemany("DELETE FROM users WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+        for user_id in user_ids:
+            self._seen_users.pop(user_id, None)
+
+    def replace_users(self, users):
+        """
+        Ghi danh sách người dùng, chỉ các dòng thay đổi so với lần đọc/ghi gần nhất
+
+        Người dùng đã đọc trước đó nhưng không còn trong users bị xóa; người dùng
+        do tiến trình khác thêm vào (chưa từng đọc) được giữ nguyên.
+        """
+        rows = {user_id: self._user_to_row(user_id, info) for user_id, info in users.items()}
+        with self._transaction() as cur:
+            self._delete_users(cur, [user_id for user_id in self._seen_users if user_id not in rows])
+            self._upsert_users(cur, [row for user_id, row in rows.items() if self._seen_users.get(user_id) != row])
+
+    def update_last_recognized(self, timestamps):
+        """
+        Cập nhật thời gian nhận diện gần nhất, chỉ ghi các dòng thay đổi
+
+        Args:
+            timestamps: Dict {user_id: thời gian}
+        """
+        with self._transaction() as cur:
+            cur.executemany("UPDATE users SET last_recognized = ? WHERE user_id = ?",
+                            [(ts, user_id) for user_id, ts in timestamps.items()])
+            for user_id, ts in timestamps.items():
+                row = self._seen_users.get(user_id)
+                if row is not None:
+                    self._seen_users[user_id] = row[:3] + (ts,) + row[4:]
+
+    # ---- Ánh xạ nhãn của mô hình ----
+
+    def user_for_label(self, label):
+        """ID người dùng của một nhãn (None nếu nhãn không tồn tại hoặc đã xóa)"""
+        with self._lock:
+            row = self._conn.execute("SELECT user_id FROM labels WHERE label = ?", (int(label),)).fetchone()
+        return row[0] if row else None
+
+    def label_for_user(self, user_id):
+        """Nhãn của một người dùng hoặc None"""
+        with self._lock:
+            row = self._conn.execute("SELECT label FROM labels WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def load_model_state(self):
+        """
+        Trạng thái mô hình theo định dạng của face_encodings
+
+        Returns:
+            dict: label_to_user, user_to_label, next_label, tombstones, sample_count,
+                  model_version ({} nếu chưa có mô hình)
+        """
+        with self._lock:
+            meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+            if "next_label" not in meta:
+                return {}
+            labels = self._conn.execute("SELECT label, user_id FROM labels").fetchall()
+            tombstones = self._conn.execute("SELECT label, samples FROM tombstones").fetchall()
+            self._seen_model = {
+                "labels": dict(labels),
+                "tombstones": dict(tombstones),
+                "sample_count": int(meta["sample_count"]) if "sample_count" in meta else None,
+            }
+        state = {
+            "label_to_user": {str(label): user_id for label, user_id in labels},
+            "user_to_label": {user_id: str(label) for label, user_id in labels},
+            "next_label": int(meta["next_label"]),
+            "tombstones": {str(label): samples for label, samples in tombstones},
+        }
+        # Dữ liệu chuyển từ phiên bản cũ có thể chưa có số mẫu (được tính lại từ mô hình)
+        for key in ("sample_count", "model_version"):
+            if key in meta:
+                state[key] = int(meta[key])
+        return state
+
+    def allocate_label(self, minimum=0):
+        """
+        Cấp một nhãn mới (không trùng với nhãn do tiến trình khác cấp)
+
+        Args:
+            minimum: Nhãn nhỏ nhất được cấp (next_label của trạng thái trong bộ nhớ)
+
+        Returns:
+            int: Nhãn mới
+        """
+        with self._transaction() as cur:
+            row = cur.execute("SELECT value FROM meta WHERE key = 'next_label'").fetchone()
+            max_label = cur.execute("SELECT MAX(label) FROM labels").fetchone()[0]
+            label = max(int(row[0]) if row else 0, -1 if max_label is None else max_label + 1, minimum)
+            cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_label', ?)", (str(label + 1),))
+        return label
+
+    def save_model_state(self, state):
+        """
+        Ghi trạng thái mô hình (định dạng face_encodings) trong một giao dịch
+
+        Chỉ ghi các nhãn/tombstone thay đổi so với lần đọc/ghi gần nhất; số mẫu
+        được cộng thêm phần chênh lệch và model_version được tăng trong cơ sở dữ
+        liệu nên hai tiến trình ghi cùng lúc không ghi đè thay đổi của nhau.
+
+        Returns:
+            int: Phiên bản mô hình mới
+        """
+        labels = {int(label): user_id for label, user_id in state.get("label_to_user", {}).items()}
+        tombstones = {int(label): int(samples) for label, samples in state.get("tombstones", {}).items()}
+        next_label = state.get("next_label", max(labels, default=-1) + 1)
+        with self._transaction() as cur:
+            seen = self._seen_model
+            seen_labels = seen.get("labels", {})
+            seen_tombstones = seen.get("tombstones", {})
+            # Chỉ xóa nhãn vẫn trỏ tới người dùng đã đọc, không xóa nhãn tiến trình khác gán lại
+            cur.executemany("DELETE FROM labels WHERE label = ? AND user_id = ?",
+                            [(label, user_id) for label, user_id in seen_labels.items() if label not in labels])
+            cur.executemany("INSERT OR REPLACE INTO labels (label, user_id) VALUES (?, ?)",
+                            [(label, user_id) for label, user_id in labels.items()
+                             if seen_labels.get(label) != user_id])
+            cur.executemany("DELETE FROM tombstones WHERE label = ?",
+                            [(label,) for label in seen_tombstones if label not in tombstones])
+            cur.executemany("INSERT OR REPLACE INTO tombstones (label, samples) VALUES (?, ?)",
+                            [(label, samples) for label, samples in tombstones.items()
+                             if seen_tombstones.get(label) != samples])
+
+            cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('next_label', ?)", (str(next_label),))
+            cur.execute("UPDATE meta SET value = MAX(CAST(value AS INTEGER), ?) WHERE key = 'next_label'",
+                        (next_label,))
+            if "sample_count" in state:
+                if seen.get("sample_count") is None:
+                    cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sample_count', ?)",
+                                (str(state["sample_count"]),))
+                else:
+                    cur.execute("UPDATE meta SET value = CAST(value AS INTEGER) + ? WHERE key = 'sample_count'",
+                                (state["sample_count"] - seen["sample_count"],))
+            cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('model_version', '0')")
+            cur.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'model_version'")
+            model_version = int(cur.execute("SELECT value FROM meta WHERE key = 'model_version'").fetchone()[0])
+
+            self._seen_model = {"labels": labels, "tombstones": tombstones,
+                                "sample_count": state.get("sample_count", seen.get("sample_count"))}
+        return model_version
+
+    # ---- Chuyển đổi từ định dạng cũ ----
+
+    def migrate_from_files(self, users_json, encodings_pkl):
+        """
+        Nhập dữ liệu từ users_database.json và face_encodings.pkl (định dạng cũ)
+
+        File cũ được giữ nguyên để có thể quay lại phiên bản trước.
+
+        Returns:
+            tuple: (số người dùng, số nhãn) đã nhập
+        """
+        users = {}
+        if os.path.exists(users_json):
+            with open(users_json, 'r', encoding='utf-8') as f:
+                users = json.load(f)
+        state = {}
+        if os.path.exists(encodings_pkl):
+            with open(encodings_pkl, 'rb') as f:
+                state = pickle.load(f)
+
+        self.replace_users(users)
+        if state:
+            self.save_model_state(state)
+        return len(users), len(state.get("label_to_user", {}))
+
@@ -0,0 +1,381 @@
+import cv2
+import os
+import csv
+import json
+import math
+import time
+import queue
+import threading
+from multiprocessing import Pool
+from persistence import atomic_write_bytes
+
+# Bộ xử lý của từng tiến trình con (mỗi worker chỉ nạp cascade/mô hình một lần)
+_worker_processor = None
+_worker_options = None
+
+# Đánh dấu hết khung hình trong hàng đợi đọc trước
+_END = object()
+
+# Các cột của file CSV: mỗi dòng là một khuôn mặt tại một thời điểm
+CSV_FIELDS = ("time", "frame", "user_id", "name", "confidence", "track_id", "x", "y", "w", "h")
+
+
+def probe_video(video_path):
+    """
+    Đọc thông tin của file video
+
+    Returns:
+        dict: fps, frame_count (0 nếu container không cho biết), width, height, duration (giây)
+
+    Raises:
+        ValueError: Không mở được video
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Không thể mở video '{video_path}'")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    if not fps or fps <= 0 or math.isnan(fps):
+        print("Cảnh báo: video không có thông tin FPS, dùng 25")
+        fps = 25.0
+    return {"fps": fps, "frame_count": frame_count, "width": width, "height": height,
+            "duration": frame_count / fps}
+
+
+def plan_segments(frame_count, fps, stride=1, segment_seconds=60.0, workers=1):
+    """
+    Chia video thành các đoạn thời gian để xử lý song song
+
+    Biên của các đoạn là bội số của stride nên các khung được lấy mẫu giống
+    hệt khi xử lý cả video trong một lượt.
+
+    Args:
+        frame_count: Số khung của video (0: không biết, xử lý một đoạn tới hết video)
+        fps: Số khung mỗi giây
+        stride: Xử lý một khung trong mỗi stride khung
+        segment_seconds: Độ dài tối đa của một đoạn (giây)
+        workers: Số tiến trình; video ngắn vẫn được chia đủ cho các tiến trình
+
+    Returns:
+        list: Các đoạn (chỉ số, khung đầu, khung cuối - không gồm; None nghĩa là tới hết video)
+    """
+    if frame_count <= 0:
+        return [(0, 0, None)]
+    count = max(math.ceil(frame_count / max(1.0, segment_seconds * fps)), workers)
+    step = max(1, math.ceil(frame_count / count / stride)) * stride
+    return [(i, start, min(start + step, frame_count))
+            for i, start in enumerate(range(0, frame_count, step))]
+
+
+def iter_frames(cap, start, end, stride=1):
+    """
+    Đọc tuần tự các khung start, start + stride, ... (trước end) của video
+
+    Các khung bị bỏ qua chỉ được grab() (không chuyển sang ảnh BGR), rẻ hơn nhiều so với read().
+
+    Yields:
+        tuple: (chỉ số khung, ảnh BGR)
+    """
+    if start > 0 and not cap.set(cv2.CAP_PROP_POS_FRAMES, start):
+        # Không tua được: đọc bỏ tới khung đầu của đoạn
+        for _ in range(start):
+            if not cap.grab():
+                return
+    index = start
+    while end is None or index < end:
+        if (index - start) % stride == 0:
+            ok, frame = cap.read()
+            if not ok:
+                return
+            yield index, frame
+        elif not cap.grab():
+            return
+        index += 1
+
+
+def prefetch(items, size=8):
+    """
+    Lấy các phần tử của items trên một luồng nền, giữ sẵn tối đa size phần tử
+
+    Dùng để giải mã khung hình (OpenCV nhả GIL) song song với việc phát hiện.
+    """
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def run():
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                buffer.put(item)
+        except Exception as e:
+            buffer.put(e)
+        finally:
+            buffer.put(_END)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Lấy bớt phần tử để luồng đọc không bị kẹt ở put() và kết thúc trước khi video được đóng
+        while thread.is_alive():
+            try:
+                buffer.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def _init_worker(cascade_path, options, detector_options, single_thread=True):
+    """Khởi tạo tiến trình con: nạp cascade, mô hình LBPH và bộ theo dõi đúng một lần"""
+    global _worker_processor, _worker_options
+    if single_thread:
+        # Mỗi tiến trình chạy một luồng OpenCV để tránh tranh chấp CPU giữa các worker
+        cv2.setNumThreads(1)
+    if options["recognition_mode"]:
+        from face_recognizer import FaceRecognizer
+        processor = FaceRecognizer(cascade_path, read_only=True, **detector_options)
+        detector = processor.detector
+    else:
+        from face_detector import FaceDetector
+        processor = detector = FaceDetector(cascade_path, **detector_options)
+
+    # Các khung lấy mẫu trong một đoạn là khung liên tiếp của cùng một video nên dùng được theo dõi
+    if options["track_interval"] > 1:
+        from face_tracker import FaceTracker
+        processor.attach_tracker(FaceTracker(detector.detect_gray, detect_interval=options["track_interval"]))
+    if options["recognition_mode"] and options["identity_cache"]:
+        from identity_cache import IdentityCache
+        processor.attach_identity_cache(IdentityCache(reverify_interval=options["reverify_interval"]))
+
+    _worker_processor = processor
+    _worker_options = options
+
+
+def _face_record(face_info, segment_index):
+    """Bản ghi gọn của một khuôn mặt đã nhận diện"""
+    face = {
+        "bbox": [int(v) for v in face_info["bbox"]],
+        "user_id": face_info["user_id"],
+        "name": face_info["name"],
+        "confidence": round(float(face_info["confidence"]), 1),
+    }
+    if "track_id" in face_info:
+        # Track chỉ có nghĩa trong một đoạn: thêm chỉ số đoạn để không trùng giữa các worker
+        face["track_id"] = f"{segment_index}-{face_info['track_id']}"
+    return face
+
+
+def _process_segment(segment):
+    """Xử lý một đoạn video trong tiến trình con và trả về các khung có khuôn mặt"""
+    index, start, end = segment
+    options = _worker_options
+    processor = _worker_processor
+    detector = processor.detector if options["recognition_mode"] else processor
+    started = time.time()
+    record = {"segment": index, "start": start, "end": end, "frames": 0, "entries": []}
+
+    # Mỗi đoạn là một khoảng thời gian khác: bắt đầu lại việc theo dõi
+    if detector.tracker is not None:
+        detector.tracker.reset()
+    if options["recognition_mode"] and processor.identity_cache is not None:
+        processor.identity_cache.reset()
+
+    cap = cv2.VideoCapture(options["video_path"])
+    try:
+        if not cap.isOpened():
+            record["error"] = "Không thể mở video"
+            return record
+        for frame_index, frame in prefetch(iter_frames(cap, start, end, options["stride"])):
+            # Phát hiện một lần, dùng lại cho nhận diện
+            detection = processor.analyze(frame)
+            if options["recognition_mode"]:
+                faces = [_face_record(face_info, index)
+                         for face_info in processor.recognize_face(detection, options["confidence"])]
+            else:
+                faces = [{"bbox": [int(v) for v in bbox]} for bbox in detection.faces]
+            record["frames"] += 1
+            if faces:
+                record["entries"].append({"frame": frame_index,
+                                          "time": round(frame_index / options["fps"], 3),
+                                          "faces": faces})
+    except Exception as e:
+        record["error"] = str(e)
+    finally:
+        cap.release()
+    record["elapsed"] = round(time.time() - started, 3)
+    return record
+
+
+def build_appearances(entries, max_gap):
+    """
+    Gộp các khung có khuôn mặt thành các khoảng xuất hiện liên tục
+
+    Mỗi người dùng (hoặc "khuôn mặt" nói chung khi chỉ phát hiện) có các khoảng
+    [start, end]; hai lần thấy cách nhau không quá max_gap giây thuộc cùng một khoảng.
+
+    Args:
+        entries: Các khung có khuôn mặt, đã sắp theo thời gian
+        max_gap: Khoảng trống tối đa (giây) trong một lần xuất hiện
+
+    Returns:
+        list: Các khoảng {user_id, name, start, end, detections, best_confidence}, sắp theo start
+    """
+    open_intervals = {}
+    appearances = []
+    for entry in entries:
+        seen = {}
+        for face in entry["faces"]:
+            key = face.get("user_id")
+            best = seen.get(key)
+            if best is None or face.get("confidence", 0) > best.get("confidence", 0):
+                seen[key] = face
+        for key, face in seen.items():
+            interval = open_intervals.get(key)
+            if interval is None or entry["time"] - interval["end"] > max_gap:
+                interval = {"user_id": key, "name": face.get("name"), "start": entry["time"],
+                            "end": entry["time"], "detections": 0}
+                if "confidence" in face:
+                    interval["best_confidence"] = face["confidence"]
+                open_intervals[key] = interval
+                appearances.append(interval)
+            interval["end"] = entry["time"]
+            interval["detections"] += 1
+            if "confidence" in face:
+                interval["best_confidence"] = max(interval["best_confidence"], face["confidence"])
+    appearances.sort(key=lambda interval: interval["start"])
+    return appearances
+
+
+def run_video(video_path, cascade_path, recognition_mode=False, confidence=50.0, stride=1,
+              workers=None, segment_seconds=60.0, max_gap=None, detector_options=None,
+              track_interval=0, identity_cache=False, reverify_interval=15):
+    """
+    Phát hiện/nhận diện khuôn mặt trong file video, chia thành các đoạn xử lý song song
+
+    Mỗi tiến trình mở video riêng, tua tới đầu đoạn của nó và giải mã tuần tự
+    (đọc trước trên một luồng nền); kết quả của các đoạn được ghép theo thời gian.
+
+    Args:
+        video_path: Đường dẫn file video
+        cascade_path: Đường dẫn file Haar Cascade
+        recognition_mode: True để nhận diện người dùng thay vì chỉ phát hiện
+        confidence: Ngưỡng độ tin cậy cho nhận diện
+        stride: Xử lý một khung trong mỗi stride khung
+        workers: Số tiến trình (mặc định: số lõi CPU); 1 để xử lý trong tiến trình hiện tại
+        segment_seconds: Độ dài tối đa của một đoạn (giây)
+        max_gap: Khoảng trống tối đa (giây) khi gộp các lần xuất hiện (mặc định: max(1, 2 * stride / fps))
+        detector_options: Tham số cho FaceDetector (vd: detection_scale, max_detection_side)
+        track_interval: Chạy cascade mỗi N khung được xử lý, theo dõi ở các khung còn lại (0: tắt)
+        identity_cache: Dùng lại danh tính theo track (chế độ nhận diện)
+        reverify_interval: Xác minh lại danh tính ít nhất mỗi N khung khi dùng identity_cache
+
+    Returns:
+        dict: Dòng thời gian (thông tin video, thống kê, frames, appearances, errors)
+    """
+    info = probe_video(video_path)
+    workers = workers or os.cpu_count() or 1
+    segments = plan_segments(info["frame_count"], info["fps"], stride, segment_seconds, workers)
+    options = {
+        "video_path": video_path,
+        "fps": info["fps"],
+        "stride": stride,
+        "recognition_mode": recognition_mode,
+        "confidence": confidence,
+        "track_interval": track_interval,
+        "identity_cache": identity_cache,
+        "reverify_interval": reverify_interval,
+    }
+    detector_options = detector_options or {}
+
+    print(f"Video: {info['width']}x{info['height']}, {info['fps']:.2f} fps, {info['frame_count']} khung "
+          f"({info['duration']:.1f} giây), {len(segments)} đoạn, xử lý 1/{stride} khung")
+
+    start_time = time.time()
+    records = []
+
+    def collect(record):
+        records.append(record)
+        if "error" in record:
+            print(f"Lỗi ở đoạn {record['segment']}: {record['error']}")
+        elapsed = time.time() - start_time
+        processed = sum(r["frames"] for r in records)
+        rate = processed / elapsed if elapsed > 0 else 0
+        print(f"Đã xử lý {len(records)}/{len(segments)} đoạn ({processed} khung, {rate:.1f} khung/giây)")
+
+    if workers == 1 or len(segments) == 1:
+        # Một tiến trình: không cần pool, OpenCV được dùng mọi lõi
+        _init_worker(cascade_path, options, detector_options, single_thread=False)
+        try:
+            for segment in segments:
+                collect(_process_segment(segment))
+        finally:
+            if recognition_mode:
+                _worker_processor.close()
+    else:
+        with Pool(min(workers, len(segments)), initializer=_init_worker,
+                  initargs=(cascade_path, options, detector_options)) as pool:
+            for record in pool.imap_unordered(_process_segment, segments):
+                collect(record)
+    elapsed = time.time() - start_time
+
+    records.sort(key=lambda record: record["segment"])
+    entries = [entry for record in records for entry in record["entries"]]
+    if max_gap is None:
+        max_gap = max(1.0, 2.0 * stride / info["fps"])
+    frames_processed = sum(record["frames"] for record in records)
+    return {
+        "video": os.path.abspath(video_path),
+        "fps": info["fps"],
+        "frame_count": info["frame_count"],
+        "duration": round(info["duration"], 3),
+        "stride": stride,
+        "mode": "recognition" if recognition_mode else "detection",
+        "segments": len(segments),
+        "frames_processed": frames_processed,
+        "elapsed": round(elapsed, 3),
+        "errors": [{"segment": record["segment"], "error": record["error"]}
+                   for record in records if "error" in record],
+        "appearances": build_appearances(entries, max_gap),
+        "frames": entries,
+    }
+
+
+def write_timeline(timeline, output_path):
+    """
+    Ghi dòng thời gian ra file theo phần mở rộng
+
+    - .json: toàn bộ dòng thời gian (thông tin video, các khoảng xuất hiện, các khung có khuôn mặt)
+    - .csv: mỗi dòng một khuôn mặt tại một thời điểm (các cột CSV_FIELDS)
+    """
+    if output_path.lower().endswith(".csv"):
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            for entry in timeline["frames"]:
+                for face in entry["faces"]:
+                    x, y, w, h = face["bbox"]
+                    writer.writerow({"time": entry["time"], "frame": entry["frame"],
+                                     "user_id": face.get("user_id") or "", "name": face.get("name", ""),
+                                     "confidence": face.get("confidence", ""),
+                                     "track_id": face.get("track_id", ""),
+                                     "x": x, "y": y, "w": w, "h": h})
+    else:
+        # Mỗi khung một dòng để file gọn nhưng vẫn dễ đọc
+        lines = [json.dumps({key: value for key, value in timeline.items() if key != "frames"},
+                            ensure_ascii=False, indent=2)[:-2] + ',\n  "frames": [']
+        lines.append(",\n".join("    " + json.dumps(entry, ensure_ascii=False) for entry in timeline["frames"]))
+        lines.append("  ]\n}\n")
+        atomic_write_bytes(output_path, "\n".join(lines).encode('utf-8'))
@@ -0,0 +1,227 @@
+import cv2
+import threading
+import time
+from collections import deque
+from metrics import timed
+
+
+class DroppingQueue:
+    """
+    Hàng đợi có giới hạn: khi đầy, phần tử cũ nhất bị bỏ để nhường chỗ cho phần tử mới
+
+    Với maxsize=1 hàng đợi chỉ giữ khung hình mới nhất, nên một giai đoạn chậm
+    không bao giờ làm khung hình dồn lại phía trước nó.
+    """
+
+    def __init__(self, maxsize=1):
+        self.maxsize = maxsize
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+        self.put_count = 0
+
+    def put(self, item):
+        """Thêm phần tử, bỏ phần tử cũ nhất nếu hàng đợi đầy"""
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self.put_count += 1
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Lấy phần tử cũ nhất
+
+        Returns:
+            Phần tử, hoặc None nếu hết thời gian chờ hay hàng đợi đã đóng
+        """
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if self._items:
+                return self._items.popleft()
+            return None
+
+    def depth(self):
+        """Số phần tử đang chờ trong hàng đợi"""
+        with self._cond:
+            return len(self._items)
+
+    def close(self):
+        """Đóng hàng đợi và đánh thức các luồng đang chờ"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class FramePacket:
+    """Dữ liệu của một khung hình đi qua các giai đoạn của pipeline"""
+
+    def __init__(self, frame_id, frame, captured_at):
+        self.frame_id = frame_id
+        self.frame = frame
+        self.captured_at = captured_at
+        self.output = None
+        self.faces = []
+        self.num_faces = 0
+
+
+class WebcamPipeline:
+    """
+    Pipeline nhiều luồng cho webcam: thu hình -> suy luận -> hiển thị/ghi video
+
+    - Luồng thu hình luôn đọc camera và chỉ giữ khung hình mới nhất
+    - Luồng suy luận xử lý khung hình mới nhất đang có (bỏ qua khung cũ)
+    - Luồng ghi video nhận khung đã vẽ qua một hàng đợi có giới hạn
+    - Hiển thị (imshow/waitKey) chạy ở luồng chính do yêu cầu của HighGUI
+
+    Nhờ vậy độ trễ đầu-cuối bị chặn trên kể cả khi nhận diện chậm hơn camera.
+    """
+
+    def __init__(self, cap, process_frame, flip=None, video_writer=None,
+                 render_queue_size=2, encode_queue_size=32, metrics=None):
+        """
+        Args:
+            cap: cv2.VideoCapture đã mở
+            process_frame: Hàm nhận khung hình, trả về (ảnh đã vẽ, danh sách khung khuôn mặt)
+            flip: Tham số lật hình cho cv2.flip hoặc None
+            video_writer: cv2.VideoWriter hoặc None
+            render_queue_size: Kích thước hàng đợi suy luận -> hiển thị
+            encode_queue_size: Kích thước hàng đợi hiển thị -> ghi video
+            metrics: Metrics ghi thời gian đọc khung hình (decode), độ trễ đầu-cuối (latency)
+                     và số khung bị bỏ (frames_dropped), hoặc None
+        """
+        self.cap = cap
+        self.process_frame = process_frame
+        self.flip = flip
+        self.video_writer = video_writer
+        self.metrics = metrics
+
+        self.capture_queue = DroppingQueue(1)
+        self.render_queue = DroppingQueue(render_queue_size)
+        self.encode_queue = DroppingQueue(encode_queue_size) if video_writer is not None else None
+
+        self._stop_event = threading.Event()
+        self._threads = []
+        self.error = None
+
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.frames_rendered = 0
+        self.frames_encoded = 0
+        self._latency_total = 0.0
+        self.last_latency = 0.0
+
+        if metrics is not None:
+            metrics.register_counter("frames_dropped", lambda: sum(
+                q.dropped for q in (self.capture_queue, self.render_queue, self.encode_queue) if q is not None))
+
+    def start(self):
+        """Khởi động các luồng thu hình, suy luận và ghi video"""
+        targets = [self._capture_loop, self._inference_loop]
+        if self.encode_queue is not None:
+            targets.append(self._encode_loop)
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def is_running(self):
+        return not self._stop_event.is_set()
+
+    def stop(self):
+        """Dừng pipeline và chờ các luồng kết thúc"""
+        self._stop_event.set()
+        for q in (self.capture_queue, self.render_queue, self.encode_queue):
+            if q is not None:
+                q.close()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+
+    def _capture_loop(self):
+        frame_id = 0
+        while not self._stop_event.is_set():
+            with timed(self.metrics, "decode"):
+                ret, frame = self.cap.read()
+            if not ret:
+                self.error = "Lỗi đọc khung hình từ camera"
+                self._stop_event.set()
+                self.capture_queue.close()
+                break
+            if self.flip is not None:
+                frame = cv2.flip(frame, self.flip)
+            frame_id += 1
+            self.frames_captured += 1
+            self.capture_queue.put(FramePacket(frame_id, frame, time.time()))
+
+    def _inference_loop(self):
+        while not self._stop_event.is_set():
+            packet = self.capture_queue.get(timeout=0.1)
+            if packet is None:
+                continue
+            try:
+                packet.output, packet.faces = self.process_frame(packet.frame)
+            except Exception as e:
+                self.error = f"Lỗi khi xử lý khung hình: {str(e)}"
+                self._stop_event.set()
+                self.render_queue.close()
+                break
+            packet.num_faces = len(packet.faces)
+            self.frames_processed += 1
+            self.render_queue.put(packet)
+
+    def _encode_loop(self):
+        # Ghi hết các khung còn trong hàng đợi trước khi thoát
+        while not self._stop_event.is_set() or self.encode_queue.depth() > 0:
+            packet = self.encode_queue.get(timeout=0.1)
+            if packet is None:
+                continue
+            self.video_writer.write(packet.output)
+            self.frames_encoded += 1
+
+    def get_result(self, timeout=0.01):
+        """
+        Lấy khung hình đã xử lý tiếp theo để hiển thị (gọi từ luồng chính)
+
+        Returns:
+            FramePacket hoặc None nếu chưa có khung mới
+        """
+        packet = self.render_queue.get(timeout)
+        if packet is not None:
+            self.last_latency = time.time() - packet.captured_at
+            self._latency_total += self.last_latency
+            if self.metrics is not None:
+                self.metrics.observe("latency", self.last_latency)
+            self.frames_rendered += 1
+        return packet
+
+    def submit_for_encoding(self, packet):
+        """Đưa khung hình đã vẽ hoàn chỉnh sang luồng ghi video"""
+        if self.encode_queue is not None:
+            self.encode_queue.put(packet)
+
+    def stats(self):
+        """
+        Thống kê theo từng giai đoạn
+
+        Returns:
+            dict: Số khung đã qua mỗi giai đoạn, độ sâu hàng đợi, số khung bị bỏ và độ trễ
+        """
+        rendered = self.frames_rendered
+        return {
+            "captured": self.frames_captured,
+            "processed": self.frames_processed,
+            "rendered": rendered,
+            "encoded": self.frames_encoded,
+            "capture_queue_depth": self.capture_queue.depth(),
+            "render_queue_depth": self.render_queue.depth(),
+            "encode_queue_depth": self.encode_queue.depth() if self.encode_queue else 0,
+            "capture_dropped": self.capture_queue.dropped,
+            "render_dropped": self.render_queue.dropped,
+            "encode_dropped": self.encode_queue.dropped if self.encode_queue else 0,
+            "last_latency_ms": self.last_latency * 1000,
+            "avg_latency_ms": (self._latency_total / rendered * 1000) if rendered else 0.0,
+        }
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# Các module nằm phẳng trong thư mục haarcascades và import lẫn nhau theo tên
+HAARCASCADES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "haarcascades")
+sys.path.insert(0, HAARCASCADES_DIR)
+
+PROJECT_DIR = os.path.dirname(HAARCASCADES_DIR)
+CASCADE_PATH = os.path.join(HAARCASCADES_DIR, "haarcascade_frontalface_default.xml")
+IMAGES_DIR = os.path.join(PROJECT_DIR, "images")
+LEGACY_DATA_DIR = os.path.join(PROJECT_DIR, "user_data")
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """Thư mục dữ liệu người dùng tạm (đường dẫn tuyệt đối, không đụng tới user_data của dự án)"""
+    path = tmp_path / "user_data"
+    path.mkdir()
+    return str(path)
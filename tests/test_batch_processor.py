@@ -0,0 +1,62 @@
+import json
+import os
+
+from batch_processor import load_processed, prepare_resume, run_batch
+from conftest import CASCADE_PATH, IMAGES_DIR
+
+
+def _write_results(path, records, torn=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        if torn:
+            f.write(torn)
+
+
+def _read_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_prepare_resume_drops_torn_line_and_retried_errors(tmp_path):
+    results_file = str(tmp_path / "results.jsonl")
+    _write_results(results_file, [
+        {"image": "a.jpg", "num_faces": 1},
+        {"image": "b.jpg", "error": "Không thể đọc ảnh"},
+        {"image": "old.jpg", "error": "Không thể đọc ảnh"},
+    ], torn='{"image": "c.jpg", "num_fa')
+
+    pending = prepare_resume(results_file, ["a.jpg", "b.jpg", "c.jpg"])
+
+    assert pending == ["b.jpg", "c.jpg"]
+    # Lỗi của ảnh không nằm trong lần chạy này được giữ lại
+    assert [r["image"] for r in _read_results(results_file)] == ["a.jpg", "old.jpg"]
+
+
+def test_prepare_resume_truncates_torn_line_only(tmp_path):
+    results_file = str(tmp_path / "results.jsonl")
+    _write_results(results_file, [{"image": "a.jpg", "num_faces": 1}], torn='{"image": "b.jp')
+
+    assert prepare_resume(results_file, ["a.jpg", "b.jpg"]) == ["b.jpg"]
+    with open(results_file, 'r', encoding='utf-8') as f:
+        assert f.read().endswith("}\n")
+    assert load_processed(results_file) == {"a.jpg"}
+    assert prepare_resume(str(tmp_path / "missing.jsonl"), ["a.jpg"]) == ["a.jpg"]
+
+
+def test_resumed_run_leaves_one_valid_record_per_image(tmp_path):
+    images = [os.path.join(IMAGES_DIR, name) for name in ("khiem1.jpg", "khiem2.jpg", "toan2.jpg")]
+    results_file = str(tmp_path / "results.jsonl")
+    # Lần chạy trước: ảnh đầu xong, ảnh thứ hai lỗi, ảnh thứ ba bị ngắt khi đang ghi
+    _write_results(results_file, [
+        {"image": images[0], "faces": [], "num_faces": 0},
+        {"image": images[1], "error": "lỗi tạm thời"},
+    ], torn=json.dumps({"image": images[2]})[:20])
+
+    stats = run_batch(images, CASCADE_PATH, results_file, IMAGES_DIR, str(tmp_path),
+                      workers=1, resume=True)
+
+    assert stats["skipped"] == 1 and stats["processed"] == 2 and stats["errors"] == 0
+    records = _read_results(results_file)
+    assert sorted(r["image"] for r in records) == sorted(images)
+    assert all("error" not in r for r in records)
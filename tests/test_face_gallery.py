@@ -0,0 +1,51 @@
+import numpy as np
+
+from face_gallery import FaceGallery
+
+
+def _sparse(rng, shape):
+    # Histogram LBP thưa: phần lớn các ô bằng 0
+    return rng.gamma(0.3, size=shape) * (rng.random(shape) < 0.1)
+
+
+def _gallery(shortlist, num_users=12, samples_per_user=10, seed=0):
+    """Thư viện tổng hợp lớn hơn shortlist: mỗi người dùng có một histogram gốc và các biến thể"""
+    rng = np.random.default_rng(seed)
+    template = FaceGallery(np.empty((0, 0)), [])
+    cells, patterns = template.grid_x * template.grid_y, template.num_patterns
+    bases = _sparse(rng, (num_users, cells, patterns)) + 1e-3
+    histograms = bases[:, None] + 0.5 * _sparse(rng, (num_users, samples_per_user, cells, patterns))
+    histograms /= histograms.sum(axis=3, keepdims=True)
+    labels = np.repeat(np.arange(num_users), samples_per_user)
+    gallery = FaceGallery(histograms.reshape(len(labels), -1), labels, shortlist=shortlist)
+    probes = bases + 0.5 * _sparse(rng, bases.shape)
+    probes /= probes.sum(axis=2, keepdims=True)
+    return gallery, probes.reshape(num_users, -1).astype(np.float32)
+
+
+def _chisqr(probe, histograms):
+    total = probe + histograms
+    diff = (probe - histograms) ** 2
+    return 2.0 * np.sum(np.divide(diff, total, out=np.zeros_like(diff), where=total > 0), axis=1)
+
+
+def test_exact_matching_equals_brute_force_chisqr():
+    gallery, probes = _gallery(shortlist=0)
+    histograms = gallery.dequantized()
+    for probe, [(label, distance)] in zip(probes, gallery.search(probes, k=1)):
+        distances = _chisqr(probe, histograms)
+        assert label == gallery.labels[np.argmin(distances)]
+        assert np.isclose(distance, distances.min(), rtol=1e-4)
+
+
+def test_shortlist_matches_exact_matching_on_separable_gallery():
+    exact, probes = _gallery(shortlist=0)
+    approximate, _ = _gallery(shortlist=32)
+    assert len(approximate) > approximate.shortlist
+
+    exact_results = exact.search(probes, k=1)
+    approximate_results = approximate.search(probes, k=1)
+    for [(exact_label, exact_distance)], [(label, distance)] in zip(exact_results, approximate_results):
+        # Bước lọc chỉ có thể loại mẫu gần nhất, không bao giờ tìm được mẫu gần hơn
+        assert distance >= exact_distance - 1e-4
+        assert label == exact_label
@@ -0,0 +1,75 @@
+import os
+import shutil
+
+import cv2
+
+from conftest import CASCADE_PATH, IMAGES_DIR, LEGACY_DATA_DIR
+from face_recognizer import FaceRecognizer
+
+
+def test_converts_legacy_yaml_model(data_dir):
+    shutil.copy(os.path.join(LEGACY_DATA_DIR, "face_model.yml"), data_dir)
+
+    recognizer = FaceRecognizer(CASCADE_PATH, data_dir=data_dir)
+    try:
+        assert recognizer.metrics is None
+        assert os.path.exists(os.path.join(data_dir, "face_model.lbph"))
+        assert len(recognizer.recognizer.gallery) > 0
+    finally:
+        recognizer.close()
+
+
+def _delete_user(recognizer, user_id):
+    """Xóa người dùng như manage_users.py delete"""
+    del recognizer.users_data[user_id]
+    recognizer.save_user(user_id)
+    recognizer.remove_user_from_model(user_id)
+
+
+def test_enroll_after_deleting_last_user_does_not_reuse_old_samples(data_dir):
+    recognizer = FaceRecognizer(CASCADE_PATH, data_dir=data_dir)
+    try:
+        khiem = cv2.imread(os.path.join(IMAGES_DIR, "khiem2.jpg"))
+        assert recognizer.add_user("a", "A", khiem)
+        _delete_user(recognizer, "a")
+        assert len(recognizer.recognizer.gallery) == 0
+
+        assert recognizer.add_user("b", "B", cv2.imread(os.path.join(IMAGES_DIR, "toan3.jpg")))
+        labels = recognizer.recognizer.getLabels().ravel()
+        assert len(labels) == 1
+
+        recognized = recognizer.recognize_face(khiem, confidence_threshold=70)
+        assert all(face["user_id"] != "b" or face["confidence"] < 100 for face in recognized)
+    finally:
+        recognizer.close()
+
+    # Mô hình trên đĩa cũng không còn mẫu của người dùng đã xóa
+    reloaded = FaceRecognizer(CASCADE_PATH, data_dir=data_dir, read_only=True)
+    assert len(reloaded.recognizer.getLabels().ravel()) == 1
+    reloaded.close()
+
+
+def test_concurrent_recognizers_do_not_overwrite_each_others_model(data_dir):
+    toan = cv2.imread(os.path.join(IMAGES_DIR, "toan3.jpg"))
+    khiem = cv2.imread(os.path.join(IMAGES_DIR, "khiem1.jpg"))
+    first = FaceRecognizer(CASCADE_PATH, data_dir=data_dir)
+    assert first.add_user("t", "T", toan)
+    # Hai tiến trình (vd: manage_users.py và máy chủ) cùng mở một thư mục dữ liệu
+    second = FaceRecognizer(CASCADE_PATH, data_dir=data_dir)
+    try:
+        assert first.add_user("k", "K", khiem)
+        assert second.add_face("t", toan)
+    finally:
+        first.close()
+        second.close()
+
+    reloaded = FaceRecognizer(CASCADE_PATH, data_dir=data_dir, read_only=True)
+    try:
+        state = reloaded.face_encodings
+        labels = list(reloaded.recognizer.getLabels().ravel())
+        assert labels.count(int(state["user_to_label"]["t"])) == 2
+        assert labels.count(int(state["user_to_label"]["k"])) == 1
+        recognized = reloaded.recognize_face(khiem, confidence_threshold=100)
+        assert [face["user_id"] for face in recognized] == ["k"]
+    finally:
+        reloaded.close()
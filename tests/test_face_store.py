@@ -0,0 +1,38 @@
+import numpy as np
+
+from face_store import FaceStore
+
+
+def _faces(value, count):
+    return [np.full((100, 100), value, dtype=np.uint8) for _ in range(count)]
+
+
+def test_concurrent_stores_append_to_separate_rows(data_dir):
+    first, second = FaceStore(data_dir), FaceStore(data_dir)
+
+    # Mỗi kho chỉ biết các dòng đã đọc khi mở; dòng mới phải tính theo chỉ mục trên đĩa
+    first.append("a", _faces(10, 2))
+    second.append("b", _faces(20, 3))
+    first.append("a", _faces(30, 1))
+    second.remove_user("a")
+
+    store = FaceStore(data_dir)
+    assert [e["row"] for e in store.entries] == list(range(6))
+    assert [e["user_id"] for e in store.entries] == ["a", "a", "b", "b", "b", "a"]
+    faces = store.faces()
+    assert [int(face[0, 0]) for face in faces] == [10, 10, 20, 20, 20, 30]
+    assert store.user_rows("a") == []
+    assert store.user_rows("b") == [2, 3, 4]
+
+
+def test_append_discards_data_without_index(data_dir):
+    store = FaceStore(data_dir)
+    store.append("a", _faces(10, 1))
+    # Lần ghi bị ngắt: dữ liệu đã ghi nhưng chỉ mục thì chưa
+    with open(store.data_file, 'ab') as f:
+        f.write(b"\0" * 150)
+
+    store.append("b", _faces(20, 1))
+    reopened = FaceStore(data_dir)
+    assert [e["user_id"] for e in reopened.entries] == ["a", "b"]
+    assert int(reopened.faces()[1][0, 0]) == 20
@@ -0,0 +1,56 @@
+import numpy as np
+
+from face_tracker import FaceTracker
+
+FACE = (60, 50, 64, 64)
+
+
+class _Detector:
+    """Hàm phát hiện giả: trả về vị trí hiện tại của khuôn mặt và đếm số lần gọi"""
+
+    def __init__(self):
+        self.box = FACE
+        self.calls = 0
+
+    def __call__(self, gray):
+        self.calls += 1
+        return np.array([self.box], dtype=np.int32)
+
+
+def _frame(box, seed=0):
+    """Khung hình nhiễu cố định với một "khuôn mặt" (mẫu nhiễu theo seed) tại box"""
+    gray = np.random.default_rng(100).integers(0, 256, size=(240, 320), dtype=np.uint8)
+    x, y, w, h = box
+    gray[y:y+h, x:x+w] = np.random.default_rng(seed).integers(0, 256, size=(h, w), dtype=np.uint8)
+    return gray
+
+
+def test_tracks_moving_face_between_detections():
+    detector = _Detector()
+    tracker = FaceTracker(detector, detect_interval=4, template_size=32)
+    assert [tuple(b) for b in tracker.update(_frame(FACE))] == [FACE]
+
+    for dx in (4, 8, 12):
+        box = (FACE[0] + dx, FACE[1] + dx // 2, 64, 64)
+        faces = tracker.update(_frame(box))
+        # Mẫu được thu nhỏ một nửa nên vị trí sai lệch tối đa ~1 điểm ảnh
+        assert np.all(np.abs(faces[0] - np.array(box)) <= 2)
+    assert detector.calls == 1 and tracker.track_count == 3
+
+    # Hết detect_interval khung: chạy lại cascade
+    tracker.update(_frame(FACE))
+    assert detector.calls == 2
+
+
+def test_low_match_score_falls_back_to_detection():
+    detector = _Detector()
+    tracker = FaceTracker(detector, detect_interval=10, min_confidence=0.6)
+    tracker.update(_frame(FACE))
+
+    # Khuôn mặt khác hẳn ở cùng vị trí: điểm khớp thấp, phải phát hiện lại
+    tracker.update(_frame(FACE, seed=1))
+    assert detector.calls == 2 and tracker.track_count == 0
+
+    tracker.reset()
+    tracker.update(_frame(FACE, seed=1))
+    assert detector.calls == 3
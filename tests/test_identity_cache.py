@@ -0,0 +1,76 @@
+from identity_cache import IdentityCache
+
+THRESHOLD = 50.0
+BOX = (100, 100, 80, 80)
+
+
+def _frame(cache, faces, generation=None):
+    return cache.begin_frame(faces, THRESHOLD, generation)
+
+
+def test_known_face_is_reused_until_reverify_interval():
+    cache = IdentityCache(reverify_interval=3, confidence_decay=0)
+    [track] = _frame(cache, [BOX])
+    assert track["pending"]
+    assert cache.resolve(track, "a", 80.0) == ("a", 80.0, None)
+
+    for _ in range(2):
+        [same] = _frame(cache, [(102, 101, 80, 80)])
+        assert same is track and not same["pending"]
+    [same] = _frame(cache, [BOX])
+    assert same["pending"]
+    assert cache.stats()["verifications"] == 1 and cache.stats()["lookups"] == 4
+
+
+def test_moved_box_decayed_confidence_and_reload_trigger_verification():
+    cache = IdentityCache(reverify_interval=100, reverify_iou=0.8, match_iou=0.3, confidence_decay=5)
+    [track] = _frame(cache, [BOX])
+    cache.resolve(track, "a", 60.0)
+
+    # Dịch 20 điểm ảnh: vẫn cùng track (IoU ~0.6) nhưng phải xác minh lại
+    [moved] = _frame(cache, [(120, 100, 80, 80)])
+    assert moved is track and moved["pending"]
+    cache.resolve(moved, "a", 60.0)
+
+    # Độ tin cậy giảm 5 mỗi khung: 55, 50 vẫn đủ ngưỡng, 45 thì không
+    assert [_frame(cache, [moved["bbox"]])[0]["pending"] for _ in range(3)] == [False, False, True]
+    cache.resolve(moved, "a", 60.0)
+
+    # Mô hình được nạp lại (thế hệ dữ liệu đổi): mọi track được xác minh lại
+    assert _frame(cache, [moved["bbox"]], generation=1)[0]["pending"]
+
+
+def test_identity_switches_only_after_consecutive_votes():
+    cache = IdentityCache(switch_votes=2, confidence_decay=0)
+    [track] = _frame(cache, [BOX])
+    cache.resolve(track, "a", 80.0)
+
+    assert cache.resolve(track, "b", 70.0)[0] == "a"
+    # Đang có phiếu đổi danh tính: khung sau vẫn phải xác minh
+    assert _frame(cache, [BOX])[0]["pending"]
+    assert cache.resolve(track, "a", 80.0)[0] == "a" and track["votes"] == 0
+
+    cache.resolve(track, "b", 70.0)
+    assert cache.resolve(track, "b", 72.0) == ("b", 72.0, None)
+    assert cache.switches == 1
+
+    # Khuôn mặt chưa xác định nay đã nhận ra: đổi ngay
+    [unknown] = _frame(cache, [BOX, (400, 100, 80, 80)])[1:]
+    cache.resolve(unknown, None, 0.0)
+    assert cache.resolve(unknown, "c", 90.0)[0] == "c"
+
+
+def test_missing_tracks_are_kept_then_evicted():
+    cache = IdentityCache(max_missed=2)
+    [track] = _frame(cache, [BOX])
+    cache.resolve(track, "a", 80.0)
+
+    for _ in range(2):
+        _frame(cache, [])
+    # Cascade bỏ sót hai khung: khuôn mặt quay lại vẫn là track cũ
+    assert _frame(cache, [BOX])[0] is track
+
+    for _ in range(3):
+        _frame(cache, [])
+    assert cache.evictions == 1 and not cache.tracks
+    assert _frame(cache, [BOX])[0]["track_id"] != track["track_id"]
@@ -0,0 +1,153 @@
+import json
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from lbph_model import LBPHModel
+
+
+def _faces(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, size=(32, 32), dtype=np.uint8) for _ in range(count)]
+
+
+def _model(count, dtype="float32", seed=0):
+    model = LBPHModel(dtype=dtype)
+    model.train(_faces(count, seed), np.arange(count) % 3)
+    return model
+
+
+def _assert_same_gallery(loaded, model):
+    assert np.array_equal(loaded.gallery.labels, model.gallery.labels)
+    assert np.array_equal(loaded.gallery.dequantized(), model.gallery.dequantized())
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "uint8"])
+def test_binary_round_trip_keeps_dtype_and_histograms(tmp_path, dtype):
+    path = str(tmp_path / "model.lbph")
+    model = _model(5, dtype)
+    model.write(path)
+
+    loaded = LBPHModel()
+    loaded.read(path)
+    assert loaded.dtype == dtype
+    assert loaded.gallery.dtype == dtype
+    _assert_same_gallery(loaded, model)
+
+
+def test_version_1_file_is_still_readable(tmp_path):
+    # Phiên bản 1: chỉ có labels int32 và histograms float32, không có version/dtype trong header
+    model = _model(4)
+    header = {"radius": 1, "neighbors": 8, "grid_x": 8, "grid_y": 8, "threshold": 100.0,
+              "count": 4, "dim": model.gallery.dimension}
+    encoded = json.dumps(header).encode('utf-8')
+    path = str(tmp_path / "v1.lbph")
+    with open(path, 'wb') as f:
+        f.write(LBPHModel.MAGIC + struct.pack('<I', len(encoded)) + encoded)
+        for name, (offset, dtype, shape) in LBPHModel._layout(len(encoded), header).items():
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(np.ascontiguousarray(getattr(model.gallery, name), dtype=dtype).data)
+
+    loaded = LBPHModel()
+    loaded.read(path, writable=True)
+    assert loaded.dtype == "float32"
+    _assert_same_gallery(loaded, model)
+
+    # File cũ không có phần dự trữ: không ghi thêm được, phải ghi lại cả file
+    loaded.update(_faces(1, seed=1), [0])
+    assert not loaded.append_binary(path)
+
+
+def test_header_mismatches_are_rejected(tmp_path):
+    path = str(tmp_path / "model.lbph")
+    _model(3).write(path)
+
+    # Header bị sửa: tham số LBP khác với kích thước histogram, kiểu histogram không hỗ trợ
+    header = LBPHModel.read_header(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    start = len(LBPHModel.MAGIC) + 4
+    (length,) = struct.unpack('<I', data[start - 4:start])
+    raw = json.loads(data[start:start + length])
+    for key, value, message in (("grid_x", 4, "không khớp"), ("dtype", "int16", "không hỗ trợ")):
+        changed = dict(raw, **{key: value})
+        encoded = json.dumps(changed).encode('utf-8').ljust(length)
+        bad = str(tmp_path / f"bad_{key}.lbph")
+        with open(bad, 'wb') as f:
+            f.write(data[:start] + encoded + data[start + length:])
+        with pytest.raises(ValueError, match=message):
+            LBPHModel().read(bad)
+
+    truncated = str(tmp_path / "truncated.lbph")
+    end = header["layout"]["histograms"][0] + 10
+    with open(truncated, 'wb') as f:
+        f.write(data[:end])
+    with pytest.raises(ValueError, match="cắt ngắn"):
+        LBPHModel().read(truncated)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "uint8"])
+def test_append_binary_writes_only_new_rows(tmp_path, dtype):
+    path = str(tmp_path / "model.lbph")
+    model = _model(4, dtype)
+    model.write(path)
+    size = os.path.getsize(path)
+
+    writer = LBPHModel()
+    writer.read(path, writable=True)
+    reader = LBPHModel()
+    reader.read(path)
+    for seed in range(1, 4):
+        writer.update(_faces(2, seed), [seed, seed])
+        assert writer.append_binary(path)
+    # Các mẫu mới nằm trong phần dự trữ: kích thước file không đổi
+    assert os.path.getsize(path) == size
+    assert LBPHModel.stored_count(path) == 10
+
+    # Bản đã nạp trước đó vẫn chỉ thấy 4 mẫu
+    assert len(reader.gallery) == 4
+    loaded = LBPHModel()
+    loaded.read(path)
+    _assert_same_gallery(loaded, writer)
+
+
+def test_append_binary_refuses_when_file_or_gallery_changed(tmp_path):
+    path = str(tmp_path / "model.lbph")
+    first = _model(3)
+    first.write(path)
+    second = LBPHModel()
+    second.read(path, writable=True)
+
+    # Tiến trình khác ghi lại file (ghi file tạm rồi đổi tên như FaceRecognizer._write_model):
+    # không được ghi thêm vào file đã thay đổi
+    first.update(_faces(1, seed=1), [1])
+    first.write(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    second.update(_faces(1, seed=2), [2])
+    assert not second.append_binary(path)
+
+    # Huấn luyện lại từ đầu: thư viện không còn là phần mở rộng của file
+    first.train(_faces(2, seed=3), [0, 1])
+    assert not first.append_binary(path)
+
+    # Hết chỗ dự trữ
+    first.save_binary(path, capacity=2)
+    first.update(_faces(1, seed=4), [0])
+    assert not first.append_binary(path)
+
+
+def test_extended_galleries_share_spare_rows():
+    model = _model(3)
+    base = model.gallery
+    model.update(_faces(1, seed=1), [1])
+    grown = model.gallery
+    model.update(_faces(1, seed=2), [2])
+    assert np.shares_memory(grown.histograms, model.gallery.histograms)
+    assert len(base) == 3 and len(grown) == 4 and len(model.gallery) == 5
+
+    # Mở rộng lần hai từ cùng một bản: không được ghi đè dòng của bản kia
+    branch = grown.extended(model.gallery.compute_histograms(_faces(1, seed=5)), [7])
+    assert not np.shares_memory(branch.histograms, model.gallery.histograms)
+    assert model.gallery.labels[-1] == 2 and branch.labels[-1] == 7
@@ -0,0 +1,66 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import CASCADE_PATH, IMAGES_DIR
+from face_detector import FaceDetector
+from multi_cascade_detector import MultiCascadeDetector
+
+
+def _detector(**options):
+    # Hai lượt chạy (nguồn 0 và 1) từ cùng một file cascade
+    return MultiCascadeDetector([CASCADE_PATH, CASCADE_PATH], workers=1, **options)
+
+
+# Hai khuôn mặt: khuôn mặt đầu được cả hai cascade tìm thấy, khuôn mặt sau chỉ cascade 0
+BOXES = np.array([[100, 100, 80, 80], [104, 102, 80, 80], [300, 50, 60, 60]], dtype=np.int32)
+COUNTS = np.array([10, 30, 5], dtype=np.int32)
+SOURCES = [0, 1, 0]
+
+
+def test_weighted_fusion_averages_boxes_of_the_same_face():
+    detector = _detector(fusion="weighted")
+    fused = detector._fuse(BOXES, COUNTS, SOURCES)
+    # (100*10 + 104*30) / 40 = 103, (100*10 + 102*30) / 40 = 101.5
+    assert sorted(map(tuple, fused)) == [(103, 102, 80, 80), (300, 50, 60, 60)]
+
+
+def test_nms_fusion_keeps_one_original_box_per_face():
+    detector = _detector(fusion="nms")
+    fused = detector._fuse(BOXES, COUNTS, SOURCES)
+    assert len(fused) == 2
+    assert tuple(fused[-1]) == (300, 50, 60, 60)
+    assert tuple(fused[0]) in {tuple(BOXES[0]), tuple(BOXES[1])}
+
+
+@pytest.mark.parametrize("fusion", ["weighted", "nms"])
+def test_min_votes_counts_distinct_cascades(fusion):
+    detector = _detector(fusion=fusion, min_votes=2)
+    fused = detector._fuse(BOXES, COUNTS, SOURCES)
+    assert len(fused) == 1 and fused[0][0] < 200
+
+    # Hai khung cùng một cascade không đủ hai phiếu
+    assert len(detector._fuse(BOXES[:2], COUNTS[:2], [0, 0])) == 0
+    assert len(detector._fuse(np.empty((0, 4), dtype=np.int32), np.empty(0), [])) == 0
+
+
+def test_invalid_options_are_rejected():
+    with pytest.raises(ValueError):
+        MultiCascadeDetector([])
+    with pytest.raises(ValueError):
+        _detector(fusion="mean")
+
+
+def test_agreeing_cascades_find_the_same_faces_as_one_cascade():
+    gray = cv2.cvtColor(cv2.imread(os.path.join(IMAGES_DIR, "khiem1.jpg")), cv2.COLOR_BGR2GRAY)
+    single = FaceDetector(CASCADE_PATH).detect_gray(gray)
+    detector = _detector(min_votes=2, gate=False)
+    try:
+        combined = detector.detect_gray(gray)
+    finally:
+        detector.close()
+    assert len(single) > 0
+    assert sorted(map(tuple, np.asarray(combined))) == sorted(map(tuple, np.asarray(single)))
+    assert sum(stats["runs"] for stats in detector.stats.values()) == len(detector.jobs)
@@ -0,0 +1,62 @@
+import threading
+
+from persistence import WriteBehindFlusher
+
+
+class _FlakyWriter:
+    """Hàm ghi giả: lỗi ở failures lần gọi đầu, ghi lại các tập khóa đã ghi thành công"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+        self.written = []
+        self.event = threading.Event()
+
+    def __call__(self, keys):
+        self.calls.append(set(keys))
+        if len(self.calls) <= self.failures:
+            raise OSError("đĩa đầy")
+        self.written.append(set(keys))
+        self.event.set()
+
+
+def test_failed_flush_keeps_keys_for_the_next_attempt():
+    writer = _FlakyWriter(failures=1)
+    flusher = WriteBehindFlusher(writer, interval=3600)
+    try:
+        flusher.mark_dirty("a")
+        flusher.mark_dirty("b")
+        flusher.flush()
+        assert flusher.error_count == 1 and flusher.write_count == 0
+        assert flusher.pending() == 2
+
+        # Khóa thay đổi sau lần ghi lỗi được gộp với các khóa chưa ghi được
+        flusher.mark_dirty("c")
+        flusher.flush()
+        assert writer.written == [{"a", "b", "c"}]
+        assert flusher.write_count == 1 and flusher.pending() == 0
+
+        # Không còn gì để ghi: không gọi hàm ghi
+        flusher.flush()
+        assert len(writer.calls) == 2
+    finally:
+        flusher.close()
+
+
+def test_max_pending_wakes_background_thread_and_close_flushes_rest():
+    writer = _FlakyWriter()
+    flusher = WriteBehindFlusher(writer, interval=3600, max_pending=3)
+    for key in "abc":
+        flusher.mark_dirty(key)
+    assert writer.event.wait(5.0)
+    assert writer.written[0] == {"a", "b", "c"}
+
+    flusher.mark_dirty("d")
+    flusher.close()
+    assert writer.written[-1] == {"d"}
+    assert flusher.pending() == 0
+
+    # Đã đóng: vẫn ghi được khi gọi flush() trực tiếp
+    flusher.mark_dirty("e")
+    flusher.flush()
+    assert writer.written[-1] == {"e"}
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from face_gallery import FaceGallery, quantization_report, quantize_histograms
+
+
+def _face_histograms(count, size=100, seed=0):
+    """Histogram LBP thật (số đếm chia cho số điểm ảnh mỗi ô) của các ảnh xám ngẫu nhiên"""
+    rng = np.random.default_rng(seed)
+    faces = [rng.integers(0, 256, size=(size, size), dtype=np.uint8) for _ in range(count)]
+    return FaceGallery(np.empty((0, 0)), []).compute_histograms(faces)
+
+
+def _dequantize(quantized, scales):
+    return quantized.astype(np.float32) * scales[:, None]
+
+
+def test_uint8_is_exact_for_lbp_count_histograms():
+    # Mỗi ô khoảng 12x12 điểm ảnh (ảnh 100x100, lưới 8x8): số đếm <= 255 nên lưu chính xác
+    histograms = _face_histograms(6)
+    quantized, scales = quantize_histograms(histograms, "uint8")
+    assert quantized.dtype == np.uint8
+    assert np.allclose(_dequantize(quantized, scales), histograms, rtol=1e-6, atol=0)
+
+
+def test_uint8_error_is_bounded_by_half_a_step():
+    rng = np.random.default_rng(1)
+    histograms = rng.random((20, 512)).astype(np.float32) * rng.random((20, 1)).astype(np.float32)
+    histograms[3] = 0  # dòng toàn 0 giữ hệ số 1
+
+    quantized, scales = quantize_histograms(histograms, "uint8", chunk_size=7)
+    error = np.abs(_dequantize(quantized, scales) - histograms)
+    # Giá trị lớn nhất của dòng ứng với 255: sai số <= nửa bước (max / 510)
+    bound = histograms.max(axis=1, keepdims=True) / 510 * (1 + 1e-5)
+    assert np.all(error <= bound)
+    assert scales[3] == 1 and not quantized[3].any()
+
+
+def test_float16_relative_error_is_bounded():
+    rng = np.random.default_rng(2)
+    histograms = rng.uniform(1e-4, 1.0, size=(10, 256)).astype(np.float32)
+    quantized, scales = quantize_histograms(histograms, "float16")
+    assert scales is None and quantized.dtype == np.float16
+    # Phần định trị 10 bit: sai số tương đối <= 2^-11
+    assert np.all(np.abs(quantized.astype(np.float32) - histograms) <= histograms * 2.0 ** -11)
+
+
+def test_invalid_dtype_is_rejected():
+    with pytest.raises(ValueError):
+        quantize_histograms(np.zeros((1, 4), dtype=np.float32), "int16")
+
+
+def test_quantized_galleries_agree_with_float32():
+    histograms = _face_histograms(60, seed=3)
+    gallery = FaceGallery(histograms, np.arange(60) % 6, shortlist=0)
+
+    report = {row["dtype"]: row for row in quantization_report(gallery, samples=60)}
+
+    assert report["float32"]["agreement"] == 1.0 and report["float32"]["distance_error"] == 0.0
+    assert report["float16"]["agreement"] == 1.0 and report["float16"]["distance_error"] < 1e-3
+    assert report["uint8"]["agreement"] == 1.0 and report["uint8"]["distance_error"] < 1e-5
+    assert report["float16"]["bytes"] * 2 == report["float32"]["bytes"]
+    assert report["uint8"]["bytes"] < report["float16"]["bytes"]
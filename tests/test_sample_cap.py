@@ -0,0 +1,65 @@
+import os
+
+import cv2
+import numpy as np
+
+from conftest import CASCADE_PATH, IMAGES_DIR
+from face_gallery import select_representatives
+from face_recognizer import FaceRecognizer
+
+
+def _line_distances(points):
+    points = np.asarray(points, dtype=np.float64)
+    return np.abs(points[:, None] - points[None, :])
+
+
+def test_select_representatives_drops_older_near_duplicates():
+    distances = _line_distances([0.0, 0.1, 5.0, 5.05, 10.0])
+    assert select_representatives(distances, duplicate_distance=1.0) == [1, 3, 4]
+    assert select_representatives(distances) == [0, 1, 2, 3, 4]
+
+
+def test_select_representatives_keeps_one_sample_per_cluster():
+    points = [0.0, 0.5, 1.0, 20.0, 20.5, 21.0, 40.0, 40.5, 41.0]
+    kept = select_representatives(_line_distances(points), max_samples=3)
+    assert kept == [1, 4, 7]
+
+
+def test_sample_cap_never_reuses_face_file_names(data_dir):
+    recognizer = FaceRecognizer(CASCADE_PATH, data_dir=data_dir, max_samples_per_user=2, duplicate_distance=0.0)
+    try:
+        assert recognizer.add_user("u", "U", cv2.imread(os.path.join(IMAGES_DIR, "khiem1.jpg")))
+        images = [cv2.imread(os.path.join(IMAGES_DIR, name)) for name in ("khiem2.jpg", "toan2.jpg", "toan3.jpg")]
+        images.append(cv2.flip(cv2.imread(os.path.join(IMAGES_DIR, "khiem1.jpg")), 1))
+        for image in images:
+            assert recognizer.add_face("u", image)
+
+            user_info = recognizer.users_data["u"]
+            face_images = user_info["face_images"]
+            retired = user_info.get("retired_faces", [])
+            assert len(face_images) <= 2
+            names = [os.path.basename(path) for path in face_images + retired]
+            assert len(names) == len(set(names))
+            assert all(os.path.exists(path) for path in face_images + retired)
+
+        faces_dir = os.path.join(data_dir, "u", "faces")
+        assert len(os.listdir(faces_dir)) == 5
+        label = int(recognizer.face_encodings["user_to_label"]["u"])
+        labels = recognizer.recognizer.getLabels().ravel()
+        live = [l for l in labels if str(l) not in recognizer.face_encodings["tombstones"]]
+        assert live.count(label) == 2
+    finally:
+        recognizer.close()
+
+
+def test_new_face_path_skips_retired_and_stray_files(data_dir):
+    recognizer = FaceRecognizer(CASCADE_PATH, data_dir=data_dir)
+    try:
+        faces_dir = os.path.join(data_dir, "u", "faces")
+        recognizer.users_data["u"] = {"name": "U", "face_images": [os.path.join(faces_dir, "u_face_1.jpg")],
+                                      "retired_faces": [os.path.join(faces_dir, "u_face_4.jpg")]}
+        assert recognizer.new_face_path("u") == os.path.join(faces_dir, "u_face_5.jpg")
+        open(os.path.join(faces_dir, "u_face_6.jpg"), "wb").close()
+        assert recognizer.new_face_path("u") == os.path.join(faces_dir, "u_face_7.jpg")
+    finally:
+        recognizer.close()
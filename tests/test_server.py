@@ -0,0 +1,80 @@
+import os
+import time
+
+import cv2
+import pytest
+
+from conftest import CASCADE_PATH, IMAGES_DIR
+from face_gallery import FaceGallery
+from face_recognizer import FaceRecognizer
+from server import create_app
+
+
+def _image(name):
+    return cv2.imread(os.path.join(IMAGES_DIR, name))
+
+
+def _encode(name):
+    return cv2.imencode(".jpg", _image(name))[1].tobytes()
+
+
+@pytest.fixture
+def enrolled_dir(data_dir):
+    recognizer = FaceRecognizer(CASCADE_PATH, data_dir=data_dir)
+    assert recognizer.add_user("khiem", "Khiem", _image("khiem1.jpg"))
+    assert recognizer.add_user("toan", "Toan", _image("toan3.jpg"))
+    recognizer.close()
+    return data_dir
+
+
+def test_recognize_images_matches_all_faces_in_one_call(enrolled_dir, monkeypatch):
+    recognizer = FaceRecognizer(CASCADE_PATH, data_dir=enrolled_dir, read_only=True)
+    images = [_image(name) for name in ("khiem2.jpg", "toan3.jpg", "khiem1.jpg")]
+    thresholds = [30.0, 30.0, 101.0]
+    expected = [recognizer.recognize_face(image, threshold) for image, threshold in zip(images, thresholds)]
+
+    calls = []
+    original_match = FaceGallery.match
+
+    def counting_match(self, *args, **kwargs):
+        calls.append(len(args[0]))
+        return original_match(self, *args, **kwargs)
+
+    monkeypatch.setattr(FaceGallery, "match", counting_match)
+    results = recognizer.recognize_images(images, thresholds)
+
+    assert calls == [sum(len(faces) for faces in expected)]
+    assert [[(f["user_id"], f["confidence"], f["bbox"]) for f in faces] for faces in results] == \
+           [[(f["user_id"], f["confidence"], f["bbox"]) for f in faces] for faces in expected]
+    # Ngưỡng theo từng ảnh: ảnh cuối không đạt ngưỡng 101
+    assert all(face["user_id"] is None for face in results[2])
+    recognizer.close()
+
+
+def test_recognize_returns_504_when_batch_times_out(enrolled_dir, monkeypatch):
+    original = FaceRecognizer.recognize_images
+
+    def slow_recognize_images(self, *args, **kwargs):
+        time.sleep(0.5)
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(FaceRecognizer, "recognize_images", slow_recognize_images)
+    app = create_app(CASCADE_PATH, workers=1, data_dir=enrolled_dir, request_timeout=0.05, reload_interval=0)
+    try:
+        response = app.test_client().post("/recognize", data=_encode("khiem2.jpg"))
+        assert response.status_code == 504
+        assert "error" in response.get_json()
+    finally:
+        app.config["BATCH_SCHEDULER"].close()
+        app.config["ADMIN_RECOGNIZER"].close()
+
+
+def test_recognize_endpoint(enrolled_dir):
+    app = create_app(CASCADE_PATH, workers=1, data_dir=enrolled_dir, reload_interval=0)
+    try:
+        response = app.test_client().post("/recognize?confidence=30", data=_encode("toan3.jpg"))
+        assert response.status_code == 200
+        assert [face["user_id"] for face in response.get_json()["recognized"]] == ["toan"]
+    finally:
+        app.config["BATCH_SCHEDULER"].close()
+        app.config["ADMIN_RECOGNIZER"].close()
@@ -0,0 +1,50 @@
+from user_store import UserStore
+
+
+def _user(name):
+    return {"name": name, "created_at": None, "last_recognized": None}
+
+
+def test_replace_users_keeps_users_added_by_another_writer(data_dir):
+    first, second = UserStore(data_dir), UserStore(data_dir)
+    try:
+        first.save_users({"a": _user("A"), "old": _user("Old")})
+        users = first.all_users()
+
+        second.save_users({"b": _user("B")})
+
+        users["a"]["name"] = "A2"
+        del users["old"]
+        first.replace_users(users)
+
+        assert set(second.all_users()) == {"a", "b"}
+        assert second.get_user("a")["name"] == "A2"
+    finally:
+        first.close()
+        second.close()
+
+
+def test_model_state_writers_do_not_clobber_each_other(data_dir):
+    first, second = UserStore(data_dir), UserStore(data_dir)
+    try:
+        first.save_model_state({"label_to_user": {"0": "a"}, "next_label": 1, "tombstones": {}, "sample_count": 2})
+        states = [first.load_model_state(), second.load_model_state()]
+
+        # Mỗi tiến trình thêm một người dùng từ bản trạng thái đã đọc
+        versions = []
+        for store, state, user_id in zip((first, second), states, ("b", "c")):
+            label = str(store.allocate_label(state["next_label"]))
+            state["label_to_user"][label] = user_id
+            state["next_label"] = int(label) + 1
+            state["sample_count"] += 3
+            versions.append(store.save_model_state(state))
+
+        state = first.load_model_state()
+        assert sorted(state["label_to_user"].values()) == ["a", "b", "c"]
+        assert len(state["label_to_user"]) == 3
+        assert state["sample_count"] == 8
+        assert versions == [2, 3]
+        assert state["model_version"] == 3
+    finally:
+        first.close()
+        second.close()
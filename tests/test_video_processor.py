@@ -0,0 +1,74 @@
+import pytest
+
+from video_processor import iter_frames, plan_segments
+
+
+class _FakeCapture:
+    """VideoCapture giả: khung thứ i là số i; seekable=False mô phỏng video không tua được"""
+
+    def __init__(self, frame_count, seekable=True):
+        self.frame_count = frame_count
+        self.seekable = seekable
+        self.position = 0
+        self.reads = 0
+
+    def set(self, prop, value):
+        if not self.seekable:
+            return False
+        self.position = int(value)
+        return True
+
+    def grab(self):
+        if self.position >= self.frame_count:
+            return False
+        self.position += 1
+        return True
+
+    def read(self):
+        if self.position >= self.frame_count:
+            return False, None
+        self.reads += 1
+        self.position += 1
+        return True, self.position - 1
+
+
+@pytest.mark.parametrize("frame_count, fps, stride, segment_seconds, workers", [
+    (1000, 25, 1, 10, 1),
+    (1000, 25, 3, 10, 1),
+    (1001, 30, 7, 5, 4),
+    (50, 25, 4, 60, 8),
+    (10, 25, 25, 60, 2),
+])
+def test_segments_sample_the_same_frames_as_a_single_pass(frame_count, fps, stride, segment_seconds, workers):
+    segments = plan_segments(frame_count, fps, stride, segment_seconds, workers)
+
+    # Các đoạn liên tiếp, phủ đúng [0, frame_count), biên là bội số của stride
+    assert [i for i, _, _ in segments] == list(range(len(segments)))
+    assert segments[0][1] == 0 and segments[-1][2] == frame_count
+    assert all(end == next_start for (_, _, end), (_, next_start, _) in zip(segments, segments[1:]))
+    assert all(start % stride == 0 for _, start, _ in segments)
+
+    sampled = []
+    for _, start, end in segments:
+        sampled += [index for index, _ in iter_frames(_FakeCapture(frame_count), start, end, stride)]
+    assert sampled == list(range(0, frame_count, stride))
+
+
+def test_short_video_is_split_for_every_worker():
+    segments = plan_segments(100, 25, stride=2, segment_seconds=60, workers=4)
+    assert len(segments) == 4
+    assert [start for _, start, _ in segments] == [0, 26, 52, 78]
+
+
+def test_unknown_frame_count_is_one_open_segment():
+    assert plan_segments(0, 25, stride=3, workers=4) == [(0, 0, None)]
+    cap = _FakeCapture(10)
+    assert [index for index, _ in iter_frames(cap, 0, None, 3)] == [0, 3, 6, 9]
+
+
+def test_iter_frames_skips_to_start_when_video_cannot_seek():
+    cap = _FakeCapture(20, seekable=False)
+    frames = list(iter_frames(cap, 8, 15, stride=3))
+    assert frames == [(8, 8), (11, 11), (14, 14)]
+    # Khung bị bỏ qua chỉ được grab(), không giải mã
+    assert cap.reads == 3